@@ -0,0 +1,120 @@
+# benchmarks/history_with_ma.py
+"""
+对比 get_history_with_ma 的两种实现在长历史 (默认每只基金 5000 条净值) 上的耗时：
+- orm: 原实现，逐行构造 NavHistory ORM 对象，float(Decimal) 组装列表，pd.to_datetime 后逐个窗口 rolling
+- core: 现实现，Core select (nav_date, nav::float8) 直接填入 NumPy 数组，一次累加和计算全部均线
+
+在 DATABASE_URL 指向的数据库中创建临时 schema，通过 schema_translate_map 让两种实现都读取其中的模拟数据，结束后删除。
+用法:
+    uv run python benchmarks/history_with_ma.py --funds 20 --rows 5000 --repeat 5
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from python_cli_starter import models, services
+from python_cli_starter.models import NavHistory, DB_SCHEMA
+from python_cli_starter.nav_cache import nav_cache
+from python_cli_starter import nav_archive
+
+BENCH_SCHEMA = "history_bench"
+MA_OPTIONS = [5, 10, 20, 60, 120, 250]
+
+
+def orm_history_with_ma(db: Session, code: str, ma_options) -> pd.DataFrame:
+    """优化前的实现 (用于对比)。"""
+    records = db.query(NavHistory).filter(NavHistory.code == code).order_by(NavHistory.nav_date).all()
+    df = pd.DataFrame([(record.nav_date, float(record.nav)) for record in records], columns=['date', 'nav'])
+    df['date'] = pd.to_datetime(df['date'])
+    for ma in ma_options:
+        df[f'ma{ma}'] = df['nav'].rolling(window=ma).mean()
+    return df
+
+
+def core_history_with_ma(db: Session, code: str, ma_options) -> pd.DataFrame:
+    # 每次都清空缓存，测量的是从数据库读取的路径
+    nav_cache.invalidate(code)
+    return services.get_history_with_ma(db, code, ma_options=ma_options)
+
+
+def create_data(engine, funds: int, rows: int):
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {BENCH_SCHEMA}"))
+        conn.execute(text(f"CREATE TABLE {BENCH_SCHEMA}.fund_nav_history (LIKE {DB_SCHEMA}.fund_nav_history INCLUDING ALL)"))
+        conn.execute(text(f"""
+            INSERT INTO {BENCH_SCHEMA}.fund_nav_history (code, nav_date, nav)
+            SELECT lpad(f::text, 6, '0'), current_date - d, round((1 + random())::numeric, 4)
+            FROM generate_series(1, :funds) AS f, generate_series(1, :rows) AS d
+        """), {"funds": funds, "rows": rows})
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"VACUUM ANALYZE {BENCH_SCHEMA}.fund_nav_history"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="get_history_with_ma: ORM 实现与 Core + NumPy 实现的耗时对比")
+    parser.add_argument("--funds", type=int, default=20, help="模拟的基金数")
+    parser.add_argument("--rows", type=int, default=5000, help="每只基金的净值条数")
+    parser.add_argument("--repeat", type=int, default=5, help="每只基金重复执行的次数")
+    args = parser.parse_args()
+
+    # 只测量数据库路径，不使用净值归档
+    nav_archive.NAV_ARCHIVE_DIR = ""
+    engine = models.engine.execution_options(schema_translate_map={DB_SCHEMA: BENCH_SCHEMA})
+    create_data(models.engine, args.funds, args.rows)
+    codes = [f"{i:06d}" for i in range(1, args.funds + 1)]
+
+    try:
+        with Session(engine) as db:
+            # 结果一致性检查
+            expected = orm_history_with_ma(db, codes[0], MA_OPTIONS)
+            actual = core_history_with_ma(db, codes[0], MA_OPTIONS)
+            pd.testing.assert_frame_equal(expected, actual, check_exact=False, rtol=1e-9)
+
+            timings = {}
+            for name, func in (("orm", orm_history_with_ma), ("core", core_history_with_ma)):
+                samples = []
+                for _ in range(args.repeat):
+                    for code in codes:
+                        started_at = time.perf_counter()
+                        func(db, code, MA_OPTIONS)
+                        samples.append((time.perf_counter() - started_at) * 1000)
+                timings[name] = samples
+
+            # 只比较计算部分 (不含数据库读取)
+            navs = np.asarray(expected['nav'], dtype=np.float64)
+            compute = {}
+            started_at = time.perf_counter()
+            for _ in range(args.repeat * len(codes)):
+                frame = pd.DataFrame({'nav': navs})
+                for ma in MA_OPTIONS:
+                    frame[f'ma{ma}'] = frame['nav'].rolling(window=ma).mean()
+            compute["orm"] = (time.perf_counter() - started_at) * 1000 / (args.repeat * len(codes))
+            started_at = time.perf_counter()
+            for _ in range(args.repeat * len(codes)):
+                services.moving_averages(navs, MA_OPTIONS)
+            compute["core"] = (time.perf_counter() - started_at) * 1000 / (args.repeat * len(codes))
+    finally:
+        with models.engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE"))
+
+    print(f"\n{args.funds} 只基金 × {args.rows} 条净值，均线 {MA_OPTIONS}，每只基金执行 {args.repeat} 次")
+    print(f"{'实现':<8}{'p50 (ms)':>12}{'p95 (ms)':>12}{'均线计算 (ms)':>16}")
+    for name, samples in timings.items():
+        samples.sort()
+        p95 = samples[int(len(samples) * 0.95) - 1]
+        print(f"{name:<8}{statistics.median(samples):>12.2f}{p95:>12.2f}{compute[name]:>16.3f}")
+    print(f"加速比 (p50): {statistics.median(timings['orm']) / statistics.median(timings['core']):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# benchmarks/nav_range_query.py
+"""
+对比 fund_nav_history 两种存储方式的区间查询延迟：
+- heap: 现有的普通表 (联合主键 + code、nav_date 两个单列 B-tree 索引)
+- partitioned: 按年分区 (NAV_PARTITIONING=range)，nav_date 上 BRIN 索引 + (code, nav_date) INCLUDE (nav) 覆盖索引
+
+两种结构都由 models.nav_history_table 和 models.ensure_nav_partitions 创建，与应用实际使用的表、索引和分区一致。
+在 DATABASE_URL 指向的数据库中为每种结构创建一个临时 schema，用 generate_series 生成模拟数据，结束后删除。
+用法:
+    uv run python benchmarks/nav_range_query.py --funds 2000 --years 20 --repeat 200
+    uv run python benchmarks/nav_range_query.py --insert-order date   # 模拟长期按日增量写入后的物理顺序
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import MetaData, text
+
+from python_cli_starter import models
+
+BENCH_SCHEMA = "nav_bench"
+# 存储方式 -> 是否分区
+LAYOUTS = {"heap": False, "partitioned": True}
+
+
+def layout_table(layout: str) -> str:
+    return f"{BENCH_SCHEMA}_{layout}.{models.NavHistory.__tablename__}"
+
+
+def drop_layouts(conn):
+    for layout in LAYOUTS:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA}_{layout} CASCADE"))
+
+
+def create_layouts(conn, funds: int, years: int, start_year: int, insert_order: str):
+    drop_layouts(conn)
+    for layout, partitioned in LAYOUTS.items():
+        schema = f"{BENCH_SCHEMA}_{layout}"
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+        table = models.nav_history_table(MetaData(schema=schema), partitioned)
+        table.create(bind=conn)
+        if partitioned:
+            models.ensure_nav_partitions(conn, start_year=start_year, end_year=start_year + years, table=table)
+
+    # code: 与首次回填一致，逐只基金按日期升序写入；date: 与日常增量同步一致，每天写入所有基金的一行。
+    # 行的物理顺序决定了 BRIN 索引的效果 (只保留工作日)
+    start, end = date(start_year, 1, 1), date(start_year + years, 12, 31)
+    order_by = "1, 2" if insert_order == "code" else "2, 1"
+    for layout in LAYOUTS:
+        started_at = time.perf_counter()
+        conn.execute(text(f"""
+            INSERT INTO {layout_table(layout)} (code, nav_date, nav)
+            SELECT lpad(f::text, 6, '0'), d::date, round((1 + random())::numeric, 4)
+            FROM generate_series(1, :funds) AS f,
+                 generate_series(CAST(:start AS date), CAST(:end AS date), interval '1 day') AS d
+            WHERE extract(isodow FROM d) < 6
+            ORDER BY {order_by}
+        """), {"funds": funds, "start": start, "end": end})
+        print(f"写入 {layout}: {time.perf_counter() - started_at:.1f} 秒")
+
+
+def vacuum_analyze(engine):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for layout in LAYOUTS:
+            started_at = time.perf_counter()
+            conn.execute(text(f"VACUUM ANALYZE {layout_table(layout)}"))
+            print(f"VACUUM ANALYZE {layout}: {time.perf_counter() - started_at:.1f} 秒")
+
+
+def relation_sizes(conn, layout: str) -> dict:
+    """表 (含全部分区) 的数据和索引大小 (MB)。"""
+    # pg_partition_tree 对普通表不返回任何行，因此再并上表本身
+    row = conn.execute(text(f"""
+        SELECT COALESCE(SUM(pg_table_size(relid)), 0), COALESCE(SUM(pg_indexes_size(relid)), 0)
+        FROM (
+            SELECT relid FROM pg_partition_tree('{layout_table(layout)}')
+            UNION SELECT '{layout_table(layout)}'::regclass
+        ) AS tree
+    """)).one()
+    return {"table_mb": row[0] / 2 ** 20, "index_mb": row[1] / 2 ** 20}
+
+
+def time_query(conn, sql: str, params_list: list) -> dict:
+    timings = []
+    for params in params_list:
+        started_at = time.perf_counter()
+        conn.execute(text(sql), params).fetchall()
+        timings.append((time.perf_counter() - started_at) * 1000)
+    timings.sort()
+    return {
+        "p50": statistics.median(timings),
+        "p95": timings[int(len(timings) * 0.95) - 1],
+        "mean": statistics.fmean(timings),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fund_nav_history 普通表与分区表的区间查询延迟对比")
+    parser.add_argument("--funds", type=int, default=1000, help="模拟的基金数")
+    parser.add_argument("--years", type=int, default=20, help="每只基金的历史年数")
+    parser.add_argument("--repeat", type=int, default=200, help="每种查询的执行次数")
+    parser.add_argument("--insert-order", choices=["code", "date"], default="code",
+                        help="模拟数据的写入顺序：code 为按基金回填，date 为按日增量同步")
+    parser.add_argument("--keep", action="store_true", help="结束后保留临时 schema")
+    args = parser.parse_args()
+
+    engine = models.engine
+    start_year = date.today().year - args.years
+    rng = random.Random(42)
+
+    with engine.begin() as conn:
+        create_layouts(conn, args.funds, args.years, start_year, args.insert_order)
+    vacuum_analyze(engine)
+
+    codes = [f"{rng.randint(1, args.funds):06d}" for _ in range(args.repeat)]
+    def random_window(days: int) -> dict:
+        begin = date(start_year, 1, 1) + timedelta(days=rng.randint(0, args.years * 365 - days))
+        return {"start": begin, "end": begin + timedelta(days=days)}
+
+    # 三类典型查询：单只基金一年 (图表/均线)、单只基金全部历史 (策略/缓存加载)、全部基金某一周 (按日期扫描)
+    queries = {
+        "单只基金 1 年": (
+            "SELECT nav_date, nav FROM {table} WHERE code = :code AND nav_date BETWEEN :start AND :end ORDER BY nav_date",
+            [dict(code=code, **random_window(365)) for code in codes],
+        ),
+        "单只基金全部历史": (
+            "SELECT nav_date, nav FROM {table} WHERE code = :code ORDER BY nav_date",
+            [{"code": code} for code in codes],
+        ),
+        "全部基金 1 周": (
+            "SELECT code, count(*), avg(nav) FROM {table} WHERE nav_date BETWEEN :start AND :end GROUP BY code",
+            [random_window(7) for _ in range(max(10, args.repeat // 10))],
+        ),
+    }
+
+    try:
+        with engine.connect() as conn:
+            print(f"\n数据量: {args.funds} 只基金 × {args.years} 年，写入顺序: {args.insert_order}")
+            for layout in LAYOUTS:
+                sizes = relation_sizes(conn, layout)
+                print(f"{layout:>11}: 表 {sizes['table_mb']:.1f} MB, 索引 {sizes['index_mb']:.1f} MB")
+
+            print(f"\n{'查询':<12}{'存储':>12}{'p50 (ms)':>12}{'p95 (ms)':>12}{'mean (ms)':>12}")
+            for name, (sql, params_list) in queries.items():
+                for layout in LAYOUTS:
+                    # 预热一次，避免首次执行的计划缓存和冷缓存影响结果
+                    conn.execute(text(sql.format(table=layout_table(layout))), params_list[0]).fetchall()
+                    stats = time_query(conn, sql.format(table=layout_table(layout)), params_list)
+                    print(f"{name:<12}{layout:>12}{stats['p50']:>12.2f}{stats['p95']:>12.2f}{stats['mean']:>12.2f}")
+    finally:
+        if not args.keep:
+            with engine.begin() as conn:
+                drop_layouts(conn)
+
+
+if __name__ == "__main__":
+    main()
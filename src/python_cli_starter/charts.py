@@ -1,44 +1,40 @@
 # src/python_cli_starter/charts.py (修改后)
 
-import akshare as ak
 import pandas as pd
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+import hashlib
 import logging
+import os
+import threading
 import numpy as np
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
+
+from . import nav_source, indicators, downsample
 
 logger = logging.getLogger(__name__)
 
+# 在内存中保留 RSI 图表状态的基金数，增量请求 (since) 和新增净值后的请求只需计算新增的日期
+CHART_STATE_MAX_FUNDS = int(os.getenv("CHART_STATE_MAX_FUNDS", "256"))
+
 # --- RSI 策略默认参数 ---
 RSI_PERIOD = 14
 RSI_UPPER = 70.0
 RSI_LOWER = 30.0
 
 def get_historical_fund_data(fund_symbol: str) -> Optional[pd.DataFrame]:
-    """获取指定基金的全部历史净值数据。"""
+    """获取指定基金的全部历史净值数据 (优先读取本地数据库)。"""
     logger.info(f"[Charts] 正在为基金 {fund_symbol} 获取全部历史净值数据...")
-    try:
-        fund_nav_df = ak.fund_open_fund_info_em(symbol=fund_symbol, indicator="单位净值走势")
-        fund_nav_df['净值日期'] = pd.to_datetime(fund_nav_df['净值日期'])
-        fund_nav_df = fund_nav_df.set_index('净值日期')
-        fund_nav_df = fund_nav_df[['单位净值']]
-        fund_nav_df.columns = ['close']
-        fund_nav_df['close'] = pd.to_numeric(fund_nav_df['close'])
-        
-        # 按日期升序排序
-        fund_nav_df = fund_nav_df.sort_index(ascending=True)
-
-        if fund_nav_df.empty:
-            logger.warning(f"获取基金 {fund_symbol} 数据为空。")
-            return None
-            
-        logger.info(f"数据获取成功！共获取 {len(fund_nav_df)} 条记录。")
-        return fund_nav_df
-        
-    except Exception as e:
-        logger.error(f"获取基金 {fund_symbol} 数据时发生错误: {e}")
+    fund_nav_df = nav_source.get_nav_dataframe(fund_symbol)
+
+    if fund_nav_df is None or fund_nav_df.empty:
+        logger.warning(f"获取基金 {fund_symbol} 数据为空。")
         return None
 
+    logger.info(f"数据获取成功！共获取 {len(fund_nav_df)} 条记录。")
+    return fund_nav_df
+
 def calculate_rsi(data: pd.DataFrame, period: int) -> pd.DataFrame:
     """计算 RSI 指标。"""
     delta = data['close'].diff()
@@ -50,44 +46,154 @@ def calculate_rsi(data: pd.DataFrame, period: int) -> pd.DataFrame:
     data['rsi'] = 100 - (100 / (1 + rs))
     return data
 
-def generate_rsi_signals(data: pd.DataFrame) -> pd.DataFrame:
-    """根据RSI指标生成买卖信号。"""
+def _scan_rsi_signals(dates, rsi: np.ndarray, start: int, position: int) -> Tuple[List[Dict[str, Any]], int]:
+    """从下标 start 开始按 RSI 上下穿阈值生成买卖信号，position 为扫描前的持仓状态，返回 (信号列表, 扫描后的持仓状态)。"""
     signals = []
-    position = 0
-    data['prev_rsi'] = data['rsi'].shift(1)
-    
-    for i in range(RSI_PERIOD, len(data)):
-        current_rsi = data['rsi'].iloc[i]
-        prev_rsi = data['prev_rsi'].iloc[i]
-        current_date = data.index[i]
-
-        if pd.isna(current_rsi) or pd.isna(prev_rsi):
+    for i in range(max(start, RSI_PERIOD), len(rsi)):
+        current_rsi, prev_rsi = rsi[i], rsi[i - 1]
+        if np.isnan(current_rsi) or np.isnan(prev_rsi):
             continue
 
         if position == 0 and current_rsi <= RSI_LOWER and prev_rsi > RSI_LOWER:
-            signals.append({'date': current_date, 'type': 'buy', 'rsi': current_rsi})
+            signals.append({'date': dates[i], 'type': 'buy', 'rsi': current_rsi})
             position = 1
         elif position == 1 and current_rsi >= RSI_UPPER and prev_rsi < RSI_UPPER:
-            signals.append({'date': current_date, 'type': 'sell', 'rsi': current_rsi})
+            signals.append({'date': dates[i], 'type': 'sell', 'rsi': current_rsi})
             position = 0
-    return pd.DataFrame(signals)
+    return signals, position
+
+@dataclass(frozen=True)
+class _RsiChartState:
+    """一只基金完整的 RSI 图表数据，以及继续递推 RSI 和信号所需的状态 (最后一天的平均涨幅/跌幅、持仓状态)。"""
+    frame: pd.DataFrame  # 以日期为索引，包含 close、rsi 两列
+    signals: List[Dict[str, Any]]
+    gain: float
+    loss: float
+    position: int
+
 
-def get_rsi_chart_data(fund_code: str) -> Optional[Dict[str, Any]]:
+# 基金代码 -> 最近一次生成的 RSI 图表状态，按最近最少使用淘汰
+_chart_states: "OrderedDict[str, _RsiChartState]" = OrderedDict()
+_chart_states_lock = threading.Lock()
+
+
+
+def _data_version(frame: pd.DataFrame, until: Optional[pd.Timestamp] = None) -> str:
     """
-    为RSI策略生成 ECharts 所需的图表数据 (全部历史)。
+    图表数据 (until 当天及之前的部分) 的版本号：行数加上日期和净值的摘要。
+    只由数据本身决定，与进程和缓存无关；之前的净值被补写、修正或删除时才会变化，末尾追加新日期不影响已有前缀的版本号。
+    """
+    if until is not None:
+        frame = frame[frame.index <= until]
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(frame.index.values.astype('datetime64[D]').tobytes())
+    digest.update(frame['close'].to_numpy(dtype=np.float64).tobytes())
+    return f"{len(frame)}-{digest.hexdigest()}"
+
+
+def _build_chart_state(fund_code: str, df_full: pd.DataFrame) -> _RsiChartState:
+    """在全部历史上计算 RSI 和买卖信号。"""
+    # 优先使用同步后预计算的 RSI，尚未计算时现场计算
+    df_with_rsi = indicators.attach_indicators(fund_code, df_full, {'rsi': indicators.rsi_key(RSI_PERIOD)})
+    if df_with_rsi is None:
+        df_with_rsi = calculate_rsi(df_full, period=RSI_PERIOD)
+    # 在序列化之前，将所有 Inf, -Inf 替换为 NaN (JSON中的null)
+    df_with_rsi = df_with_rsi[['close', 'rsi']].replace([np.inf, -np.inf], np.nan)
+
+    # 与 calculate_rsi 相同的平均涨幅/跌幅，增量更新时从最后一天继续递推
+    delta = df_with_rsi['close'].diff()
+    gain = delta.clip(lower=0).ewm(com=RSI_PERIOD - 1, adjust=False).mean().iloc[-1]
+    loss = (-1 * delta.clip(upper=0)).ewm(com=RSI_PERIOD - 1, adjust=False).mean().iloc[-1]
+
+    signals, position = _scan_rsi_signals(df_with_rsi.index, df_with_rsi['rsi'].to_numpy(dtype=np.float64), 0, 0)
+    return _RsiChartState(frame=df_with_rsi, signals=signals, gain=gain, loss=loss, position=position)
+
+
+def _extend_chart_state(state: _RsiChartState, new_rows: pd.DataFrame) -> _RsiChartState:
+    """只为新增的净值日期递推 RSI 并继续扫描信号，不重新计算已有的历史。"""
+    closes = new_rows['close'].to_numpy(dtype=np.float64)
+    rsi = np.full(len(closes), np.nan)
+    gain, loss = state.gain, state.loss
+    prev_close = state.frame['close'].iloc[-1]
+    alpha = 1 / RSI_PERIOD  # 与 ewm(com=RSI_PERIOD - 1) 相同
+    for i, close in enumerate(closes):
+        delta, prev_close = close - prev_close, close
+        gain = gain + alpha * (max(delta, 0.0) - gain) if pd.notna(gain) else max(delta, 0.0)
+        loss = loss + alpha * (max(-delta, 0.0) - loss) if pd.notna(loss) else max(-delta, 0.0)
+        if loss > 0:
+            rsi[i] = 100 - 100 / (1 + gain / loss)
+        elif gain > 0:
+            rsi[i] = 100.0
+
+    frame = pd.concat([state.frame, pd.DataFrame({'close': closes, 'rsi': rsi}, index=new_rows.index)])
+    new_signals, position = _scan_rsi_signals(
+        frame.index, frame['rsi'].to_numpy(dtype=np.float64), len(state.frame), state.position
+    )
+    return _RsiChartState(frame=frame, signals=state.signals + new_signals, gain=gain, loss=loss, position=position)
+
+
+def _get_chart_state(fund_code: str) -> Optional[_RsiChartState]:
+    """
+    返回基金最新的 RSI 图表状态。缓存的状态与当前净值的前缀一致时只为新增的日期增量计算，
+    历史净值有变化 (补写、修正或被删除) 时在全部历史上重新计算。
     """
     df_full = get_historical_fund_data(fund_code)
     if df_full is None or df_full.empty:
         return None
 
-    df_with_rsi = calculate_rsi(df_full, period=RSI_PERIOD)
-    
-    signals_df = generate_rsi_signals(df_with_rsi)
+    with _chart_states_lock:
+        state = _chart_states.get(fund_code)
+    count = len(state.frame) if state is not None else 0
+    if state is not None and len(df_full) >= count \
+            and df_full.index[:count].equals(state.frame.index) \
+            and np.array_equal(df_full['close'].to_numpy()[:count], state.frame['close'].to_numpy()):
+        if len(df_full) > count:
+            state = _extend_chart_state(state, df_full.iloc[count:])
+    else:
+        state = _build_chart_state(fund_code, df_full)
+
+    with _chart_states_lock:
+        _chart_states[fund_code] = state
+        _chart_states.move_to_end(fund_code)
+        while len(_chart_states) > CHART_STATE_MAX_FUNDS:
+            _chart_states.popitem(last=False)
+    return state
+
+
+def get_rsi_chart_data(fund_code: str, max_points: Optional[int] = None,
+                       since: Optional[date] = None, version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    为RSI策略生成 ECharts 所需的图表数据 (全部历史)。
+    指定 since 时只返回该日期之后的日期、数值和信号 (增量模式)，前端把上次响应中的 latestDate 和 version 传回即可。
+    同时传入 version 时先核对 since 及之前的数据：与当前数据的版本不一致 (之前的净值被补写、修正或删除) 时
+    返回完整数据并标记 reset，前端应整体替换已有数据。
+    指定 max_points 时按净值和 RSI 两条曲线 (LTTB) 降采样，买卖信号所在的日期优先保留，返回的日期数不超过 max_points。
+    """
+    state = _get_chart_state(fund_code)
+    if state is None:
+        return None
+
+    df_with_rsi, signals = state.frame, state.signals
+    latest_date = df_with_rsi.index[-1].strftime('%Y-%m-%d')
+    reset = since is not None and version is not None and version != _data_version(df_with_rsi, pd.Timestamp(since))
+    if reset:
+        since = None
+    if since is not None:
+        since_ts = pd.Timestamp(since)
+        df_with_rsi = df_with_rsi[df_with_rsi.index > since_ts]
+        signals = [signal for signal in signals if signal['date'] > since_ts]
 
-    # --- 核心修改在这里 ---
-    # 在序列化之前，将所有 NaN, Inf, -Inf 替换为 None (JSON中的null)
-    df_with_rsi.replace([np.inf, -np.inf], np.nan, inplace=True)
-    df_with_rsi.fillna(value=np.nan, inplace=True) # 确保所有缺失值都是 np.nan
+    total_points = len(df_with_rsi)
+    if max_points and total_points > max_points:
+        # 信号和 RSI 都在全部数据上算完后再降采样，信号点的坐标不受影响
+        keep = df_with_rsi.index.get_indexer([signal['date'] for signal in signals])
+        indices = downsample.downsample_indices(
+            df_with_rsi.index.values.astype('datetime64[D]').astype(np.int64),
+            [df_with_rsi['close'].to_numpy(dtype=np.float64), df_with_rsi['rsi'].to_numpy(dtype=np.float64)],
+            max_points,
+            keep=[i for i in keep if i >= 0],
+        )
+        df_with_rsi = df_with_rsi.iloc[indices]
 
     # 准备 ECharts 数据
     dates = df_with_rsi.index.strftime('%Y-%m-%d').tolist()
@@ -99,18 +205,17 @@ def get_rsi_chart_data(fund_code: str) -> Optional[Dict[str, Any]]:
     # 准备买卖信号点数据
     buy_signals = []
     sell_signals = []
-    if not signals_df.empty:
-        for _, row in signals_df.iterrows():
-            # 同样要检查信号点上的rsi值是否为nan
-            if pd.notna(row['rsi']):
-                signal_point = {
-                    'coord': [row['date'].strftime('%Y-%m-%d'), round(row['rsi'], 2)],
-                    'value': '买入' if row['type'] == 'buy' else '卖出'
-                }
-                if row['type'] == 'buy':
-                    buy_signals.append(signal_point)
-                else:
-                    sell_signals.append(signal_point)
+    for signal in signals:
+        # 同样要检查信号点上的rsi值是否为nan
+        if pd.notna(signal['rsi']):
+            signal_point = {
+                'coord': [signal['date'].strftime('%Y-%m-%d'), round(signal['rsi'], 2)],
+                'value': '买入' if signal['type'] == 'buy' else '卖出'
+            }
+            if signal['type'] == 'buy':
+                buy_signals.append(signal_point)
+            else:
+                sell_signals.append(signal_point)
 
     return {
         "dates": dates,
@@ -120,9 +225,14 @@ def get_rsi_chart_data(fund_code: str) -> Optional[Dict[str, Any]]:
             "buy": buy_signals,
             "sell": sell_signals
         },
+        "since": since.isoformat() if since is not None else None,
+        "latestDate": latest_date,
+        "version": _data_version(state.frame),
+        "reset": reset,
         "config": {
             "rsiPeriod": RSI_PERIOD,
             "rsiUpper": RSI_UPPER,
-            "rsiLower": RSI_LOWER
+            "rsiLower": RSI_LOWER,
+            "totalPoints": total_points
         }
-    }
\ No newline at end of file
+    }
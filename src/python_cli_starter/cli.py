@@ -1,16 +1,19 @@
 # cli.py
 import typer
-from typing import Optional
+from typing import Optional, List
 import json
 from rich.console import Console
 from rich.table import Table
 from pathlib import Path
 import logging
+import time
 
 from .logger_config import setup_logging
 from .models import SessionLocal
-from . import services, schemas
+from . import models
+from . import services, schemas, data_fetcher, indicators, nav_archive
 from .scheduler import update_all_nav_history, update_today_estimate
+from . import crud
 from .crud import get_holdings 
 
 # 将Typer实例命名为 cli_app，以示区分
@@ -130,19 +133,226 @@ def list_holdings_command():
     finally:
         db.close()
 
+@cli_app.command(name="show-estimates")
+def show_estimates_command(
+    codes: Optional[List[str]] = typer.Argument(None, help="要查询的基金代码，可传多个；不传则查询全部持仓基金。"),
+    no_cache: bool = typer.Option(False, "--no-cache", help="跳过进程内缓存，强制从网络获取。")
+):
+    """并发查询一批基金的实时估值（不写入数据库）。"""
+    logger.info(f"开始执行 show-estimates 命令, codes: {codes}")
+    db = SessionLocal()
+    try:
+        if not codes:
+            codes = [holding.code for holding in get_holdings(db, limit=None)]
+        if not codes:
+            console.print("🤷‍ 您当前没有任何持仓记录，请直接指定要查询的基金代码。")
+            return
+
+        started_at = time.perf_counter()
+        estimates = data_fetcher.fetch_fund_realtime_estimates(codes, use_cache=not no_cache)
+        elapsed = time.perf_counter() - started_at
+
+        table = Table(title="基金实时估值", caption=f"共 {len(estimates)} 只基金，耗时 {elapsed:.2f} 秒", show_header=True, header_style="bold magenta")
+        table.add_column("代码 (Code)", style="dim", width=12)
+        table.add_column("名称 (Name)", min_width=20)
+        table.add_column("净值日期", justify="right")
+        table.add_column("单位净值 (NAV)", justify="right")
+        table.add_column("今日估值 (Estimate)", justify="right")
+        table.add_column("估算涨跌幅 (%)", justify="right")
+        table.add_column("估值更新时间", justify="right", style="dim")
+
+        for code, data in estimates.items():
+            if not data:
+                table.add_row(code, "[bold red]获取失败[/bold red]", "-", "-", "-", "-", "-")
+                continue
+            pct_str = data.get('gszzl', '-')
+            try:
+                pct = float(pct_str)
+                color = "bold red" if pct > 0 else "bold green" if pct < 0 else "white"
+                pct_str = f"[{color}]{pct:+.2f}%[/{color}]"
+            except (ValueError, TypeError):
+                pass
+            table.add_row(code, data.get('name', '-'), data.get('jzrq', '-'), data.get('dwjz', '-'),
+                          data.get('gsz', '-'), pct_str, data.get('gztime', '-'))
+
+        console.print(table)
+    except Exception as e:
+        logger.exception("在 show-estimates 命令中发生未知错误。")
+        console.print(f"[bold red]查询实时估值时发生错误: {e}[/bold red]")
+    finally:
+        db.close()
+
 @cli_app.command(name="sync-history")
-def sync_history_command():
+def sync_history_command(
+    estimate: bool = typer.Option(True, "--estimate/--no-estimate", help="是否刷新今日盘中估值"),
+    history: bool = typer.Option(True, "--history/--no-history", help="是否同步历史净值并校准持仓金额"),
+    workers: Optional[int] = typer.Option(None, "--workers", "-w", min=1, help="并发抓取的基金数，默认取环境变量 SYNC_WORKERS"),
+    resume: bool = typer.Option(False, "--resume", help="续跑最近一次中断的同步任务，跳过其中已完成的基金"),
+    only_failed: bool = typer.Option(False, "--only-failed", help="只重试最近一次同步任务中失败的基金，其余未完成的基金暂缓到下次 --resume"),
+    watchlist: Optional[bool] = typer.Option(None, "--watchlist/--no-watchlist", help="是否同时同步关注列表中的基金，默认取环境变量 SYNC_INCLUDE_WATCHLIST")
+):
     """手动触发一次全量/增量的历史净值同步任务。"""
     console.print("[bold yellow]🚀 开始手动执行历史净值同步任务...[/bold yellow]")
-    logger.info("开始执行 sync-history 命令。")
+    logger.info(f"开始执行 sync-history 命令, estimate: {estimate}, history: {history}, workers: {workers}, "
+                f"resume: {resume}, only_failed: {only_failed}, watchlist: {watchlist}")
     try:
-        update_today_estimate()
-        update_all_nav_history()
+        if estimate:
+            update_today_estimate()
+        if history:
+            report = update_all_nav_history(workers=workers, resume=resume, only_failed=only_failed,
+                                            include_watchlist=watchlist)
+            if report is not None:
+                console.print(f"   - 同步任务: #{report.run_id}")
+                console.print(f"   - 基金: {report.funds_total} 只，更新 {report.funds_updated} 只，失败 {report.funds_failed} 只")
+                console.print(f"   - 写入: {report.rows_written} 行，耗时 {report.elapsed_seconds:.2f} 秒")
+                console.print(f"   - 吞吐: {report.funds_per_second:.2f} 只/秒，{report.rows_per_second:.1f} 行/秒")
+                for result in report.results.values():
+                    if result.status == "failed":
+                        console.print(f"   [yellow]- 基金 {result.code} 同步失败: {result.error}[/yellow]")
         console.print("[bold green]✅ 同步任务执行完毕！[/bold green]")
     except Exception as e:
         logger.exception("在 sync-history 命令中发生未知错误。")
         console.print(f"[bold red]❌ 同步任务执行失败: {e}[/bold red]")
 
+@cli_app.command(name="sync-status")
+def sync_status_command():
+    """查看最近一次历史净值同步任务的进度 (按状态和节点汇总)。"""
+    db = SessionLocal()
+    try:
+        run = crud.get_latest_sync_run(db)
+        if run is None:
+            console.print("🤷‍ 还没有执行过历史净值同步任务。")
+            return
+
+        table = Table(title=f"同步任务 #{run.id} ({run.status})",
+                      caption=f"开始于 {run.started_at:%Y-%m-%d %H:%M:%S}，共 {run.funds_total} 只基金",
+                      show_header=True, header_style="bold magenta")
+        table.add_column("状态 (Status)")
+        table.add_column("节点 (Node)", style="dim")
+        table.add_column("基金数", justify="right")
+        table.add_column("已写入行数", justify="right")
+        for status, node, funds, rows in crud.get_sync_run_summary(db, run.id):
+            table.add_row(status, node or "-", str(funds), str(rows))
+        console.print(table)
+    except Exception as e:
+        logger.exception("在 sync-status 命令中发生未知错误。")
+        console.print(f"[bold red]查询同步任务进度时发生错误: {e}[/bold red]")
+    finally:
+        db.close()
+
+@cli_app.command(name="watch-add")
+def watch_add_command(
+    codes: List[str] = typer.Argument(..., help="要关注的基金代码，可传多个")
+):
+    """把基金加入关注列表，历史净值同步任务会保持它们的数据最新。"""
+    logger.info(f"开始执行 watch-add 命令, codes: {codes}")
+    db = SessionLocal()
+    try:
+        added, existed = services.add_to_watchlist(db, codes)
+        console.print(f"🎉 [bold green]关注列表已更新！[/bold green] 新增: {added}, 已在列表中: {existed}")
+    except Exception as e:
+        logger.exception("在 watch-add 命令中发生未知错误。")
+        console.print(f"[bold red]发生未知错误: {e}[/bold red]")
+    finally:
+        db.close()
+
+@cli_app.command(name="watch-remove")
+def watch_remove_command(
+    code: str = typer.Argument(..., help="要移出关注列表的基金代码")
+):
+    """把基金移出关注列表 (已同步的历史净值会保留)。"""
+    logger.info(f"开始执行 watch-remove 命令, code: {code}")
+    db = SessionLocal()
+    try:
+        services.remove_from_watchlist(db, code)
+        console.print(f"✅ 已将基金 [bold cyan]{code}[/bold cyan] 移出关注列表。")
+    except services.WatchlistNotFoundError as e:
+        console.print(f"[bold red]错误: {e}[/bold red]")
+    except Exception as e:
+        logger.exception(f"在 watch-remove 命令中发生未知错误, code: {code}")
+        console.print(f"[bold red]发生未知错误: {e}[/bold red]")
+    finally:
+        db.close()
+
+@cli_app.command(name="watch-list")
+def watch_list_command():
+    """查看关注列表 (按最近查询时间排序)。"""
+    db = SessionLocal()
+    try:
+        items = crud.get_watchlist(db)
+        if not items:
+            console.print("🤷‍ 关注列表为空，使用 `watch-add` 添加基金。")
+            return
+        table = Table(title="关注列表", caption=f"共 {len(items)} 只基金", show_header=True, header_style="bold magenta")
+        table.add_column("代码 (Code)", style="dim", width=12)
+        table.add_column("名称 (Name)", min_width=20)
+        table.add_column("加入时间", justify="right")
+        table.add_column("最近查询时间", justify="right", style="dim")
+        for item in items:
+            table.add_row(item.code, item.name or "-", f"{item.added_at:%Y-%m-%d %H:%M}",
+                          f"{item.last_queried_at:%Y-%m-%d %H:%M}" if item.last_queried_at else "-")
+        console.print(table)
+    except Exception as e:
+        logger.exception("在 watch-list 命令中发生未知错误。")
+        console.print(f"[bold red]查询关注列表时发生错误: {e}[/bold red]")
+    finally:
+        db.close()
+
+@cli_app.command(name="migrate-nav-partitions")
+def migrate_nav_partitions_command():
+    """把 fund_nav_history 迁移为按年分区的分区表 (需设置 NAV_PARTITIONING=range)。"""
+    logger.info("开始执行 migrate-nav-partitions 命令。")
+    console.print("[bold yellow]🚀 正在迁移 fund_nav_history，迁移期间该表会被锁定...[/bold yellow]")
+    try:
+        started_at = time.perf_counter()
+        migrated = models.migrate_nav_history_to_partitions()
+        models.create_db_and_tables()
+        console.print(f"[bold green]✅ 迁移完成！[/bold green] 共迁移 {migrated} 行，耗时 {time.perf_counter() - started_at:.2f} 秒。")
+    except ValueError as e:
+        console.print(f"[bold red]错误: {e}[/bold red]")
+    except Exception as e:
+        logger.exception("在 migrate-nav-partitions 命令中发生未知错误。")
+        console.print(f"[bold red]❌ 迁移失败，已回滚: {e}[/bold red]")
+
+@cli_app.command(name="rebuild-indicators")
+def rebuild_indicators_command(
+    codes: Optional[List[str]] = typer.Argument(None, help="要重新计算的基金代码，不传则为所有有净值的基金")
+):
+    """删除并重新计算基金的全部技术指标 (调整指标参数后使用，同步任务平时只做增量计算)。"""
+    logger.info(f"开始执行 rebuild-indicators 命令, codes: {codes}")
+    db = SessionLocal()
+    try:
+        started_at = time.perf_counter()
+        written = indicators.rebuild_indicators(db, codes or None)
+        db.commit()
+        console.print(f"[bold green]✅ 指标重新计算完成！[/bold green] 写入 {written} 行，耗时 {time.perf_counter() - started_at:.2f} 秒。")
+    except Exception as e:
+        db.rollback()
+        logger.exception("在 rebuild-indicators 命令中发生未知错误。")
+        console.print(f"[bold red]重新计算指标时发生错误: {e}[/bold red]")
+    finally:
+        db.close()
+
+@cli_app.command(name="build-nav-archive")
+def build_nav_archive_command(
+    codes: Optional[List[str]] = typer.Argument(None, help="要归档的基金代码，不传则为所有有净值的基金")
+):
+    """把基金的历史净值写入 NAV_ARCHIVE_DIR 下的内存映射归档 (同步任务平时会自动更新)。"""
+    logger.info(f"开始执行 build-nav-archive 命令, codes: {codes}")
+    if not nav_archive.enabled():
+        console.print("[bold red]错误: 请先设置环境变量 NAV_ARCHIVE_DIR。[/bold red]")
+        return
+    db = SessionLocal()
+    try:
+        started_at = time.perf_counter()
+        updated = nav_archive.refresh(db, codes or list(crud.get_latest_navs(db).keys()))
+        console.print(f"[bold green]✅ 归档完成！[/bold green] 更新 {updated} 只基金，耗时 {time.perf_counter() - started_at:.2f} 秒。")
+    except Exception as e:
+        logger.exception("在 build-nav-archive 命令中发生未知错误。")
+        console.print(f"[bold red]写入净值归档时发生错误: {e}[/bold red]")
+    finally:
+        db.close()
+
 @cli_app.command(name="update-holding")
 def update_holding_command(
     code: str = typer.Option(..., "--code", "-c", help="要更新的基金代码"),
@@ -1,7 +1,24 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import (select, update, insert, delete, values, column, func, exists, or_, and_, cast,
+                        String, Integer, Float, Numeric, DateTime, literal_column)
+from sqlalchemy.dialects.postgresql import insert as pg_insert, aggregate_order_by
 from fastapi import HTTPException
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+import csv
+import io
+import os
 from . import models, schemas, services
 
+# 单批净值记录超过该行数时改用 COPY 写入，否则使用多值 INSERT
+NAV_COPY_THRESHOLD = int(os.getenv("NAV_COPY_THRESHOLD", "1000"))
+# 多值 INSERT 每条语句的最大行数 (PostgreSQL 单条语句最多 65535 个绑定参数)
+NAV_INSERT_CHUNK_SIZE = 1000
+# 创建/加入同步任务时使用的事务级咨询锁编号，保证多个节点同时启动时只会创建一个任务
+SYNC_RUN_LOCK_KEY = 0x66756E64
+
 def get_holding(db: Session, fund_code: str):
     """根据基金代码查询单个持仓"""
     return db.query(models.Holding).filter(models.Holding.code == fund_code).first()
@@ -10,6 +27,11 @@ def get_holdings(db: Session, skip: int = 0, limit: int = 100):
     """查询所有持仓记录，支持分页"""
     return db.query(models.Holding).offset(skip).limit(limit).all()
 
+async def get_holdings_async(db: AsyncSession, skip: int = 0, limit: int = 100) -> List[models.Holding]:
+    """get_holdings 的异步版本，供 API 的异步路由使用"""
+    result = await db.execute(select(models.Holding).offset(skip).limit(limit))
+    return list(result.scalars().all())
+
 def create_holding(db: Session, holding: schemas.HoldingCreate) -> models.Holding:
     """
     (API层) 创建一个新的持仓记录。
@@ -32,6 +54,416 @@ def get_nav_history(db: Session, fund_code: str):
     return db.query(models.NavHistory).filter(models.NavHistory.code == fund_code).order_by(models.NavHistory.nav_date).all()
 
 
+def get_latest_navs(db: Session, codes: Optional[Iterable[str]] = None) -> Dict[str, Tuple[date, Decimal]]:
+    """
+    用一条 DISTINCT ON 查询取出每只基金最新的净值日期和单位净值。
+    :return: {基金代码: (最新净值日期, 最新单位净值)}，本地没有数据的基金不在结果中。
+    """
+    nav = models.NavHistory
+    stmt = (
+        select(nav.code, nav.nav_date, nav.nav)
+        .distinct(nav.code)
+        .order_by(nav.code, nav.nav_date.desc())
+    )
+    if codes is not None:
+        stmt = stmt.where(nav.code.in_(list(codes)))
+    return {row.code: (row.nav_date, row.nav) for row in db.execute(stmt)}
+
+def recalibrate_holdings(db: Session, codes: Optional[Iterable[str]] = None) -> int:
+    """
+    用一条 UPDATE ... FROM 语句，按各基金最新净值校准持仓：
+    yesterday_nav = 最新净值，holding_amount = 份额 × 最新净值。
+    codes 为 None 时校准全部持仓。不提交事务，返回被更新的持仓数。
+    """
+    nav = models.NavHistory
+    latest = (
+        select(nav.code, nav.nav)
+        .distinct(nav.code)
+        .order_by(nav.code, nav.nav_date.desc())
+    )
+    if codes is not None:
+        latest = latest.where(nav.code.in_(list(codes)))
+    latest = latest.subquery()
+
+    holding = models.Holding
+    stmt = (
+        update(holding)
+        .where(holding.code == latest.c.code)
+        .values(yesterday_nav=latest.c.nav, holding_amount=holding.shares * latest.c.nav)
+    )
+    return db.execute(stmt).rowcount
+
+def bulk_update_estimates(db: Session, rows: List[Dict[str, Any]]) -> int:
+    """
+    用一条 UPDATE ... FROM (VALUES ...) 语句批量写回盘中估值。
+    rows 为包含 code / today_estimate_nav / today_estimate_amount / percentage_change /
+    today_estimate_update_time 的字典列表。不提交事务，返回被更新的持仓数。
+    """
+    if not rows:
+        return 0
+    holding = models.Holding
+    updated = 0
+    for i in range(0, len(rows), NAV_INSERT_CHUNK_SIZE):
+        chunk = rows[i:i + NAV_INSERT_CHUNK_SIZE]
+        estimates = values(
+            column('code', String), column('nav', Float), column('amount', Numeric(12, 2)),
+            column('pct', Float), column('update_time', DateTime(timezone=True)),
+            name='estimates',
+        ).data([
+            (row['code'], row['today_estimate_nav'], row['today_estimate_amount'],
+             row['percentage_change'], row['today_estimate_update_time'])
+            for row in chunk
+        ])
+        stmt = (
+            update(holding)
+            .where(holding.code == estimates.c.code)
+            .values(
+                today_estimate_nav=estimates.c.nav, today_estimate_amount=estimates.c.amount,
+                percentage_change=estimates.c.pct, today_estimate_update_time=estimates.c.update_time,
+            )
+        )
+        updated += db.execute(stmt).rowcount
+    return updated
+
+def create_sync_run(db: Session, codes: List[str]) -> int:
+    """
+    创建一次历史净值同步任务及其逐只基金的进度行 (均为 pending)，codes 的顺序即领取顺序。
+    不提交事务，返回任务编号。
+    """
+    run_id = db.execute(
+        insert(models.SyncRun)
+        .values(status="running", started_at=func.now(), funds_total=len(codes))
+        .returning(models.SyncRun.id)
+    ).scalar_one()
+    if codes:
+        db.execute(insert(models.SyncRunItem), [
+            {'run_id': run_id, 'code': code, 'status': "pending", 'priority': priority}
+            for priority, code in enumerate(codes)
+        ])
+    return run_id
+
+def reopen_sync_run(db: Session, run_id: int):
+    """把已结束的同步任务重新标记为 running，以便续跑。不提交事务。"""
+    db.execute(update(models.SyncRun).where(models.SyncRun.id == run_id).values(status="running", finished_at=None))
+
+def get_latest_sync_run(db: Session) -> Optional[models.SyncRun]:
+    """返回最近一次同步任务 (status 仍为 running 说明该任务中途中断)。"""
+    return db.execute(select(models.SyncRun).order_by(models.SyncRun.id.desc()).limit(1)).scalars().first()
+
+def checkpoint_sync_items(db: Session, run_id: int, progress: List[Dict[str, Any]]) -> int:
+    """
+    用一条 UPDATE ... FROM (VALUES ...) 语句记录多只基金的同步进度。
+    progress 中每项包含 code / status / rows (本次新增的行数) / last_page / error。
+    不提交事务，调用方应与对应的净值写入放在同一事务中。
+    """
+    if not progress:
+        return 0
+    item = models.SyncRunItem
+    checkpoints = values(
+        column('code', String), column('status', String), column('rows', Integer),
+        column('last_page', Integer), column('error', String),
+        name='checkpoints',
+    ).data([(p['code'], p['status'], p['rows'], p['last_page'], p['error']) for p in progress])
+    stmt = (
+        update(item)
+        .where(item.run_id == run_id, item.code == checkpoints.c.code)
+        .values(
+            status=checkpoints.c.status, rows_written=item.rows_written + checkpoints.c.rows,
+            last_page=func.greatest(item.last_page, checkpoints.c.last_page),
+            error=checkpoints.c.error, updated_at=func.now(),
+        )
+    )
+    return db.execute(stmt).rowcount
+
+def lock_sync_runs(db: Session):
+    """获取事务级咨询锁，在当前事务提交或回滚前，其他节点无法同时创建/加入/结束同步任务。"""
+    db.execute(select(func.pg_advisory_xact_lock(SYNC_RUN_LOCK_KEY)))
+
+def sync_run_is_active(db: Session, run: models.SyncRun, lease_seconds: float) -> bool:
+    """任务仍为 running，且刚刚创建或有基金的租约尚未过期，说明有节点正在处理它。"""
+    if run.status != "running":
+        return False
+    item = models.SyncRunItem
+    recently_started = db.execute(
+        select(run.started_at > func.now() - timedelta(seconds=lease_seconds))
+    ).scalar_one()
+    if recently_started:
+        return True
+    return db.execute(
+        select(exists().where(item.run_id == run.id, item.status == "running", item.lease_until > func.now()))
+    ).scalar_one()
+
+def requeue_sync_items(db: Session, run_id: int, statuses: Iterable[str]) -> int:
+    """把指定状态的基金重新放回队列 (pending)。不提交事务，返回数量。"""
+    item = models.SyncRunItem
+    stmt = (
+        update(item)
+        .where(item.run_id == run_id, item.status.in_(list(statuses)))
+        .values(status="pending", claimed_by=None, lease_until=None, error=None, updated_at=func.now())
+    )
+    return db.execute(stmt).rowcount
+
+def defer_sync_items(db: Session, run_id: int) -> int:
+    """
+    把尚未完成的基金 (pending，以及中断时遗留的 running) 标记为 deferred，任何节点都不会领取它们，
+    用于只重试失败基金的续跑；之后普通续跑时会重新放回队列。不提交事务，返回数量。
+    """
+    item = models.SyncRunItem
+    stmt = (
+        update(item)
+        .where(item.run_id == run_id, item.status.in_(["pending", "running"]))
+        .values(status="deferred", claimed_by=None, lease_until=None, updated_at=func.now())
+    )
+    return db.execute(stmt).rowcount
+
+def claim_sync_items(db: Session, run_id: int, node_id: str, limit: int, lease_seconds: float) -> List[str]:
+    """
+    用 SELECT ... FOR UPDATE SKIP LOCKED 领取最多 limit 只待同步的基金 (pending，或租约已过期的 running)，
+    并标记为本节点持有、设置租约。多个节点并发领取时互不重叠，也不会互相等待。
+    不提交事务，返回领取到的基金代码。
+    """
+    item = models.SyncRunItem
+    claimable = (
+        select(item.code)
+        .where(
+            item.run_id == run_id,
+            or_(item.status == "pending", and_(item.status == "running", item.lease_until < func.now())),
+        )
+        .order_by(item.priority, item.code)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    stmt = (
+        update(item)
+        .where(item.run_id == run_id, item.code.in_(claimable.scalar_subquery()))
+        .values(status="running", claimed_by=node_id,
+                lease_until=func.now() + timedelta(seconds=lease_seconds), updated_at=func.now())
+        .returning(item.code)
+    )
+    return list(db.execute(stmt).scalars())
+
+def renew_sync_leases(db: Session, run_id: int, node_id: str, codes: Iterable[str], lease_seconds: float) -> int:
+    """延长本节点仍在处理的基金的租约。不提交事务。"""
+    item = models.SyncRunItem
+    stmt = (
+        update(item)
+        .where(item.run_id == run_id, item.claimed_by == node_id, item.status == "running", item.code.in_(list(codes)))
+        .values(lease_until=func.now() + timedelta(seconds=lease_seconds))
+    )
+    return db.execute(stmt).rowcount
+
+def finish_sync_run(db: Session, run_id: int) -> Optional[str]:
+    """
+    所有基金都已处理完时结束同步任务：全部完成记为 completed，有失败或被暂缓 (deferred) 的基金时记为 failed。
+    仍有 pending / running 的基金 (其他节点还在处理) 时不做任何修改，返回 None。
+    不提交事务，多节点时应先调用 lock_sync_runs。
+    """
+    item = models.SyncRunItem
+    counts = dict(db.execute(
+        select(item.status, func.count()).where(item.run_id == run_id).group_by(item.status)
+    ).all())
+    if counts.get("pending") or counts.get("running"):
+        return None
+    status = "failed" if counts.get("failed") or counts.get("deferred") else "completed"
+    db.execute(
+        update(models.SyncRun)
+        .where(models.SyncRun.id == run_id, models.SyncRun.status == "running")
+        .values(status=status, finished_at=func.now())
+    )
+    return status
+
+def get_sync_run_summary(db: Session, run_id: int) -> List[Tuple[str, Optional[str], int, int]]:
+    """按状态和节点汇总某次同步任务的进度：[(状态, 节点, 基金数, 已写入行数)]。"""
+    item = models.SyncRunItem
+    stmt = (
+        select(item.status, item.claimed_by, func.count(), func.coalesce(func.sum(item.rows_written), 0))
+        .where(item.run_id == run_id)
+        .group_by(item.status, item.claimed_by)
+        .order_by(item.status, item.claimed_by)
+    )
+    return [tuple(row) for row in db.execute(stmt)]
+
+def get_watchlist(db: Session) -> List[models.Watchlist]:
+    """按最近查询时间 (其次按加入时间) 倒序返回关注列表。"""
+    watch = models.Watchlist
+    stmt = select(watch).order_by(watch.last_queried_at.desc().nulls_last(), watch.added_at.desc())
+    return list(db.execute(stmt).scalars())
+
+def add_watchlist_items(db: Session, items: List[Dict[str, Any]]) -> int:
+    """批量加入关注列表，items 为包含 code / name 的字典列表，已关注的基金跳过。不提交事务，返回新增数量。"""
+    if not items:
+        return 0
+    stmt = pg_insert(models.Watchlist.__table__).values(items).on_conflict_do_nothing(index_elements=['code'])
+    return db.execute(stmt).rowcount
+
+def delete_watchlist_item(db: Session, code: str) -> int:
+    """从关注列表移除 (保留已同步的历史净值)。不提交事务，返回删除数量。"""
+    return db.execute(delete(models.Watchlist).where(models.Watchlist.code == code)).rowcount
+
+def get_watchlist_codes(db: Session) -> List[str]:
+    """返回关注列表中的全部基金代码。"""
+    return list(db.execute(select(models.Watchlist.code)).scalars())
+
+def get_nav_codes(db: Session, exclude: Iterable[str] = ()) -> List[str]:
+    """返回本地有历史净值的基金代码 (不含 exclude 中的基金)。"""
+    nav = models.NavHistory
+    stmt = select(nav.code).distinct()
+    exclude = list(exclude)
+    if exclude:
+        stmt = stmt.where(nav.code.not_in(exclude))
+    return list(db.execute(stmt.order_by(nav.code)).scalars())
+
+def touch_watchlist(db: Session, codes: Iterable[str]) -> int:
+    """记录关注基金被查询的时间，不在关注列表中的基金不受影响。不提交事务。"""
+    watch = models.Watchlist
+    return db.execute(update(watch).where(watch.code.in_(list(codes))).values(last_queried_at=func.now())).rowcount
+
+def get_sync_universe(db: Session, include_watchlist: bool = True) -> List[str]:
+    """
+    返回需要同步历史净值的基金代码，按同步优先级排序：
+    先是全部持仓基金，然后是仅关注的基金 (最近被查询过的在前)。
+    """
+    held = list(db.execute(select(models.Holding.code).order_by(models.Holding.code)).scalars())
+    if not include_watchlist:
+        return held
+    held_set = set(held)
+    watched = [item.code for item in get_watchlist(db) if item.code not in held_set]
+    return held + watched
+
+def get_nav_since(db: Session, code: str, after: Optional[date]) -> List[Tuple[date, float]]:
+    """按日期升序返回基金在 after 之后 (after 为空时为全部) 的 (净值日期, 单位净值)，净值在数据库中转为浮点数。"""
+    nav = models.NavHistory
+    stmt = select(nav.nav_date, cast(nav.nav, Float)).where(nav.code == code)
+    if after is not None:
+        stmt = stmt.where(nav.nav_date > after)
+    return [tuple(row) for row in db.execute(stmt.order_by(nav.nav_date))]
+
+def nav_checksum(db: Session, code: str, until: date) -> Tuple[int, str]:
+    """
+    基金在 until 当天及之前的净值行数，以及按日期排序的 "YYYY-MM-DD:净值" 串 (逗号分隔) 的 MD5，
+    补写、删除或原地修正其中任一行都会改变结果。
+    """
+    nav = models.NavHistory
+    entry = func.to_char(nav.nav_date, 'YYYY-MM-DD').concat(':').concat(cast(nav.nav, String))
+    count, digest = db.execute(
+        select(func.count(), func.md5(func.string_agg(entry, aggregate_order_by(literal_column("','"), nav.nav_date))))
+        .where(nav.code == code, nav.nav_date <= until)
+    ).one()
+    return count, digest or ""
+
+def get_nav_window(db: Session, code: str, after: Optional[date], lookback: int) -> List[Tuple[date, float]]:
+    """
+    按日期升序返回基金在 after 之后的全部净值，以及 after 当天及之前的最近 lookback 条净值 (供滚动指标回看)。
+    after 为空时返回全部净值。
+    """
+    if after is None:
+        return get_nav_since(db, code, after=None)
+    nav = models.NavHistory
+    previous = db.execute(
+        select(nav.nav_date, cast(nav.nav, Float))
+        .where(nav.code == code, nav.nav_date <= after)
+        .order_by(nav.nav_date.desc())
+        .limit(lookback)
+    ).all()
+    return [tuple(row) for row in reversed(previous)] + get_nav_since(db, code, after=after)
+
+def get_indicator_cursors(db: Session, codes: Iterable[str], cursor_key: str) -> Dict[str, date]:
+    """返回每只基金已计算指标的最新日期 (以每天都有值的 cursor_key 为准)，没有指标的基金不在结果中。"""
+    ind = models.FundIndicator
+    stmt = (
+        select(ind.code, func.max(ind.nav_date))
+        .where(ind.key == cursor_key, ind.code.in_(list(codes)))
+        .group_by(ind.code)
+    )
+    return {code: nav_date for code, nav_date in db.execute(stmt)}
+
+def get_indicator_values(db: Session, code: str, keys: Iterable[str], start_date: Optional[date] = None,
+                         end_date: Optional[date] = None) -> List[Tuple[str, date, float]]:
+    """按 (指标, 日期) 顺序返回基金在 [start_date, end_date] 内的指标值。"""
+    ind = models.FundIndicator
+    stmt = select(ind.key, ind.nav_date, ind.value).where(ind.code == code, ind.key.in_(list(keys)))
+    if start_date:
+        stmt = stmt.where(ind.nav_date >= start_date)
+    if end_date:
+        stmt = stmt.where(ind.nav_date <= end_date)
+    return [tuple(row) for row in db.execute(stmt.order_by(ind.key, ind.nav_date))]
+
+def upsert_indicators(db: Session, rows: List[Dict[str, Any]]) -> int:
+    """批量写入指标，rows 为包含 code / key / nav_date / value 的字典列表，已存在的覆盖。不提交事务。"""
+    table = models.FundIndicator.__table__
+    written = 0
+    # 每行 4 个绑定参数，按与净值写入相同的参数上限分块
+    for i in range(0, len(rows), NAV_INSERT_CHUNK_SIZE):
+        stmt = pg_insert(table).values(rows[i:i + NAV_INSERT_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(constraint='pk_fund_indicator', set_={'value': stmt.excluded.value})
+        written += db.execute(stmt).rowcount
+    return written
+
+def delete_indicators(db: Session, codes: Optional[Iterable[str]] = None) -> int:
+    """删除指定基金 (为空时为全部基金) 的已计算指标。不提交事务。"""
+    stmt = delete(models.FundIndicator)
+    if codes is not None:
+        stmt = stmt.where(models.FundIndicator.code.in_(list(codes)))
+    return db.execute(stmt).rowcount
+
+def upsert_nav_history(db: Session, rows: List[Dict[str, Any]], update_existing: bool = False) -> int:
+    """
+    批量写入历史净值，rows 为包含 code / nav_date / nav 的字典列表，不构造 ORM 对象。
+    已存在的 (code, nav_date) 默认跳过 (ON CONFLICT DO NOTHING)，update_existing=True 时覆盖净值。
+    行数超过 NAV_COPY_THRESHOLD 时先 COPY 到临时表再合并，适合大批量回填。
+    同一批中重复的 (code, nav_date) 只保留最后一行 (一条 ON CONFLICT DO UPDATE 不能两次更新同一行)。
+    不提交事务，返回实际新增或更新的行数。
+    """
+    rows = list({(row['code'], row['nav_date']): row for row in rows}.values())
+    if not rows:
+        return 0
+    if len(rows) >= NAV_COPY_THRESHOLD:
+        copied = _copy_nav_history(db, rows, update_existing)
+        if copied is not None:
+            return copied
+
+    table = models.NavHistory.__table__
+    written = 0
+    for i in range(0, len(rows), NAV_INSERT_CHUNK_SIZE):
+        stmt = pg_insert(table).values(rows[i:i + NAV_INSERT_CHUNK_SIZE])
+        if update_existing:
+            stmt = stmt.on_conflict_do_update(constraint='pk_fund_date', set_={'nav': stmt.excluded.nav})
+        else:
+            stmt = stmt.on_conflict_do_nothing(constraint='pk_fund_date')
+        written += db.execute(stmt).rowcount
+    return written
+
+def _copy_nav_history(db: Session, rows: List[Dict[str, Any]], update_existing: bool):
+    """通过 COPY 写入临时表后合并到 fund_nav_history；驱动不支持 COPY 时返回 None。"""
+    cursor = db.connection().connection.dbapi_connection.cursor()
+    if not hasattr(cursor, 'copy_expert'):
+        cursor.close()
+        return None
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow((row['code'], row['nav_date'].isoformat(), row['nav']))
+    buffer.seek(0)
+
+    target = f"{models.DB_SCHEMA}.{models.NavHistory.__tablename__}"
+    conflict_action = "DO UPDATE SET nav = EXCLUDED.nav" if update_existing else "DO NOTHING"
+    try:
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS nav_history_staging "
+            "(code varchar, nav_date date, nav numeric(10, 4)) ON COMMIT DELETE ROWS"
+        )
+        cursor.execute("TRUNCATE nav_history_staging")
+        cursor.copy_expert("COPY nav_history_staging (code, nav_date, nav) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(
+            f"INSERT INTO {target} (code, nav_date, nav) "
+            f"SELECT code, nav_date, nav FROM nav_history_staging "
+            f"ON CONFLICT ON CONSTRAINT pk_fund_date {conflict_action}"
+        )
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
 def update_holding(db: Session, code: str, amount: float) -> models.Holding:
     """(API层) 更新持仓金额"""
     try:
@@ -2,68 +2,414 @@ import httpx
 import time
 import json
 import logging
+import os
+import asyncio
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, AsyncIterator, Optional, Any
+
+import pytz
+
+from . import rate_limiter
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+REQUEST_TIMEOUT = 10.0
+
+# 批量请求的总并发上限，以及对同一主机的最大并发连接数
+FETCH_MAX_CONCURRENCY = int(os.getenv("FETCH_MAX_CONCURRENCY", "32"))
+FETCH_MAX_CONNECTIONS_PER_HOST = int(os.getenv("FETCH_MAX_CONNECTIONS_PER_HOST", "16"))
+
+# 历史净值 (lsjz) 分页抓取参数
+HISTORY_URL = "http://api.fund.eastmoney.com/f10/lsjz"
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "100"))  # 期望的每页条数，接口可能会下调
+HISTORY_PAGE_CONCURRENCY = int(os.getenv("HISTORY_PAGE_CONCURRENCY", "8"))  # 单只基金同时在途的页数
+HISTORY_PAGE_RETRIES = 2
+HISTORY_MAX_RECORDS = 10000
+
+# 实时估值缓存：fundgz 大约每分钟刷新一次估值，缓存过期时间按响应中的 gztime 推算
+REALTIME_CACHE_MAX_SIZE = int(os.getenv("REALTIME_CACHE_MAX_SIZE", "2048"))
+REALTIME_REFRESH_SECONDS = 60
+REALTIME_CACHE_MIN_TTL = 5
+REALTIME_CACHE_MAX_TTL = int(os.getenv("REALTIME_CACHE_MAX_TTL", "300"))
+CHINA_TZ = pytz.timezone("Asia/Shanghai")
+
+
+def to_china_time(value: datetime) -> datetime:
+    """把估值时间统一为带北京时区的 datetime；gztime 本身是北京时间，写入 timestamptz 列时不受数据库会话时区影响。"""
+    return CHINA_TZ.localize(value) if value.tzinfo is None else value.astimezone(CHINA_TZ)
+
+
 http_client = httpx.Client(
-    headers={
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    },
-    timeout=10.0
+    headers=DEFAULT_HEADERS,
+    timeout=REQUEST_TIMEOUT
 )
 
-def fetch_fund_realtime_estimate(fund_code: str):
-    """从天天基金网获取基金的实时估值。"""
-    url = f'http://fundgz.1234567.com.cn/js/{fund_code}.js'
+
+class _BoundedAsyncClient:
+    """带总并发上限和单主机连接上限的异步 HTTP 客户端，只能在创建它的事件循环内使用。"""
+
+    def __init__(self, max_concurrency: int = FETCH_MAX_CONCURRENCY, max_per_host: int = FETCH_MAX_CONNECTIONS_PER_HOST):
+        self._client = httpx.AsyncClient(
+            headers=DEFAULT_HEADERS,
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._max_per_host = max_per_host
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._client.aclose()
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        host = httpx.URL(url).host
+        host_semaphore = self._host_semaphores.get(host)
+        if host_semaphore is None:
+            host_semaphore = self._host_semaphores[host] = asyncio.Semaphore(self._max_per_host)
+        # 先占用主机名额再占用全局名额，避免排队等待某一主机时白白占着全局并发
+        async with host_semaphore:
+            async with self._semaphore:
+                return await self._client.get(url, **kwargs)
+
+
+def _run_coroutine(coro):
+    """
+    在同步代码中执行协程。
+    如果当前线程已经有事件循环在运行 (例如在 FastAPI 的 async 路由中被调用)，
+    则在独立线程中启动新的事件循环，避免 asyncio.run 报错。
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+def _estimate_ttl(data: dict, now: float) -> float:
+    """
+    根据 gztime 推算估值还能新鲜多久:
+    - 距离 gztime 不足一个刷新周期: 缓存到下一次预期刷新;
+    - 刚超过刷新周期 (接口略有延迟): 短暂缓存后尽快重试;
+    - 远超刷新周期 (午休、收盘或非交易日，估值不再变化): 使用最长 TTL。
+    """
     try:
+        gztime = CHINA_TZ.localize(datetime.strptime(data['gztime'], '%Y-%m-%d %H:%M')).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return REALTIME_REFRESH_SECONDS
+    age = now - gztime
+    if age < REALTIME_REFRESH_SECONDS:
+        ttl = REALTIME_REFRESH_SECONDS - age
+    elif age < REALTIME_REFRESH_SECONDS * 5:
+        ttl = REALTIME_CACHE_MIN_TTL
+    else:
+        ttl = REALTIME_CACHE_MAX_TTL
+    return min(max(ttl, REALTIME_CACHE_MIN_TTL), REALTIME_CACHE_MAX_TTL)
+
+
+class _RealtimeEstimateCache:
+    """按基金代码缓存实时估值，过期时间跟随 gztime，超出容量时按最近最少使用 (LRU) 淘汰。"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, fund_code: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(fund_code)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[fund_code]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(fund_code)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, fund_code: str, data: dict):
+        if self.max_size <= 0:
+            return
+        now = time.time()
+        expires_at = now + _estimate_ttl(data, now)
+        with self._lock:
+            self._entries[fund_code] = (expires_at, data)
+            self._entries.move_to_end(fund_code)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_realtime_cache = _RealtimeEstimateCache(REALTIME_CACHE_MAX_SIZE)
+
+def get_realtime_cache_stats() -> Dict[str, Any]:
+    """返回实时估值缓存的容量和命中统计。"""
+    return _realtime_cache.stats()
+
+def clear_realtime_cache():
+    """清空实时估值缓存。"""
+    _realtime_cache.clear()
+
+
+def _realtime_estimate_url(fund_code: str) -> str:
+    return f'http://fundgz.1234567.com.cn/js/{fund_code}.js'
+
+def _parse_realtime_estimate(text: str) -> dict:
+    json_str = text.replace('jsonpgz(', '').replace(');', '')
+    return json.loads(json_str)
+
+def fetch_fund_realtime_estimate(fund_code: str, use_cache: bool = True):
+    """
+    从天天基金网获取基金的实时估值。
+    :param use_cache: 为 False 时跳过缓存直接请求网络 (结果仍会写回缓存)。
+    """
+    if use_cache:
+        cached = _realtime_cache.get(fund_code)
+        if cached is not None:
+            return cached
+
+    url = _realtime_estimate_url(fund_code)
+    try:
+        rate_limiter.get_limiter("fundgz").acquire()
         response = http_client.get(url)
         response.raise_for_status()
-        json_str = response.text.replace('jsonpgz(', '').replace(');', '')
-        data = json.loads(json_str)
+        data = _parse_realtime_estimate(response.text)
+        _realtime_cache.put(fund_code, data)
         return data
     except httpx.HTTPStatusError as e:
         logger.error(f"获取基金 {fund_code} 实时估值失败，状态码: {e.response.status_code}, URL: {e.request.url}")
         return None
-    except Exception as e:
+    except Exception:
         logger.exception(f"获取基金 {fund_code} 实时估值时发生未知错误。")
         return None
 
-def fetch_fund_history(fund_code: str, start_date: str = None, end_date: str = None):
-    """通过天天基金网的API获取基金的历史净值数据。"""
-    logger.info(f"开始获取基金 {fund_code} 的历史净值数据...")
-    url = "http://api.fund.eastmoney.com/f10/lsjz"
+async def _fetch_realtime_estimate_async(client: _BoundedAsyncClient, fund_code: str):
+    url = _realtime_estimate_url(fund_code)
+    try:
+        await rate_limiter.get_limiter("fundgz").acquire_async()
+        response = await client.get(url)
+        response.raise_for_status()
+        data = _parse_realtime_estimate(response.text)
+        _realtime_cache.put(fund_code, data)
+        return data
+    except httpx.HTTPStatusError as e:
+        logger.error(f"获取基金 {fund_code} 实时估值失败，状态码: {e.response.status_code}, URL: {e.request.url}")
+        return None
+    except Exception:
+        logger.exception(f"获取基金 {fund_code} 实时估值时发生未知错误。")
+        return None
+
+async def _fetch_realtime_estimates_async(fund_codes: list) -> Dict[str, Optional[dict]]:
+    async with _BoundedAsyncClient() as client:
+        results = await asyncio.gather(*(_fetch_realtime_estimate_async(client, code) for code in fund_codes))
+    return dict(zip(fund_codes, results))
+
+def fetch_fund_realtime_estimates(fund_codes: Iterable[str], use_cache: bool = True) -> Dict[str, Optional[dict]]:
+    """
+    并发批量获取多只基金的实时估值。
+    总耗时接近最慢的单个请求，而不是所有请求之和；缓存仍新鲜的基金不会发起请求。
+    :param use_cache: 为 False 时全部走网络 (结果仍会写回缓存)。
+    :return: {基金代码: 估值数据}，获取失败的基金对应 None。
+    """
+    codes = list(dict.fromkeys(fund_codes))
+    if not codes:
+        return {}
+
+    results: Dict[str, Optional[dict]] = {}
+    if use_cache:
+        for code in codes:
+            cached = _realtime_cache.get(code)
+            if cached is not None:
+                results[code] = cached
+    codes_to_fetch = [code for code in codes if code not in results]
+
+    started_at = time.perf_counter()
+    if codes_to_fetch:
+        results.update(_run_coroutine(_fetch_realtime_estimates_async(codes_to_fetch)))
+    succeeded = sum(1 for code in codes_to_fetch if results.get(code))
+    logger.info(f"批量获取实时估值完成：共 {len(codes)} 只基金，缓存命中 {len(codes) - len(codes_to_fetch)} 只，"
+                f"网络请求 {len(codes_to_fetch)} 只 (成功 {succeeded} 只)，耗时 {time.perf_counter() - started_at:.2f} 秒。")
+    return {code: results.get(code) for code in codes}
+
+class HistoryFetchError(Exception):
+    def __init__(self, code: str, message: str):
+        self.code = code
+        super().__init__(f"获取基金 '{code}' 的历史净值失败: {message}")
+
+async def _fetch_history_page(client: _BoundedAsyncClient, fund_code: str, page_index: int, page_size: int,
+                              start_date: Optional[str], end_date: Optional[str]) -> dict:
+    """请求 lsjz 接口的某一页，失败时按指数退避重试。"""
+    params = {
+        'fundCode': fund_code, 'pageIndex': page_index, 'pageSize': page_size,
+        'startDate': start_date if start_date else '',
+        'endDate': end_date if end_date else '',
+        '_': int(time.time() * 1000)
+    }
     headers_with_referer = {'Referer': f'http://fundf10.eastmoney.com/jjjz_{fund_code}.html'}
-    
-    all_data = []
-    page_index = 1
-    max_pages = 200
-    
-    while page_index <= max_pages:
-        params = {
-            'fundCode': fund_code, 'pageIndex': page_index, 'pageSize': 50,
-            'startDate': start_date if start_date else '',
-            'endDate': end_date if end_date else '',
-            '_': int(time.time() * 1000)
-        }
+    for attempt in range(HISTORY_PAGE_RETRIES + 1):
         try:
-            response = http_client.get(url, params=params, headers=headers_with_referer)
+            await rate_limiter.get_limiter("lsjz").acquire_async()
+            response = await client.get(HISTORY_URL, params=params, headers=headers_with_referer)
             response.raise_for_status()
             data = response.json()
-            
-            records = data['Data']['LSJZList']
-            if not records:
-                break
-            all_data.extend(records)
-            if data['TotalCount'] <= len(all_data):
-                break
-            page_index += 1
-            time.sleep(0.2)
+            return {'records': data['Data']['LSJZList'] or [], 'total': int(data['TotalCount'])}
         except httpx.HTTPStatusError as e:
-            logger.error(f"请求历史数据失败，状态码: {e.response.status_code}, URL: {e.request.url}")
-            return []
+            message = f"第 {page_index} 页请求失败，状态码: {e.response.status_code}"
         except Exception as e:
-            logger.exception(f"请求或解析历史数据时发生未知错误: {e}")
-            return []
-            
-    logger.info(f"成功获取基金 {fund_code} 的 {len(all_data)} 条历史记录。")
-    return all_data
\ No newline at end of file
+            message = f"第 {page_index} 页请求或解析失败: {e!r}"
+        if attempt < HISTORY_PAGE_RETRIES:
+            logger.warning(f"基金 {fund_code} {message}，{0.5 * 2 ** attempt:.1f} 秒后重试。")
+            await asyncio.sleep(0.5 * 2 ** attempt)
+    raise HistoryFetchError(fund_code, message)
+
+async def _iter_history_pages_async(fund_code: str, start_date: Optional[str], end_date: Optional[str]) -> AsyncIterator[list]:
+    """
+    按日期升序逐页产出历史净值记录 (每页内部也是升序)。
+    第一页返回总条数后，从最旧的一页开始，在大小为 HISTORY_PAGE_CONCURRENCY 的滑动窗口内并发请求，
+    并严格按顺序产出：消费者处理慢时，窗口外的页不会被请求，内存占用保持有界。
+    """
+    async with _BoundedAsyncClient(max_concurrency=HISTORY_PAGE_CONCURRENCY, max_per_host=HISTORY_PAGE_CONCURRENCY) as client:
+        first_page = await _fetch_history_page(client, fund_code, 1, HISTORY_PAGE_SIZE, start_date, end_date)
+        records = first_page['records']
+        total = first_page['total']
+        if not records or total <= len(records):
+            if records:
+                yield records[::-1]
+            return
+
+        # 自适应分页：接口可能会悄悄下调 pageSize，后续页按第一页实际返回的条数计算偏移
+        page_size = len(records)
+        page_count = -(-min(total, HISTORY_MAX_RECORDS) // page_size)
+        # 固定结束日期为第一页的最新日期，避免抓取期间有新净值发布导致分页错位
+        pinned_end_date = end_date or records[0]['FSRQ']
+
+        # 接口按日期降序分页，倒序请求即可从最旧的数据开始产出
+        page_indexes = iter(range(page_count, 1, -1))
+        in_flight = deque()
+
+        def schedule_next():
+            page_index = next(page_indexes, None)
+            if page_index is not None:
+                in_flight.append(asyncio.ensure_future(
+                    _fetch_history_page(client, fund_code, page_index, page_size, start_date, pinned_end_date)
+                ))
+
+        for _ in range(HISTORY_PAGE_CONCURRENCY):
+            schedule_next()
+        received = len(records)
+        try:
+            while in_flight:
+                page = await in_flight.popleft()
+                schedule_next()
+                received += len(page['records'])
+                if page['records']:
+                    yield page['records'][::-1]
+        finally:
+            for task in in_flight:
+                task.cancel()
+        yield records[::-1]
+
+    if total <= HISTORY_MAX_RECORDS and received != total:
+        logger.warning(f"基金 {fund_code} 的历史记录条数 ({received}) 与接口声明的总数 ({total}) 不一致。")
+
+def iter_fund_history_pages(fund_code: str, start_date: str = None, end_date: str = None) -> Iterator[list]:
+    """
+    流式获取基金历史净值：按日期升序逐页产出 lsjz 原始记录。
+    网络请求在后台线程的事件循环中进行，调用方处理 (如写库) 当前页时，后续页已在下载，
+    两者重叠进行；队列有界，调用方处理慢时下载会自动放缓。
+    获取失败时抛出 HistoryFetchError。
+    """
+    pages: queue.Queue = queue.Queue(maxsize=HISTORY_PAGE_CONCURRENCY)
+    stop = threading.Event()
+    finished = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    async def produce():
+        page_iter = _iter_history_pages_async(fund_code, start_date, end_date)
+        try:
+            async for page in page_iter:
+                # 在线程池中阻塞等待队列空位，避免卡住事件循环里其他在途的请求
+                if not await asyncio.get_running_loop().run_in_executor(None, put, page):
+                    return
+        finally:
+            await page_iter.aclose()
+
+    def run():
+        try:
+            asyncio.run(produce())
+            put(finished)
+        except BaseException as e:
+            put(e)
+
+    producer = threading.Thread(target=run, name=f"history-{fund_code}", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = pages.get()
+            if item is finished:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def fetch_fund_history(fund_code: str, start_date: str = None, end_date: str = None):
+    """
+    通过天天基金网的API获取基金的历史净值数据 (日期降序，与接口原始顺序一致)。
+    会把全部记录读入内存；大批量回填请使用 iter_fund_history_pages 流式处理。
+    """
+    logger.info(f"开始获取基金 {fund_code} 的历史净值数据...")
+    started_at = time.perf_counter()
+    all_data = []
+    try:
+        for page in iter_fund_history_pages(fund_code, start_date, end_date):
+            all_data.extend(page)
+    except HistoryFetchError as e:
+        logger.error(str(e))
+        return []
+    except Exception as e:
+        logger.exception(f"请求或解析历史数据时发生未知错误: {e}")
+        return []
+
+    all_data.reverse()
+    logger.info(f"成功获取基金 {fund_code} 的 {len(all_data)} 条历史记录，耗时 {time.perf_counter() - started_at:.2f} 秒。")
+    return all_data
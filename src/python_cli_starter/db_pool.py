@@ -0,0 +1,143 @@
+# src/python_cli_starter/db_pool.py
+import bisect
+import os
+import threading
+import time
+from typing import Dict, Any
+
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+# 连接池配置 (同步和异步引擎各自一个连接池，使用相同的配置)
+# 常驻连接数 / 超出常驻连接后最多再创建的连接数
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# 连接全部被占用时，获取连接最多等待的秒数，超时抛出 TimeoutError
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# 连接使用超过该秒数后在下次取出时重建，避免被数据库或中间代理断开的空闲连接；-1 为不回收
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# 取出连接时先执行一次轻量的探活查询，失效的连接会被丢弃并重连
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes", "on")
+
+# 获取连接等待时间直方图的桶上限 (毫秒)
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class PoolMetrics:
+    """单个连接池的累计指标，由连接池类和连接池事件更新。"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.soft_invalidations = 0
+        self.timeouts = 0
+        self._wait_counts = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self._total_wait_ms = 0.0
+        self._max_wait_ms = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        wait_ms = seconds * 1000
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            self._wait_counts[bisect.bisect_left(WAIT_BUCKETS_MS, wait_ms)] += 1
+            self._total_wait_ms += wait_ms
+            self._max_wait_ms = max(self._max_wait_ms, wait_ms)
+
+    def count(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def stats(self, pool) -> Dict[str, Any]:
+        with self._lock:
+            waits = sum(self._wait_counts)
+            histogram = {f"<={bound}ms": n for bound, n in zip(WAIT_BUCKETS_MS, self._wait_counts)}
+            histogram[f">{WAIT_BUCKETS_MS[-1]}ms"] = self._wait_counts[-1]
+            return {
+                "pool_size": pool.size(),
+                "max_overflow": DB_MAX_OVERFLOW,
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                # QueuePool 的 overflow() 在常驻连接未建满时为负数
+                "overflow_in_use": max(0, pool.overflow()),
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "soft_invalidations": self.soft_invalidations,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self._total_wait_ms / waits, 3) if waits else 0.0,
+                "max_wait_ms": round(self._max_wait_ms, 3),
+                "wait_ms_histogram": histogram,
+            }
+
+
+# 引擎名称 -> 持有连接池的同步引擎 (异步引擎取其 sync_engine)
+_engines: Dict[str, Engine] = {}
+_metrics: Dict[str, PoolMetrics] = {}
+
+
+def _instrumented_pool_class(base, metrics: PoolMetrics):
+    """
+    生成记录获取连接等待时间的连接池类。指标挂在类上，
+    engine.dispose() 重建连接池 (pool.recreate 使用同一个类) 后仍然累计。
+    """
+    def _do_get(self):
+        # 包含排队等待空闲连接的时间，以及在 overflow 内新建连接的时间
+        started_at = time.perf_counter()
+        try:
+            connection = base._do_get(self)
+        except exc.TimeoutError:
+            metrics.record_wait(time.perf_counter() - started_at, timed_out=True)
+            raise
+        metrics.record_wait(time.perf_counter() - started_at)
+        return connection
+
+    return type(f"Instrumented{base.__name__}", (base,), {"_do_get": _do_get})
+
+
+def _listen(sync_engine: Engine, metrics: PoolMetrics):
+    event.listen(sync_engine, "connect", lambda *args: metrics.count("connects"))
+    event.listen(sync_engine, "checkout", lambda *args: metrics.count("checkouts"))
+    event.listen(sync_engine, "checkin", lambda *args: metrics.count("checkins"))
+    event.listen(sync_engine, "invalidate", lambda *args: metrics.count("invalidations"))
+    event.listen(sync_engine, "soft_invalidate", lambda *args: metrics.count("soft_invalidations"))
+
+
+def _pool_options(name: str, base) -> Dict[str, Any]:
+    metrics = _metrics[name] = PoolMetrics(name)
+    return {
+        "poolclass": _instrumented_pool_class(base, metrics),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def create_pooled_engine(name: str, url, **kwargs) -> Engine:
+    """按 DB_POOL_* 配置创建带监控的同步引擎，name 用于在 /utils/metrics 中区分连接池。"""
+    engine = create_engine(url, **_pool_options(name, QueuePool), **kwargs)
+    _listen(engine, _metrics[name])
+    _engines[name] = engine
+    return engine
+
+
+def create_pooled_async_engine(name: str, url, **kwargs) -> AsyncEngine:
+    """create_pooled_engine 的异步版本。"""
+    engine = create_async_engine(url, **_pool_options(name, AsyncAdaptedQueuePool), **kwargs)
+    _listen(engine.sync_engine, _metrics[name])
+    _engines[name] = engine.sync_engine
+    return engine
+
+
+def get_pool_stats() -> Dict[str, Dict[str, Any]]:
+    """返回所有连接池的当前状态和累计指标，按引擎名称分组。"""
+    return {name: _metrics[name].stats(engine.pool) for name, engine in _engines.items()}
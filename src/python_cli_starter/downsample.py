@@ -0,0 +1,64 @@
+# src/python_cli_starter/downsample.py
+from typing import Iterable, Sequence
+
+import numpy as np
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets 降采样，返回保留点的下标 (升序，包含首尾两点)。
+    中间的点均分为 threshold - 2 个桶，每个桶保留与上一个保留点、下一个桶均值构成的三角形面积最大的点，
+    因此峰谷等形状特征会被保留。y 中的 NaN 只影响选点 (按序列均值处理)，不会出现在结果里。
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if np.isnan(y).any():
+        y = np.where(np.isnan(y), np.nanmean(y) if not np.isnan(y).all() else 0.0, y)
+
+    # threshold - 1 条边界把下标 [1, n - 1) 分成 threshold - 2 个桶
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    selected = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+            avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = x[n - 1], y[n - 1]
+        areas = np.abs(
+            (x[selected] - avg_x) * (y[start:end] - y[selected])
+            - (x[selected] - x[start:end]) * (avg_y - y[selected])
+        )
+        selected = start + int(np.argmax(areas))
+        indices[bucket + 1] = selected
+    return indices
+
+
+def downsample_indices(x: np.ndarray, series: Sequence[np.ndarray], max_points: int,
+                       keep: Iterable[int] = ()) -> np.ndarray:
+    """
+    多条共用横轴的序列一起降采样，返回升序下标，点数不超过 max_points。
+    keep 中必须保留的下标 (如买卖信号点) 先占用名额，剩余名额均分给各条序列用 LTTB 选点后取并集；
+    keep 本身超过 max_points 时从中均匀抽取。点数不超过 max_points 时返回全部下标。
+    """
+    n = len(x)
+    if not max_points or n <= max_points:
+        return np.arange(n)
+    keep = np.unique(np.fromiter(keep, dtype=np.int64))
+    if len(keep) >= max_points:
+        return keep[np.unique(np.linspace(0, len(keep) - 1, max_points).astype(np.int64))]
+
+    remaining = max_points - len(keep)
+    budget = remaining // max(1, len(series))
+    if budget < 3:
+        # 名额不够每条序列跑 LTTB (至少首尾加一个点)，按横轴均匀取点
+        indices = [np.linspace(0, n - 1, remaining).astype(np.int64)]
+    else:
+        indices = [lttb_indices(x, y, budget) for y in series]
+    return np.unique(np.concatenate(indices + [keep]))
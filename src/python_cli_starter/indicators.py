@@ -0,0 +1,196 @@
+# src/python_cli_starter/indicators.py
+import logging
+import math
+from typing import Dict, List, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from .models import ReadSessionLocal
+from . import crud
+
+logger = logging.getLogger(__name__)
+
+# --- 预计算的指标参数 (覆盖各策略和图表使用的参数) ---
+MA_PERIODS = (5, 10, 20, 50, 60, 120)
+RSI_PERIOD = 14
+MACD_PERIODS = (12, 26, 9)
+BBANDS_PERIOD = 50
+BBANDS_DEV_FACTOR = 2.0
+
+
+def ma_key(period: int) -> str:
+    return f"ma{period}"
+
+def ema_key(period: int) -> str:
+    return f"ema{period}"
+
+def rsi_key(period: int) -> str:
+    return f"rsi{period}"
+
+def macd_key(part: str, short: int, long: int, signal: int) -> str:
+    """part 为 dif / dea / hist。"""
+    return f"macd{short}_{long}_{signal}_{part}"
+
+def bbands_key(part: str, period: int, dev_factor: float) -> str:
+    """part 为 upper / lower，中轨即同周期的均线 ma_key(period)。"""
+    return f"boll{period}_{dev_factor:g}_{part}"
+
+
+_SHORT, _LONG, _SIGNAL = MACD_PERIODS
+# 递推指标的状态：增量计算时从上次计算的最后一天继续
+_RSI_GAIN_KEY = f"{rsi_key(RSI_PERIOD)}_gain"
+_RSI_LOSS_KEY = f"{rsi_key(RSI_PERIOD)}_loss"
+_STATE_KEYS = (ema_key(_SHORT), ema_key(_LONG), macd_key("dea", *MACD_PERIODS), _RSI_GAIN_KEY, _RSI_LOSS_KEY)
+# 每个有净值的日期都有值的指标，用来判断一只基金的指标已计算到哪一天
+CURSOR_KEY = ema_key(_SHORT)
+# 滚动指标需要回看的净值条数
+LOOKBACK = max(max(MA_PERIODS), BBANDS_PERIOD)
+
+INDICATOR_KEYS = frozenset(
+    [ma_key(p) for p in MA_PERIODS]
+    + [rsi_key(RSI_PERIOD), ema_key(_SHORT), ema_key(_LONG), _RSI_GAIN_KEY, _RSI_LOSS_KEY]
+    + [macd_key(part, *MACD_PERIODS) for part in ("dif", "dea", "hist")]
+    + [bbands_key(part, BBANDS_PERIOD, BBANDS_DEV_FACTOR) for part in ("upper", "lower")]
+)
+
+
+def compute_indicators(navs: np.ndarray, start: int = 0, state: Optional[Dict[str, float]] = None) -> Dict[str, np.ndarray]:
+    """
+    计算 navs[start:] 每个日期的全部指标，返回 {指标名: 长度为 len(navs) - start 的数组}，无法计算的位置为 NaN。
+    滚动指标 (均线、布林带) 用 navs 中 start 之前的数据回看；EMA、MACD、RSI 按 pandas ewm(adjust=False) 的递推公式，
+    从 state (navs[start - 1] 当天已存储的 _STATE_KEYS 的值) 继续计算，start 为 0 时从第一条净值开始。
+    """
+    navs = np.asarray(navs, dtype=np.float64)
+    count = len(navs) - start
+    result: Dict[str, np.ndarray] = {}
+
+    closes = pd.Series(navs)
+    for period in MA_PERIODS:
+        result[ma_key(period)] = closes.rolling(window=period).mean().to_numpy()[start:]
+    band_std = closes.rolling(window=BBANDS_PERIOD).std().to_numpy()[start:] * BBANDS_DEV_FACTOR
+    band_mid = result[ma_key(BBANDS_PERIOD)]
+    result[bbands_key("upper", BBANDS_PERIOD, BBANDS_DEV_FACTOR)] = band_mid + band_std
+    result[bbands_key("lower", BBANDS_PERIOD, BBANDS_DEV_FACTOR)] = band_mid - band_std
+
+    state = state or {}
+    ema_short, ema_long = state.get(ema_key(_SHORT)), state.get(ema_key(_LONG))
+    dea = state.get(macd_key("dea", *MACD_PERIODS))
+    gain, loss = state.get(_RSI_GAIN_KEY), state.get(_RSI_LOSS_KEY)
+    alpha_short, alpha_long, alpha_signal = 2 / (_SHORT + 1), 2 / (_LONG + 1), 2 / (_SIGNAL + 1)
+    alpha_rsi = 1 / RSI_PERIOD  # 与 ewm(com=RSI_PERIOD - 1) 相同
+
+    columns = {key: np.full(count, np.nan) for key in
+               (ema_key(_SHORT), ema_key(_LONG), _RSI_GAIN_KEY, _RSI_LOSS_KEY, rsi_key(RSI_PERIOD))
+               + tuple(macd_key(part, *MACD_PERIODS) for part in ("dif", "dea", "hist"))}
+    for offset, i in enumerate(range(start, len(navs))):
+        close = navs[i]
+        ema_short = close if ema_short is None else ema_short + alpha_short * (close - ema_short)
+        ema_long = close if ema_long is None else ema_long + alpha_long * (close - ema_long)
+        dif = ema_short - ema_long
+        dea = dif if dea is None else dea + alpha_signal * (dif - dea)
+        columns[ema_key(_SHORT)][offset] = ema_short
+        columns[ema_key(_LONG)][offset] = ema_long
+        columns[macd_key("dif", *MACD_PERIODS)][offset] = dif
+        columns[macd_key("dea", *MACD_PERIODS)][offset] = dea
+        columns[macd_key("hist", *MACD_PERIODS)][offset] = dif - dea
+
+        if i == 0:
+            continue  # 第一条净值没有涨跌幅
+        delta = close - navs[i - 1]
+        up, down = max(delta, 0.0), max(-delta, 0.0)
+        gain = up if gain is None else gain + alpha_rsi * (up - gain)
+        loss = down if loss is None else loss + alpha_rsi * (down - loss)
+        columns[_RSI_GAIN_KEY][offset] = gain
+        columns[_RSI_LOSS_KEY][offset] = loss
+        if loss > 0:
+            columns[rsi_key(RSI_PERIOD)][offset] = 100 - 100 / (1 + gain / loss)
+        elif gain > 0:
+            columns[rsi_key(RSI_PERIOD)][offset] = 100.0
+
+    result.update(columns)
+    return result
+
+
+def refresh_indicators(db: Session, codes: Iterable[str]) -> int:
+    """
+    为一批基金增量计算指标：只计算上次计算之后新增的净值日期，从未计算过的基金计算全部历史。
+    不提交事务，返回写入的行数。
+    """
+    codes = list(codes)
+    cursors = crud.get_indicator_cursors(db, codes, CURSOR_KEY)
+    written = 0
+    for code in codes:
+        cursor = cursors.get(code)
+        window = crud.get_nav_window(db, code, after=cursor, lookback=LOOKBACK)
+        if not window:
+            continue
+        dates = [nav_date for nav_date, _ in window]
+        navs = np.array([nav for _, nav in window], dtype=np.float64)
+
+        start, state = 0, None
+        if cursor is not None:
+            start = next((i for i, nav_date in enumerate(dates) if nav_date > cursor), len(dates))
+            if start == len(dates):
+                continue
+            # get_nav_window 只回看了 LOOKBACK 条，第一条净值不是该基金真正的第一条，必须从已存储的状态继续递推
+            state = {key: value for key, _, value in crud.get_indicator_values(db, code, _STATE_KEYS, cursor, cursor)}
+            # cursor 是第一条净值时 (start == 1) 还没有 RSI 状态，其余情况状态必须完整
+            missing = set(_STATE_KEYS) - state.keys()
+            if missing and (start > 1 or missing - {_RSI_GAIN_KEY, _RSI_LOSS_KEY}):
+                # 状态缺失 (如指标表被部分清理)，改为重新计算全部历史
+                start, state = 0, None
+                window = crud.get_nav_window(db, code, after=None, lookback=LOOKBACK)
+                dates = [nav_date for nav_date, _ in window]
+                navs = np.array([nav for _, nav in window], dtype=np.float64)
+
+        values = compute_indicators(navs, start, state)
+        rows = [
+            {"code": code, "key": key, "nav_date": dates[start + offset], "value": float(value)}
+            for key, column in values.items()
+            for offset, value in enumerate(column)
+            if not math.isnan(value)
+        ]
+        written += crud.upsert_indicators(db, rows)
+    return written
+
+
+def attach_indicators(fund_code: str, data: pd.DataFrame, columns: Dict[str, str]) -> Optional[pd.DataFrame]:
+    """
+    把已存储的指标按日期并入 data (以日期为索引、包含 close 列的 DataFrame)，columns 为 {列名: 指标名}。
+    以下情况返回 None，调用方应回退到现场计算：请求的指标不在预计算范围内、读取失败，
+    或存储的指标没有覆盖 data 的最后一天 (同步后的指标计算尚未完成，或数据来自 akshare)。
+    """
+    keys = set(columns.values())
+    if data is None or data.empty or not keys <= INDICATOR_KEYS:
+        return None
+    start_date, end_date = data.index[0].date(), data.index[-1].date()
+    try:
+        with ReadSessionLocal() as db:
+            rows = crud.get_indicator_values(db, fund_code, keys, start_date, end_date)
+    except Exception as e:
+        logger.warning(f"读取基金 {fund_code} 的预计算指标失败，改为现场计算: {e}")
+        return None
+    if not rows:
+        return None
+
+    stored = pd.DataFrame(rows, columns=["key", "nav_date", "value"])
+    stored = stored.pivot(index="nav_date", columns="key", values="value")
+    stored.index = pd.DatetimeIndex(stored.index)
+    if stored.index[-1] < data.index[-1]:
+        return None
+
+    result = data.copy()
+    for column, key in columns.items():
+        result[column] = stored[key].reindex(result.index) if key in stored else np.nan
+    return result
+
+
+def rebuild_indicators(db: Session, codes: Optional[List[str]] = None) -> int:
+    """删除并重新计算指定基金 (为空时为所有有净值的基金) 的全部指标，调整指标参数后使用。不提交事务。"""
+    if codes is None:
+        codes = crud.get_latest_navs(db).keys()
+    codes = list(codes)
+    crud.delete_indicators(db, codes)
+    return refresh_indicators(db, codes)
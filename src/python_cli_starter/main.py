@@ -1,21 +1,24 @@
 # src/python_cli_starter/main.py (修改后)
 from fastapi import FastAPI, Depends, HTTPException, Query, Response, status, UploadFile, File, Form, Query
-from fastapi.responses import JSONResponse
 import inspect
+import asyncio
 from datetime import date
 from typing import List, Optional
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from contextlib import asynccontextmanager
 import json
 import logging
 
 # 1. 导入新的日志配置和我们自己的模块
 from .logger_config import setup_logging
-# from .scheduler import scheduler_runner # <-- 移除导入
+from .scheduler import run_scheduler, SCHEDULER_ENABLED
 from . import models, crud, schemas, services
-from .models import SessionLocal
+from .models import SessionLocal, ReadSessionLocal, AsyncReadSessionLocal
 from .strategies import STRATEGY_REGISTRY
 from . import charts
+from . import rate_limiter, data_fetcher, nav_source, db_pool
+from .nav_cache import nav_cache
 
 # 2. 在应用启动前，最先配置日志
 setup_logging()
@@ -28,13 +31,22 @@ models.create_db_and_tables()
 async def lifespan(app: FastAPI):
     # 在应用启动时执行的代码
     logger.info("FastAPI 应用启动...")
-    # 移除启动后台调度器的代码
+    scheduler_task = asyncio.create_task(run_scheduler()) if SCHEDULER_ENABLED else None
     
     yield # 这是应用运行的时间点
     
     # 在应用关闭时执行的代码
     logger.info("FastAPI 应用关闭...")
-    # 移除停止后台调度器的代码
+    if scheduler_task:
+        scheduler_task.cancel()
+        try:
+            await scheduler_task
+        except asyncio.CancelledError:
+            pass
+        logger.info("定时任务已停止。")
+    await models.async_engine.dispose()
+    if models.async_read_engine is not models.async_engine:
+        await models.async_read_engine.dispose()
 
 # 将FastAPI实例命名为 api_app，以示区分
 api_app = FastAPI(title="基金投资助手 API", lifespan=lifespan)
@@ -47,10 +59,23 @@ def get_db():
     finally:
         db.close()
 
+# Dependency: 获取只读会话，配置了 DATABASE_READ_URL 时连接只读副本，否则与 get_db 相同
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Dependency: 获取异步只读会话，读接口在等待数据库时不占用线程池
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
 # --- API 路由定义 (保持不变) ---
 @api_app.get("/holdings/", response_model=list[schemas.Holding])
-def read_holdings(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    holdings = crud.get_holdings(db, skip=skip, limit=limit)
+async def read_holdings(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_read_db)):
+    holdings = await crud.get_holdings_async(db, skip=skip, limit=limit)
     return holdings
 
 @api_app.post("/holdings/", response_model=schemas.Holding)
@@ -80,33 +105,59 @@ def delete_holding_endpoint(fund_code: str, db: Session = Depends(get_db)):
 
 
 @api_app.get("/holdings/{fund_code}/history")
-def read_fund_history_with_ma(
+async def read_fund_history_with_ma(
     fund_code: str,
     start_date: Optional[date] = Query(None, description="查询开始日期 (格式: YYYY-MM-DD)"),
     end_date: Optional[date] = Query(None, description="查询结束日期 (格式: YYYY-MM-DD)"),
     ma: Optional[List[int]] = Query(None, description="需要计算的均线周期，可多选。例如: ma=5&ma=10&ma=20"),
-    db: Session = Depends(get_db)
+    max_points: Optional[int] = Query(None, ge=3, description="最多返回的点数，超出时按净值曲线降采样 (LTTB)，均线仍基于全部数据计算"),
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     获取指定基金在特定时间范围内的历史净值及所选的移动平均线。
     """
-    df = services.get_history_with_ma(
+    df = await services.get_history_with_ma_async(
         db=db,
         code=fund_code,
         start_date=start_date,
         end_date=end_date,
-        ma_options=ma
+        ma_options=ma,
+        max_points=max_points
     )
     
     if df.empty:
         raise HTTPException(status_code=404, detail=f"未找到基金代码为 '{fund_code}' 的历史数据，或指定时间范围内无数据。")
 
+    # to_json 的结果已是 JSON，直接返回，不再解析后重新序列化
     json_str = df.to_json(orient='records', date_format='iso', default_handler=None)
-    return JSONResponse(content=json.loads(json_str))
+    return Response(content=json_str, media_type="application/json")
+
+@api_app.get("/watchlist/", response_model=list[schemas.WatchlistItem], summary="查看关注列表")
+def read_watchlist(db: Session = Depends(get_read_db)):
+    return crud.get_watchlist(db)
+
+@api_app.post("/watchlist/", summary="加入关注列表")
+def add_watchlist_endpoint(payload: schemas.WatchlistAdd, db: Session = Depends(get_db)):
+    """
+    把一批基金加入关注列表，历史净值同步任务会保持它们的数据最新。
+    """
+    added, existed = services.add_to_watchlist(db, payload.codes)
+    return {"message": "关注列表已更新", "added": added, "existed": existed}
+
+@api_app.delete("/watchlist/{fund_code}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_watchlist_endpoint(fund_code: str, db: Session = Depends(get_db)):
+    """
+    把基金移出关注列表 (已同步的历史净值会保留)。
+    """
+    try:
+        services.remove_from_watchlist(db, fund_code)
+    except services.WatchlistNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 # --- 3. 添加新的工具类路由 ---
 @api_app.get("/utils/export", summary="导出所有持仓数据")
-def export_data_endpoint(db: Session = Depends(get_db)):
+def export_data_endpoint(db: Session = Depends(get_read_db)):
     """
     将所有持仓的核心数据（代码和份额）导出为 JSON 文件。
     """
@@ -120,6 +171,20 @@ def export_data_endpoint(db: Session = Depends(get_db)):
         }
     )
 
+@api_app.get("/utils/metrics", summary="查看运行指标")
+def metrics_endpoint():
+    """
+    返回进程内的运行指标：各出站行情接口的限流预算与累计等待时间、
+    实时估值缓存和净值序列缓存的命中率与内存占用、
+    各数据库连接池的占用情况与获取连接的等待时间分布。
+    """
+    return {
+        "db_pools": db_pool.get_pool_stats(),
+        "rate_limits": rate_limiter.get_all_stats(),
+        "realtime_cache": data_fetcher.get_realtime_cache_stats(),
+        "nav_cache": nav_cache.stats(),
+    }
+
 @api_app.post("/utils/import", summary="通过上传JSON文件导入持仓数据")
 async def import_data_endpoint(
     db: Session = Depends(get_db),
@@ -154,10 +219,11 @@ async def import_data_endpoint(
     response_model=schemas.StrategySignal, 
     summary="获取基金策略信号"
 )
-def get_strategy_signal(
+async def get_strategy_signal(
     strategy_name: str, 
     fund_code: str,
-    is_holding: Optional[bool] = Query(None, description="【可选】对于需要持仓状态的策略，指定当前是否持有该基金。") # <-- 添加 is_holding 参数
+    is_holding: Optional[bool] = Query(None, description="【可选】对于需要持仓状态的策略，指定当前是否持有该基金。"), # <-- 添加 is_holding 参数
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     根据指定的策略名称和基金代码，运行分析并返回交易信号。
@@ -195,8 +261,15 @@ def get_strategy_signal(
                 )
             params['is_holding'] = is_holding
 
-        # 执行策略函数，并传入构造好的参数
-        result_dict = strategy_function(**params)
+        # 先通过异步会话把净值序列读入进程内缓存，策略函数读取时直接命中缓存；
+        # 读库失败时交给策略函数自己处理 (回退到 akshare)
+        try:
+            await nav_source.get_nav_series_async(fund_code, db)
+        except Exception as e:
+            logger.warning(f"预读基金 {fund_code} 的净值序列失败: {e}")
+
+        # 策略函数是同步的 pandas 计算 (本地无数据时还会请求 akshare)，放到线程池中执行
+        result_dict = await asyncio.to_thread(strategy_function, **params)
         
         # (后续错误处理和响应封装保持不变)
         if result_dict.get("error"):
@@ -230,15 +303,20 @@ def get_strategy_signal(
     summary="获取RSI策略图表数据 (ECharts, 全部历史)",
     tags=["Charts"] # 使用 tags 对 API 进行分组
 )
-def get_rsi_chart_endpoint(fund_code: str):
+def get_rsi_chart_endpoint(
+    fund_code: str,
+    max_points: Optional[int] = Query(None, ge=3, description="最多返回的点数，超出时降采样 (LTTB)，买卖信号点优先占用名额"),
+    since: Optional[date] = Query(None, description="增量模式：只返回该日期之后的数据和信号，传入上次响应中的 latestDate"),
+    version: Optional[str] = Query(None, description="增量模式 (可选)：上次响应中的 version，since 及之前的数据已变化时返回完整数据并标记 reset")
+):
     """
     获取指定基金的全部历史净值和RSI指标数据，
     返回格式适配 ECharts，用于绘制策略回测图。
     """
-    logger.info(f"收到RSI图表数据请求 (全部历史): code='{fund_code}'")
+    logger.info(f"收到RSI图表数据请求: code='{fund_code}', since={since}, version={version}")
     
     # 调用更新后的函数，不再传递 start_date
-    chart_data = charts.get_rsi_chart_data(fund_code)
+    chart_data = charts.get_rsi_chart_data(fund_code, max_points, since, version)
     
     if chart_data is None:
         raise HTTPException(
@@ -1,23 +1,63 @@
 # src/python_cli_starter/models.py
 
-from sqlalchemy import (create_engine, Column, String, Date, Float, Numeric, 
-                        PrimaryKeyConstraint, MetaData, text, DateTime)
+from sqlalchemy import (Column, String, Date, Float, Numeric, 
+                        PrimaryKeyConstraint, MetaData, Table, text, DateTime, Integer, ForeignKey, func, Index)
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.orm import declarative_base, sessionmaker
+from datetime import date
+import logging
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# db_pool 在导入时读取 DB_POOL_* 环境变量，需在 load_dotenv 之后导入
+from .db_pool import create_pooled_engine, create_pooled_async_engine
+
 # --- 保持生产环境的配置 ---
 DATABASE_URL = os.getenv("DATABASE_URL")
 DB_SCHEMA = os.getenv("DB_SCHEMA", "public") 
+# fund_nav_history 的存储方式：留空为普通表；"range" 为按 nav_date 按年分区的分区表，
+# 附带 nav_date 上的 BRIN 索引和 (code, nav_date) INCLUDE (nav) 覆盖索引
+NAV_PARTITIONING = os.getenv("NAV_PARTITIONING", "").strip().lower()
+# 分区表的第一个年度分区，更早的数据落入默认分区
+NAV_PARTITION_START_YEAR = int(os.getenv("NAV_PARTITION_START_YEAR", "2000"))
+NAV_PARTITIONED = NAV_PARTITIONING == "range"
+# 创建/迁移分区时使用的事务级咨询锁编号，多个节点同时启动或同步时串行执行分区 DDL
+NAV_PARTITION_LOCK_KEY = 0x6E617670
+
+logger = logging.getLogger(__name__)
 
 # --- 核心改动在这里 ---
 # 1. 创建一个 MetaData 实例，并指定 schema
 metadata_obj = MetaData(schema=DB_SCHEMA)
 
-engine = create_engine(DATABASE_URL)
+def _async_url(url: str):
+    return make_url(url).set(drivername="postgresql+asyncpg")
+
+# 连接池大小、超时、回收和探活由 DB_POOL_* 环境变量配置，运行指标见 /utils/metrics
+engine = create_pooled_engine("primary", DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# API 读路径使用的异步引擎 (asyncpg)，与同步引擎连接同一个数据库；
+# 同步任务、CLI 和写路径仍使用上面的同步引擎
+ASYNC_DATABASE_URL = _async_url(DATABASE_URL)
+async_engine = create_pooled_async_engine("primary_async", ASYNC_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# 只读副本 (可选)：历史净值、图表、策略等只读查询走 ReadSessionLocal / AsyncReadSessionLocal，
+# 写入和同步任务始终使用主库。未配置时两者就是主库的会话工厂，不会额外建立连接池。
+# 副本有复制延迟，刚写入主库的数据可能稍后才能从这里读到
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL") or None
+if DATABASE_READ_URL:
+    read_engine = create_pooled_engine("replica", DATABASE_READ_URL)
+    async_read_engine = create_pooled_async_engine("replica_async", _async_url(DATABASE_READ_URL))
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+    AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+else:
+    read_engine, async_read_engine = engine, async_engine
+    ReadSessionLocal, AsyncReadSessionLocal = SessionLocal, AsyncSessionLocal
 Base = declarative_base(metadata=metadata_obj)
 
 # 表1：我的持仓 (my_holdings)
@@ -44,22 +84,199 @@ class Holding(Base):
         return f"<Holding(code='{self.code}', shares={self.shares}, amount={self.holding_amount})>"
 
 # 表2：基金历史净值 (fund_nav_history)
+def nav_history_table(metadata: MetaData, partitioned: bool) -> Table:
+    """
+    fund_nav_history 的表定义。partitioned 为 True 时按 nav_date 范围分区 (分区由 ensure_nav_partitions 创建)。
+    benchmarks/nav_range_query.py 也用它在临时 schema 中建出与线上相同的两种结构。
+    """
+    columns = [
+        Column('code', String, comment="基金代码"),
+        Column('nav_date', Date, comment="净值日期"),
+        Column('nav', Numeric(10, 4), nullable=False, comment="单位净值"),
+        # 使用联合主键，确保同一基金同一天只有一条记录
+        PrimaryKeyConstraint('code', 'nav_date', name='pk_fund_date'),
+    ]
+    if not partitioned:
+        return Table("fund_nav_history", metadata, *columns,
+                     Index('ix_fund_nav_history_code', 'code'),
+                     Index('ix_fund_nav_history_nav_date', 'nav_date'))
+    # 分区表用下面的覆盖索引和 BRIN 索引代替两个单列 B-tree 索引
+    return Table(
+        "fund_nav_history", metadata, *columns,
+        # 按基金查询日期区间时只扫描索引即可拿到净值 (index-only scan)
+        Index('ix_fund_nav_history_code_date_nav', 'code', 'nav_date', postgresql_include=['nav']),
+        # 按日期扫描全部基金时使用，体积只有 B-tree 的几百分之一
+        Index('ix_fund_nav_history_nav_date_brin', 'nav_date', postgresql_using='brin'),
+        postgresql_partition_by='RANGE (nav_date)',
+    )
+
 class NavHistory(Base):
     __tablename__ = "fund_nav_history"
-
-    code = Column(String, index=True, comment="基金代码")
-    nav_date = Column(Date, index=True, comment="净值日期")
-    nav = Column(Numeric(10, 4), nullable=False, comment="单位净值")
-    
-    # 使用联合主键，确保同一基金同一天只有一条记录
-    __table_args__ = (PrimaryKeyConstraint('code', 'nav_date', name='pk_fund_date'),)
+    __table__ = nav_history_table(metadata_obj, NAV_PARTITIONED)
 
     def __repr__(self):
         return f"<NavHistory(code='{self.code}', date='{self.nav_date}', nav={self.nav})>"
 
+# 表3：交易日历 (trade_calendar)，由 trading_calendar 模块维护
+class TradeCalendar(Base):
+    __tablename__ = "trade_calendar"
+
+    trade_date = Column(Date, primary_key=True, comment="交易日")
+
+    def __repr__(self):
+        return f"<TradeCalendar(date='{self.trade_date}')>"
+
+# 表4：历史净值同步任务 (sync_runs)，每次执行 sync-history 记录一行
+class SyncRun(Base):
+    __tablename__ = "sync_runs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True, comment="任务编号")
+    status = Column(String, nullable=False, default="running", comment="running / completed / failed")
+    started_at = Column(DateTime(timezone=True), nullable=False, comment="开始时间")
+    finished_at = Column(DateTime(timezone=True), nullable=True, comment="结束时间")
+    funds_total = Column(Integer, nullable=False, default=0, comment="纳入本次任务的基金数")
+
+    def __repr__(self):
+        return f"<SyncRun(id={self.id}, status='{self.status}')>"
+
+# 表5：同步任务中每只基金的进度 (sync_run_items)，由写库线程随净值数据在同一事务中更新。
+# 同时作为多节点同步的任务队列：各节点用 SELECT ... FOR UPDATE SKIP LOCKED 领取 pending 的基金
+class SyncRunItem(Base):
+    __tablename__ = "sync_run_items"
+
+    run_id = Column(Integer, ForeignKey(SyncRun.id, ondelete="CASCADE"), comment="任务编号")
+    code = Column(String, comment="基金代码")
+    status = Column(String, nullable=False, default="pending", comment="pending / running / done / failed / deferred (只重试失败基金时暂缓的未完成基金)")
+    priority = Column(Integer, nullable=False, default=0, comment="领取顺序，越小越先同步")
+    last_page = Column(Integer, nullable=False, default=0, comment="已写入的最后一页 (按日期升序计)")
+    rows_written = Column(Integer, nullable=False, default=0, comment="已写入的净值行数")
+    error = Column(String, nullable=True, comment="失败原因")
+    claimed_by = Column(String, nullable=True, comment="领取该基金的同步节点")
+    lease_until = Column(DateTime(timezone=True), nullable=True, comment="领取租约到期时间，过期后其他节点可重新领取")
+    updated_at = Column(DateTime(timezone=True), nullable=True, comment="最后更新时间")
+
+    __table_args__ = (PrimaryKeyConstraint('run_id', 'code', name='pk_sync_run_item'),)
+
+    def __repr__(self):
+        return f"<SyncRunItem(run_id={self.run_id}, code='{self.code}', status='{self.status}')>"
+
+# 表6：关注列表 (watchlist)，未持有但需要保持历史净值最新的基金
+class Watchlist(Base):
+    __tablename__ = "watchlist"
+
+    code = Column(String, primary_key=True, comment="基金代码")
+    name = Column(String, nullable=True, comment="基金名称")
+    added_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), comment="加入时间")
+    last_queried_at = Column(DateTime(timezone=True), nullable=True, comment="最近一次被策略/图表查询的时间")
+
+    def __repr__(self):
+        return f"<Watchlist(code='{self.code}', name='{self.name}')>"
+
+# 表7：技术指标 (fund_indicators)，同步任务写入净值后按新增日期增量计算，策略和图表直接读取
+class FundIndicator(Base):
+    __tablename__ = "fund_indicators"
+
+    code = Column(String, comment="基金代码")
+    key = Column(String, comment="指标名称，如 ma20、rsi14、macd12_26_9_dif")
+    nav_date = Column(Date, comment="净值日期")
+    value = Column(Float, nullable=False, comment="指标值 (无法计算的日期不写入)")
+
+    # 主键顺序与读取方式一致：按基金、指标读取一段日期
+    __table_args__ = (PrimaryKeyConstraint('code', 'key', 'nav_date', name='pk_fund_indicator'),)
+
+    def __repr__(self):
+        return f"<FundIndicator(code='{self.code}', key='{self.key}', date='{self.nav_date}', value={self.value})>"
+
+def _nav_table_kind(connection) -> str:
+    """返回 fund_nav_history 的 relkind：'p' 为分区表，'r' 为普通表，表不存在时返回空字符串。"""
+    kind = connection.execute(
+        text("SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+             "WHERE n.nspname = :schema AND c.relname = :table"),
+        {"schema": DB_SCHEMA, "table": NavHistory.__tablename__},
+    ).scalar()
+    return kind or ""
+
+def _lock_nav_partitions(connection):
+    """在当前事务内获取分区 DDL 的咨询锁，事务结束时自动释放。"""
+    connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": NAV_PARTITION_LOCK_KEY})
+
+def ensure_nav_partitions(connection, start_year: int = NAV_PARTITION_START_YEAR, end_year: int = None,
+                          table: Table = None):
+    """
+    为分区表 (默认为 NavHistory 的表) 创建 [start_year, end_year] 的年度分区 (end_year 默认为明年) 以及默认分区，已存在的跳过。
+    需要在数据跨入新的一年之前调用 (应用启动和每次同步时都会调用)，否则新数据会落入默认分区。
+    并发调用方应先在同一事务中调用 _lock_nav_partitions。
+    """
+    end_year = end_year or date.today().year + 1
+    table = table if table is not None else NavHistory.__table__
+    table = f"{table.schema}.{table.name}"
+    for year in range(start_year, end_year + 1):
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {table}_y{year} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        ))
+    connection.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+
+def maintain_nav_partitions():
+    """分区模式下补齐到明年为止的年度分区；未启用分区或表尚未迁移时不做任何事。"""
+    if not NAV_PARTITIONED:
+        return
+    with engine.begin() as connection:
+        if _nav_table_kind(connection) == "p":
+            _lock_nav_partitions(connection)
+            ensure_nav_partitions(connection)
+
+def migrate_nav_history_to_partitions() -> int:
+    """
+    把已有的普通 fund_nav_history 表迁移为按年分区的分区表 (需设置 NAV_PARTITIONING=range)。
+    在一个事务中完成：旧表改名、创建分区表及索引、复制数据、删除旧表，失败时整体回滚。
+    已经是分区表时不做任何修改。返回迁移的行数。
+    """
+    if not NAV_PARTITIONED:
+        raise ValueError("请先设置环境变量 NAV_PARTITIONING=range 再执行迁移。")
+
+    table = f"{DB_SCHEMA}.{NavHistory.__tablename__}"
+    legacy = f"{NavHistory.__tablename__}_legacy"
+    with engine.begin() as connection:
+        connection.execute(text(f"CREATE SCHEMA IF NOT EXISTS {DB_SCHEMA}"))
+        _lock_nav_partitions(connection)
+        kind = _nav_table_kind(connection)
+        if kind == "p":
+            logger.info("fund_nav_history 已经是分区表，无需迁移。")
+            ensure_nav_partitions(connection)
+            return 0
+        if kind == "":
+            NavHistory.__table__.create(bind=connection)
+            ensure_nav_partitions(connection)
+            return 0
+
+        # 旧表的主键和索引与新表同名，改名后再建新表
+        connection.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+        connection.execute(text(f"ALTER TABLE {DB_SCHEMA}.{legacy} RENAME CONSTRAINT pk_fund_date TO pk_fund_date_legacy"))
+        min_year = connection.execute(text(f"SELECT EXTRACT(YEAR FROM MIN(nav_date))::int FROM {DB_SCHEMA}.{legacy}")).scalar()
+        NavHistory.__table__.create(bind=connection)
+        ensure_nav_partitions(connection, start_year=min(min_year or NAV_PARTITION_START_YEAR, NAV_PARTITION_START_YEAR))
+        migrated = connection.execute(text(
+            f"INSERT INTO {table} (code, nav_date, nav) SELECT code, nav_date, nav FROM {DB_SCHEMA}.{legacy}"
+        )).rowcount
+        connection.execute(text(f"DROP TABLE {DB_SCHEMA}.{legacy}"))
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text(f"ANALYZE {table}"))
+    logger.info(f"fund_nav_history 已迁移为分区表，共迁移 {migrated} 行。")
+    return migrated
+
 # 创建数据库表的函数 (可以在应用启动时调用一次)
 def create_db_and_tables():
     with engine.connect() as connection:
         connection.execute(text(f"CREATE SCHEMA IF NOT EXISTS {DB_SCHEMA}"))
         connection.commit()
+    if NAV_PARTITIONED:
+        with engine.begin() as connection:
+            _lock_nav_partitions(connection)
+            if _nav_table_kind(connection) == "r":
+                # 不自动迁移已有数据，需通过 cli migrate-nav-partitions 显式迁移
+                logger.warning("NAV_PARTITIONING=range，但 fund_nav_history 仍是普通表，请执行 `cli migrate-nav-partitions` 迁移。")
+            else:
+                NavHistory.__table__.create(bind=connection, checkfirst=True)
+                ensure_nav_partitions(connection)
     Base.metadata.create_all(bind=engine)
\ No newline at end of file
@@ -0,0 +1,134 @@
+# src/python_cli_starter/nav_archive.py
+import hashlib
+import logging
+import os
+import tempfile
+from datetime import date
+from typing import Iterable, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from .nav_cache import NavSeries
+from . import crud
+
+logger = logging.getLogger(__name__)
+
+# 净值归档目录：每只基金一个列式二进制文件，读取时内存映射，不经过 ORM 和 Decimal。
+# 由同步任务在写入净值后更新；留空则不使用归档，全部从数据库读取
+NAV_ARCHIVE_DIR = os.getenv("NAV_ARCHIVE_DIR", "").strip()
+
+# 文件格式：16 字节文件头 (魔数、版本、行数)，随后是 count 个 datetime64[D] 日期和 count 个 float64 净值，
+# 两列都是 8 字节对齐的连续数组，可以直接映射为 numpy 数组
+_MAGIC = b"NAVA"
+_VERSION = 1
+_HEADER = np.dtype([("magic", "S4"), ("version", "<u4"), ("count", "<u8")])
+
+
+def enabled() -> bool:
+    return bool(NAV_ARCHIVE_DIR)
+
+
+def _path(fund_code: str) -> str:
+    return os.path.join(NAV_ARCHIVE_DIR, f"{fund_code}.nav")
+
+
+def load_series(fund_code: str) -> Optional[NavSeries]:
+    """内存映射打开基金的归档，返回直接引用映射内存的净值序列；未启用归档、没有归档或文件损坏时返回 None。"""
+    if not enabled():
+        return None
+    path = _path(fund_code)
+    try:
+        mapped = np.memmap(path, dtype=np.uint8, mode="r")
+    except (FileNotFoundError, ValueError):
+        # ValueError: 空文件无法映射
+        return None
+    except OSError as e:
+        logger.warning(f"打开基金 {fund_code} 的净值归档失败: {e}")
+        return None
+
+    header = mapped[:_HEADER.itemsize].view(_HEADER)[0] if len(mapped) >= _HEADER.itemsize else None
+    count = int(header["count"]) if header is not None else -1
+    if header is None or header["magic"] != _MAGIC or header["version"] != _VERSION \
+            or len(mapped) != _HEADER.itemsize + count * 16:
+        logger.warning(f"基金 {fund_code} 的净值归档格式无效，已忽略: {path}")
+        return None
+
+    body = mapped[_HEADER.itemsize:]
+    dates = body[:count * 8].view("datetime64[D]")
+    navs = body[count * 8:].view(np.float64)
+    return NavSeries.from_arrays(dates, navs)
+
+
+def write_series(fund_code: str, series: NavSeries):
+    """整体写入基金的归档：先写临时文件再原子替换，已打开旧文件的读者不受影响。"""
+    os.makedirs(NAV_ARCHIVE_DIR, exist_ok=True)
+    header = np.zeros(1, dtype=_HEADER)
+    header["magic"], header["version"], header["count"] = _MAGIC, _VERSION, len(series)
+    fd, tmp_path = tempfile.mkstemp(dir=NAV_ARCHIVE_DIR, prefix=f".{fund_code}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header.tobytes())
+            f.write(np.ascontiguousarray(series.dates, dtype="datetime64[D]").tobytes())
+            f.write(np.ascontiguousarray(series.navs, dtype=np.float64).tobytes())
+        os.replace(tmp_path, _path(fund_code))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def remove(fund_codes: Optional[Iterable[str]] = None):
+    """删除指定基金 (为空时为全部基金) 的归档，数据库中的净值被删除时调用。"""
+    if not enabled() or not os.path.isdir(NAV_ARCHIVE_DIR):
+        return
+    if fund_codes is None:
+        fund_codes = [name[:-len(".nav")] for name in os.listdir(NAV_ARCHIVE_DIR) if name.endswith(".nav")]
+    for fund_code in fund_codes:
+        try:
+            os.remove(_path(fund_code))
+        except FileNotFoundError:
+            pass
+
+
+def extend(series: NavSeries, rows) -> NavSeries:
+    """把晚于归档最后一天的 (日期, 净值) 行接到序列末尾，没有新行时原样返回 (不复制)。"""
+    if not rows:
+        return series
+    return NavSeries.from_arrays(
+        np.concatenate([series.dates, np.array([row[0] for row in rows], dtype="datetime64[D]")]),
+        np.concatenate([series.navs, np.array([row[1] for row in rows], dtype=np.float64)]),
+    )
+
+
+def _checksum(series: NavSeries) -> str:
+    """与 crud.nav_checksum 相同格式的摘要 (净值按 numeric(10, 4) 的四位小数格式化)。"""
+    entries = ",".join(f"{d}:{v:.4f}" for d, v in zip(series.dates.astype("datetime64[D]").astype(str), series.navs))
+    return hashlib.md5(entries.encode()).hexdigest()
+
+
+def refresh(db: Session, fund_codes: Iterable[str]) -> int:
+    """
+    同步任务写入净值后更新这些基金的归档：归档范围内的数据与数据库一致时只在末尾追加新日期；
+    数据库中归档范围内的行数或摘要与归档不一致 (补写了中间日期、原地修正了净值) 或没有归档时从数据库完整重建。
+    返回更新的基金数。
+    """
+    if not enabled():
+        return 0
+    updated = 0
+    for fund_code in fund_codes:
+        archived = load_series(fund_code)
+        if archived is not None and len(archived):
+            last_date = archived.dates[-1].astype(date)
+            newer = crud.get_nav_since(db, fund_code, after=last_date)
+            if crud.nav_checksum(db, fund_code, until=last_date) == (len(archived), _checksum(archived)):
+                if not newer:
+                    continue
+                write_series(fund_code, extend(archived, newer))
+                updated += 1
+                continue
+        rows = crud.get_nav_since(db, fund_code, after=None)
+        if rows:
+            write_series(fund_code, extend(NavSeries.from_arrays([], []), rows))
+            updated += 1
+    return updated
@@ -0,0 +1,151 @@
+# src/python_cli_starter/nav_cache.py
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 缓存占用的内存上限 (MB)，超出后按最近最少使用 (LRU) 淘汰
+NAV_CACHE_MAX_MB = float(os.getenv("NAV_CACHE_MAX_MB", "64"))
+# 条目最长存活时间 (秒)。同步任务在其他进程 (如 CLI) 运行时无法通知本进程失效缓存，
+# 依靠这个 TTL 兜底，保证最迟在该时间后读到新数据。设为 0 表示不过期。
+NAV_CACHE_TTL_SECONDS = float(os.getenv("NAV_CACHE_TTL_SECONDS", "300"))
+
+
+@dataclass(frozen=True)
+class NavSeries:
+    """一只基金按日期升序排列的净值序列，dates 为 datetime64[D]，navs 为 float64，均为只读的连续数组。"""
+    dates: np.ndarray
+    navs: np.ndarray
+
+    @classmethod
+    def from_arrays(cls, dates, navs) -> "NavSeries":
+        dates = np.ascontiguousarray(dates, dtype="datetime64[D]")
+        navs = np.ascontiguousarray(navs, dtype=np.float64)
+        dates.flags.writeable = False
+        navs.flags.writeable = False
+        return cls(dates=dates, navs=navs)
+
+    def __len__(self) -> int:
+        return len(self.navs)
+
+    @property
+    def nbytes(self) -> int:
+        return self.dates.nbytes + self.navs.nbytes
+
+    def slice(self, start_date=None, end_date=None) -> "NavSeries":
+        """按日期闭区间 [start_date, end_date] 截取，返回共享底层内存的视图。"""
+        lo = np.searchsorted(self.dates, np.datetime64(start_date, "D"), side="left") if start_date else 0
+        hi = np.searchsorted(self.dates, np.datetime64(end_date, "D"), side="right") if end_date else len(self.dates)
+        return NavSeries(dates=self.dates[lo:hi], navs=self.navs[lo:hi])
+
+
+class NavSeriesCache:
+    """按基金代码缓存完整净值序列，按内存占用做 LRU 淘汰，并统计命中率。"""
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple[float, NavSeries]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.appends = 0
+
+    def _remove(self, fund_code: str):
+        _, series = self._entries.pop(fund_code)
+        self._bytes -= series.nbytes
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            oldest_code = next(iter(self._entries))
+            self._remove(oldest_code)
+            self.evictions += 1
+
+    def get(self, fund_code: str) -> Optional[NavSeries]:
+        with self._lock:
+            entry = self._entries.get(fund_code)
+            if entry is not None and self.ttl_seconds and time.monotonic() - entry[0] > self.ttl_seconds:
+                self._remove(fund_code)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(fund_code)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, fund_code: str, series: NavSeries):
+        if series.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if fund_code in self._entries:
+                self._remove(fund_code)
+            self._entries[fund_code] = (time.monotonic(), series)
+            self._bytes += series.nbytes
+            self._evict()
+
+    def invalidate(self, fund_code: Optional[str] = None):
+        """使某只基金 (为 None 时为全部基金) 的缓存失效。"""
+        with self._lock:
+            codes = [fund_code] if fund_code is not None else list(self._entries)
+            for code in codes:
+                if code in self._entries:
+                    self._remove(code)
+                    self.invalidations += 1
+
+    def append(self, fund_code: str, dates, navs):
+        """
+        同步任务写入新净值后调用：新日期全部晚于已缓存的最后一天时直接追加，
+        否则 (例如补写了中间缺失的日期) 使该基金的缓存失效，下次读取时重新加载。
+        未缓存的基金不做任何处理。
+        """
+        if len(navs) == 0:
+            return
+        new_series = NavSeries.from_arrays(dates, navs)
+        with self._lock:
+            entry = self._entries.get(fund_code)
+            if entry is None:
+                return
+            loaded_at, series = entry
+            if len(series) and new_series.dates[0] <= series.dates[-1]:
+                self._remove(fund_code)
+                self.invalidations += 1
+                return
+            merged = NavSeries.from_arrays(
+                np.concatenate([series.dates, new_series.dates]),
+                np.concatenate([series.navs, new_series.navs]),
+            )
+            self._entries[fund_code] = (loaded_at, merged)
+            self._bytes += merged.nbytes - series.nbytes
+            self.appends += 1
+            self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "avg_entry_bytes": self._bytes // len(self._entries) if self._entries else 0,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "appends": self.appends,
+            }
+
+
+nav_cache = NavSeriesCache(max_bytes=int(NAV_CACHE_MAX_MB * 1024 * 1024), ttl_seconds=NAV_CACHE_TTL_SECONDS)
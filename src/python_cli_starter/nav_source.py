@@ -0,0 +1,168 @@
+# src/python_cli_starter/nav_source.py
+import numpy as np
+import pandas as pd
+from datetime import date, timedelta
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import select, cast, Float
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .models import SessionLocal, ReadSessionLocal, NavHistory
+from .nav_cache import nav_cache, NavSeries
+from . import rate_limiter, crud, nav_archive
+
+logger = logging.getLogger(__name__)
+
+# 同一只基金多久 (秒) 最多记录一次查询时间，避免每次策略/图表请求都写库
+WATCHLIST_TOUCH_INTERVAL_SECONDS = float(os.getenv("WATCHLIST_TOUCH_INTERVAL_SECONDS", "600"))
+# 本地最新净值早于这么多天前时记录警告 (同步任务可能没有运行)，仍然使用本地数据
+NAV_STALE_DAYS = 7
+
+_touched_at: Dict[str, float] = {}
+_touch_lock = threading.Lock()
+
+
+def _nav_series_stmt(fund_code: str, after: Optional[date] = None):
+    """读取基金净值序列 (after 之后的部分) 的查询 (只查询 nav_date 和 nav 两列)。"""
+    # 在数据库中把 numeric 转为 double precision，驱动直接返回 float，不再逐行构造 Decimal
+    stmt = select(NavHistory.nav_date, cast(NavHistory.nav, Float).label("nav")).where(NavHistory.code == fund_code)
+    if after is not None:
+        stmt = stmt.where(NavHistory.nav_date > after)
+    return stmt.order_by(NavHistory.nav_date.asc())
+
+def _rows_to_series(rows) -> NavSeries:
+    """把 (nav_date, nav) 结果行直接填入预分配的 NumPy 数组，不构造中间列表。"""
+    count = len(rows)
+    return NavSeries.from_arrays(
+        np.fromiter((row[0] for row in rows), dtype="datetime64[D]", count=count),
+        np.fromiter((row[1] for row in rows), dtype=np.float64, count=count),
+    )
+
+def _archive_tail_date(archived: Optional[NavSeries]) -> Optional[date]:
+    return archived.dates[-1].astype(date) if archived is not None and len(archived) else None
+
+def _extend_archived(archived: NavSeries, rows) -> NavSeries:
+    return nav_archive.extend(archived, rows)
+
+def _load_series_from_db(db: Session, fund_code: str) -> NavSeries:
+    """
+    读取基金的完整净值序列。有净值归档 (NAV_ARCHIVE_DIR) 时直接内存映射归档，
+    只从 fund_nav_history 补读归档最后一天之后的净值 (通常为 0 行)；否则从数据库读取全部。
+    """
+    archived = nav_archive.load_series(fund_code)
+    tail_date = _archive_tail_date(archived)
+    if tail_date is not None:
+        return _extend_archived(archived, db.execute(_nav_series_stmt(fund_code, after=tail_date)).all())
+    return _rows_to_series(db.execute(_nav_series_stmt(fund_code)).all())
+
+def get_nav_series(fund_code: str, db: Optional[Session] = None) -> NavSeries:
+    """
+    获取本地数据库中基金的完整净值序列，优先命中进程内缓存。
+    本地没有数据时返回空序列 (空序列不会被缓存)。
+    """
+    series = nav_cache.get(fund_code)
+    if series is not None:
+        return series
+
+    if db is not None:
+        series = _load_series_from_db(db, fund_code)
+    else:
+        # 未传入会话时走只读副本 (未配置副本时为主库)
+        with ReadSessionLocal() as session:
+            series = _load_series_from_db(session, fund_code)
+    if len(series):
+        nav_cache.put(fund_code, series)
+    return series
+
+async def get_nav_series_async(fund_code: str, db: AsyncSession) -> NavSeries:
+    """
+    get_nav_series 的异步版本：未命中缓存时通过异步会话读库，不占用线程池。
+    读到的序列同样写入进程内缓存，随后在线程中运行的策略/图表可以直接命中。
+    """
+    series = nav_cache.get(fund_code)
+    if series is not None:
+        return series
+
+    archived = nav_archive.load_series(fund_code)
+    tail_date = _archive_tail_date(archived)
+    if tail_date is not None:
+        result = await db.execute(_nav_series_stmt(fund_code, after=tail_date))
+        series = _extend_archived(archived, result.all())
+    else:
+        result = await db.execute(_nav_series_stmt(fund_code))
+        series = _rows_to_series(result.all())
+    if len(series):
+        nav_cache.put(fund_code, series)
+    return series
+
+def series_to_dataframe(series: NavSeries) -> pd.DataFrame:
+    """把净值序列转换为以日期为索引、包含 close 列的 DataFrame。"""
+    index = pd.DatetimeIndex(series.dates, name='净值日期')
+    return pd.DataFrame({'close': series.navs}, index=index)
+
+def _load_from_akshare(fund_code: str) -> Optional[pd.DataFrame]:
+    """通过 akshare 下载基金的全部历史净值 (仅在本地没有该基金的数据或读取失败时使用)。"""
+    import akshare as ak  # akshare 导入较慢，只在真正需要回退到网络时才加载
+
+    rate_limiter.get_limiter("akshare").acquire()
+    fund_nav_df = ak.fund_open_fund_info_em(symbol=fund_code, indicator="单位净值走势")
+    fund_nav_df['净值日期'] = pd.to_datetime(fund_nav_df['净值日期'])
+    fund_nav_df = fund_nav_df.set_index('净值日期')
+    fund_nav_df = fund_nav_df[['单位净值']]
+    fund_nav_df.columns = ['close']
+    fund_nav_df['close'] = pd.to_numeric(fund_nav_df['close'])
+    return fund_nav_df.sort_index(ascending=True)
+
+def _touch_watchlist(fund_code: str):
+    """记录关注基金最近被查询的时间，同步任务按此决定关注基金的同步顺序。"""
+    now = time.monotonic()
+    with _touch_lock:
+        if now - _touched_at.get(fund_code, float("-inf")) < WATCHLIST_TOUCH_INTERVAL_SECONDS:
+            return
+        _touched_at[fund_code] = now
+    try:
+        with SessionLocal() as session:
+            crud.touch_watchlist(session, [fund_code])
+            session.commit()
+    except Exception as e:
+        logger.warning(f"记录基金 {fund_code} 的查询时间失败: {e}")
+
+def get_nav_dataframe(fund_code: str, days: Optional[int] = None) -> Optional[pd.DataFrame]:
+    """
+    获取基金的单位净值序列，返回以日期为索引、包含 close 列的升序 DataFrame。
+    优先读取本地数据库中最近 days 天 (为 None 时为全部历史) 的数据；本地有该基金的数据时总是使用本地数据
+    (即使已经过时，此时只记录警告)，只有本地完全没有该基金或读取失败时才回退到 akshare 下载。
+    获取失败时返回 None。
+    """
+    start_date = date.today() - timedelta(days=days) if days else None
+    _touch_watchlist(fund_code)
+
+    try:
+        series = get_nav_series(fund_code)
+    except Exception as e:
+        logger.error(f"从本地数据库读取基金 {fund_code} 的净值数据时发生错误，回退到 akshare 下载: {e}")
+        series = None
+    if series is not None and len(series):
+        latest_date = series.dates[-1].astype(date)
+        if latest_date < date.today() - timedelta(days=NAV_STALE_DAYS):
+            logger.warning(f"本地基金 {fund_code} 的净值最新只到 {latest_date}，请检查历史净值同步任务。")
+        series = series.slice(start_date=start_date)
+        logger.info(f"从本地数据读取基金 {fund_code} 的净值数据，共 {len(series)} 条记录。")
+        return series_to_dataframe(series)
+
+    if series is not None:
+        logger.info(f"本地没有基金 {fund_code} 的净值数据，回退到 akshare 下载全部历史。")
+    try:
+        fund_nav_df = _load_from_akshare(fund_code)
+    except Exception as e:
+        logger.error(f"通过 akshare 获取基金 {fund_code} 数据时发生错误: {e}")
+        return None
+
+    if start_date:
+        fund_nav_df = fund_nav_df[fund_nav_df.index >= pd.Timestamp(start_date)]
+    return fund_nav_df
@@ -0,0 +1,168 @@
+# src/python_cli_starter/rate_limiter.py
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，退化为进程内限流
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 各出站端点的默认预算: (每秒补充的令牌数, 桶容量/允许的突发请求数)
+# 可通过环境变量覆盖，格式为 "速率/容量"，例如 RATE_LIMIT_LSJZ="10/20"
+DEFAULT_BUDGETS: Dict[str, Tuple[float, int]] = {
+    "fundgz": (20.0, 40),   # 天天基金实时估值
+    "lsjz": (10.0, 20),     # 东方财富历史净值分页接口
+    "akshare": (2.0, 4),    # akshare 的整段历史下载
+    "sync_funds": (5.0, 10),  # 历史净值同步每秒开始处理的基金数 (同步任务的吞吐目标)
+}
+
+# 令牌桶状态文件所在目录。同一台机器上的多个进程 (API 服务、CLI 同步任务等)
+# 通过文件锁共享同一个桶；设置为空字符串则只在进程内限流。
+RATE_LIMIT_STATE_DIR = os.getenv("RATE_LIMIT_STATE_DIR", os.path.join(tempfile.gettempdir(), "fund_rate_limits"))
+
+
+def _parse_budget(name: str) -> Tuple[float, int]:
+    default_rate, default_capacity = DEFAULT_BUDGETS.get(name, (5.0, 10))
+    raw = os.getenv(f"RATE_LIMIT_{name.upper()}")
+    if not raw:
+        return default_rate, default_capacity
+    try:
+        rate_str, _, capacity_str = raw.partition("/")
+        rate = float(rate_str)
+        capacity = int(capacity_str) if capacity_str else max(1, int(rate))
+        if rate <= 0 or capacity <= 0:
+            raise ValueError
+        return rate, capacity
+    except ValueError:
+        logger.warning(f"环境变量 RATE_LIMIT_{name.upper()}='{raw}' 格式无效，使用默认预算 {default_rate}/{default_capacity}。")
+        return default_rate, default_capacity
+
+
+class TokenBucket:
+    """
+    令牌桶限流器。
+    每次调用先"预留"一个令牌 (允许透支)，再按透支量计算需要等待的时间，
+    因此同步线程和协程都可以共用同一个桶，且等待是公平排队的。
+    """
+
+    def __init__(self, name: str, rate: float, capacity: int, state_dir: Optional[str] = None):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._tokens = float(capacity)
+        self._updated_at = time.time()
+        self._state_path = None
+        if state_dir and fcntl is not None:
+            try:
+                os.makedirs(state_dir, exist_ok=True)
+                self._state_path = os.path.join(state_dir, f"{name}.bucket")
+            except OSError as e:
+                logger.warning(f"无法创建限流状态目录 {state_dir}，'{name}' 将只在进程内限流: {e}")
+
+        self._calls = 0
+        self._waited_calls = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _take(self, tokens: float, updated_at: float, now: float) -> Tuple[float, float]:
+        tokens = min(float(self.capacity), tokens + max(0.0, now - updated_at) * self.rate)
+        return tokens - 1, max(0.0, (1 - tokens) / self.rate)
+
+    def _reserve_shared(self) -> float:
+        with open(self._state_path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                now = time.time()
+                tokens, wait = self._take(state.get("tokens", float(self.capacity)), state.get("updated_at", now), now)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({"tokens": tokens, "updated_at": now}))
+                f.flush()
+                return wait
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _reserve(self) -> float:
+        """预留一个令牌，返回调用方需要等待的秒数。"""
+        with self._lock:
+            if self._state_path:
+                try:
+                    return self._reserve_shared()
+                except OSError as e:
+                    logger.warning(f"读写限流状态文件失败，'{self.name}' 改为进程内限流: {e}")
+                    self._state_path = None
+            now = time.time()
+            self._tokens, wait = self._take(self._tokens, self._updated_at, now)
+            self._updated_at = now
+            return wait
+
+    def _record(self, wait: float):
+        with self._lock:
+            self._calls += 1
+            if wait > 0:
+                self._waited_calls += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+
+    def acquire(self) -> float:
+        """阻塞直到拿到一个令牌，返回实际等待的秒数。"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        self._record(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        """acquire 的协程版本，等待期间不阻塞事件循环。"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._record(wait)
+        return wait
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rate_per_second": self.rate,
+                "capacity": self.capacity,
+                "shared_across_processes": self._state_path is not None,
+                "calls": self._calls,
+                "waited_calls": self._waited_calls,
+                "total_wait_seconds": round(self._total_wait, 3),
+                "max_wait_seconds": round(self._max_wait, 3),
+                "avg_wait_ms": round(self._total_wait / self._calls * 1000, 2) if self._calls else 0.0,
+            }
+
+
+_limiters: Dict[str, TokenBucket] = {}
+_registry_lock = threading.Lock()
+
+def get_limiter(name: str) -> TokenBucket:
+    """获取 (必要时创建) 指定端点的令牌桶。"""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _registry_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                rate, capacity = _parse_budget(name)
+                limiter = _limiters[name] = TokenBucket(name, rate, capacity, state_dir=RATE_LIMIT_STATE_DIR)
+    return limiter
+
+def get_all_stats() -> Dict[str, Dict[str, Any]]:
+    """返回所有端点限流器的预算和等待统计。"""
+    names = list(DEFAULT_BUDGETS) + [name for name in _limiters if name not in DEFAULT_BUDGETS]
+    return {name: get_limiter(name).stats() for name in names}
@@ -1,72 +1,141 @@
 # src/python_cli_starter/scheduler.py (修改后)
-import time
-from datetime import date, timedelta, datetime
-from sqlalchemy import func
+from datetime import datetime, date, time as dtime
+from sqlalchemy import select
+import asyncio
 import logging
+import os
+from typing import Optional
 
-from .models import SessionLocal, Holding, NavHistory
-from .data_fetcher import fetch_fund_history, fetch_fund_realtime_estimate
+from .models import SessionLocal, Holding, maintain_nav_partitions
+from . import rate_limiter, crud
+from .data_fetcher import fetch_fund_realtime_estimates, to_china_time
+from .sync_pipeline import NavSyncPipeline, SyncJobQueue, SYNC_NODE_ID, SYNC_LEASE_SECONDS
+from . import trading_calendar, indicators, nav_archive
 
 logger = logging.getLogger(__name__)
 
-def update_all_nav_history():
-    """手动任务：增量更新所有持仓基金的历史净值，并校准持仓金额。"""
+# 是否在 API 服务进程内运行定时任务
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+# 历史净值同步是否包含关注列表中的基金
+SYNC_INCLUDE_WATCHLIST = os.getenv("SYNC_INCLUDE_WATCHLIST", "true").lower() in ("1", "true", "yes", "on")
+# 交易时段内刷新盘中估值的间隔 (分钟)
+ESTIMATE_INTERVAL_MINUTES = float(os.getenv("ESTIMATE_INTERVAL_MINUTES", "5"))
+# 交易日当晚基金公司公布净值后，执行历史净值同步的时间 (北京时间, HH:MM)
+NAV_SYNC_TIME = os.getenv("NAV_SYNC_TIME", "21:30")
+# 调度循环的检查间隔 (秒)。每次检查只比较时间，不访问网络和数据库
+SCHEDULER_TICK_SECONDS = 30
+
+def _open_sync_run(db, include_watchlist: bool, resume: bool, only_failed: bool) -> Optional[int]:
+    """
+    在咨询锁保护下决定本节点参与哪个同步任务：
+    - 最近的任务仍有节点在处理 (刚创建或有未过期的租约)：加入该任务，与其他节点分摊基金；
+    - resume：续跑最近一次未完成的任务，把其中失败和暂缓的基金重新放回队列，连同未完成的基金一起处理；
+    - only_failed：续跑最近一次任务，只把失败的基金放回队列，其余未完成的基金暂缓 (deferred)，本次不会被任何节点领取；
+    - 否则按 同步范围 (持仓基金在前，关注基金按最近查询时间在后) 新建任务，没有需要同步的基金时返回 None。
+    调用方负责提交事务 (同时释放咨询锁)。
+    """
+    crud.lock_sync_runs(db)
+    last_run = crud.get_latest_sync_run(db)
+    if last_run is not None and crud.sync_run_is_active(db, last_run, SYNC_LEASE_SECONDS):
+        logger.info(f"同步任务 #{last_run.id} 正在其他节点执行，加入该任务共同处理。")
+        return last_run.id
+
+    if (resume or only_failed) and last_run is not None and (only_failed or last_run.status != "completed"):
+        if only_failed:
+            deferred = crud.defer_sync_items(db, last_run.id)
+            requeued = crud.requeue_sync_items(db, last_run.id, ["failed"])
+            detail = f"另有 {deferred} 只未完成的基金暂缓，可稍后用 --resume 处理" if deferred else "没有其他未完成的基金"
+        else:
+            requeued = crud.requeue_sync_items(db, last_run.id, ["failed", "deferred"])
+            detail = "并继续处理未完成的基金"
+        crud.reopen_sync_run(db, last_run.id)
+        logger.info(f"续跑同步任务 #{last_run.id} (原状态: {last_run.status})，重新排队 {requeued} 只"
+                    f"{'失败' if only_failed else '失败或暂缓'}的基金，{detail}。")
+        return last_run.id
+    if resume or only_failed:
+        logger.info("没有可续跑的同步任务，将新建同步任务。")
+
+    codes = crud.get_sync_universe(db, include_watchlist=include_watchlist)
+    if not codes:
+        return None
+    fund_rate = rate_limiter.get_limiter("sync_funds").rate
+    logger.info(f"新建同步任务: 共 {len(codes)} 只基金，吞吐目标 {fund_rate:g} 只/秒，"
+                f"全部需要请求时预计至少 {len(codes) / fund_rate:.0f} 秒。")
+    return crud.create_sync_run(db, codes)
+
+def _refresh_indicators(db, codes):
+    """同步后的指标计算：只为新写入的日期计算指标。失败不影响同步结果，策略和图表会回退到现场计算。"""
+    try:
+        written = indicators.refresh_indicators(db, codes)
+        db.commit()
+        logger.info(f"已为 {len(codes)} 只基金增量计算技术指标，写入 {written} 行。")
+    except Exception:
+        db.rollback()
+        logger.exception("增量计算技术指标失败，将在下次同步时重试。")
+
+def _refresh_nav_archive(db, codes):
+    """同步后更新净值归档。失败不影响同步结果，读取时会从数据库补读归档之后的净值。"""
+    if not nav_archive.enabled():
+        return
+    try:
+        updated = nav_archive.refresh(db, codes)
+        db.commit()
+        logger.info(f"已更新 {updated} 只基金的净值归档 ({nav_archive.NAV_ARCHIVE_DIR})。")
+    except Exception:
+        db.rollback()
+        logger.exception("更新净值归档失败，将在下次同步时重试。")
+
+def update_all_nav_history(workers: Optional[int] = None, resume: bool = False, only_failed: bool = False,
+                           include_watchlist: Optional[bool] = None):
+    """
+    手动任务：增量更新所有持仓基金 (以及关注列表中的基金) 的历史净值，并校准持仓金额。
+    include_watchlist 为空时取 SYNC_INCLUDE_WATCHLIST；持仓基金总是最先同步。
+    开始同步每只基金的速度受 sync_funds 限流器 (RATE_LIMIT_SYNC_FUNDS) 控制。
+    多只基金由抓取线程池并发下载，单个写库线程批量写入，workers 为空时取 SYNC_WORKERS。
+    每次执行都会在 sync_runs / sync_run_items 中记录进度，sync_run_items 同时作为任务队列：
+    多个节点 (容器) 同时执行时会加入同一个任务，用 FOR UPDATE SKIP LOCKED 分摊基金，互不重复。
+    resume=True 时续跑最近一次未完成的任务 (跳过已完成的基金)，only_failed=True 时只重试最近一次任务中失败的基金，
+    该任务中其余未完成的基金暂缓 (deferred)，不会被本节点或加入的其他节点领取。
+    未完成的基金都从数据库中的最新净值日期之后继续获取，由于净值按日期升序写入，中断后续跑不会留下缺口。
+    """
     logger.info("开始执行任务：更新历史净值与持仓金额校准...")
     db = SessionLocal()
     try:
-        holdings = db.query(Holding).all()
-        if not holdings:
-            logger.info("没有持仓基金，任务结束。")
+        # 长期运行的服务跨年时，保证新一年的分区在写入前已经存在
+        maintain_nav_partitions()
+        if include_watchlist is None:
+            include_watchlist = SYNC_INCLUDE_WATCHLIST
+        run_id = _open_sync_run(db, include_watchlist, resume, only_failed)
+        db.commit()
+        if run_id is None:
+            logger.info("没有需要同步的基金 (持仓和关注列表均为空)，任务结束。")
             return
 
-        for holding in holdings:
-            logger.info(f"--- 正在处理基金: {holding.name} ({holding.code}) ---")
-            
-            latest_date_in_db = db.query(func.max(NavHistory.nav_date)).filter(NavHistory.code == holding.code).scalar()
-            start_date_to_fetch = None
-            if latest_date_in_db:
-                start_date_to_fetch = (latest_date_in_db + timedelta(days=1)).strftime('%Y-%m-%d')
-                logger.info(f"数据库中最新净值日期为: {latest_date_in_db}，将从 {start_date_to_fetch} 开始获取新数据。")
-            else:
-                logger.info("数据库中无此基金历史数据，将获取全部历史。")
-
-            history_data_raw = fetch_fund_history(holding.code, start_date=start_date_to_fetch)
-            if not history_data_raw:
-                logger.warning(f"未能获取到基金 {holding.code} 的新历史数据。")
-                continue
-
-            new_nav_records = []
-            for record in history_data_raw:
-                nav_date = date.fromisoformat(record['FSRQ'])
-                if latest_date_in_db and nav_date <= latest_date_in_db:
-                    continue
-                try:
-                    float(record['JZZZL']) 
-                except (ValueError, TypeError):
-                    logger.warning(f"跳过无效记录: 基金 {holding.code}, 日期 {nav_date}, 净值 {record['DWJZ']}, 涨跌幅 {record['JZZZL']}")
-                    continue
-                new_nav_records.append(NavHistory(code=holding.code, nav_date=nav_date, nav=float(record['DWJZ'])))
-
-            if not new_nav_records:
-                logger.info(f"基金 {holding.code} 没有新的净值记录需要添加。")
-                continue
+        target_date = trading_calendar.latest_published_nav_date()
+        logger.info(f"同步任务 #{run_id}: 节点 {SYNC_NODE_ID} 开始领取基金，最新可能公布的净值日期为 {target_date}。")
+        job_queue = SyncJobQueue(db, run_id, target_date=target_date)
+        report = NavSyncPipeline(workers=workers, run_id=run_id).run(db=db, job_queue=job_queue)
+        logger.info(f"本节点共领取 {job_queue.claimed_count} 只基金，其中 {job_queue.skipped_count} 只已是最新。")
 
-            logger.info(f"发现 {len(new_nav_records)} 条新净值记录，正在批量插入数据库...")
-            db.add_all(new_nav_records)
+        updated_codes = report.updated_codes
+        if updated_codes:
+            # 本节点写完后，用一条语句按最新净值统一校准它更新过的基金的持仓金额
+            recalibrated = crud.recalibrate_holdings(db, updated_codes)
             db.commit()
-            logger.info(f"基金 {holding.code} 的历史净值更新成功！")
-            time.sleep(1)
-            
-            latest_nav_record = db.query(NavHistory).filter(NavHistory.code == holding.code).order_by(NavHistory.nav_date.desc()).first()
-            if latest_nav_record:
-                latest_actual_nav = float(latest_nav_record.nav)
-                new_holding_amount = float(holding.shares) * latest_actual_nav
-                holding.holding_amount = new_holding_amount
-                holding.yesterday_nav = latest_actual_nav
-                logger.info(f"基金 {holding.code} 的持仓已校准：最新净值 {latest_actual_nav}, 最新金额 {new_holding_amount:.2f}")
+            logger.info(f"已按最新净值校准 {recalibrated} 只基金的持仓金额。")
+            _refresh_indicators(db, updated_codes)
+            _refresh_nav_archive(db, updated_codes)
 
+        crud.lock_sync_runs(db)
+        run_status = crud.finish_sync_run(db, run_id)
         db.commit()
-        logger.info("\n所有基金的历史净值更新与持仓金额校准任务已全部完成。")
+        lsjz_stats = rate_limiter.get_limiter("lsjz").stats()
+        logger.info(f"限流统计 (lsjz): 请求 {lsjz_stats['calls']} 次，其中 {lsjz_stats['waited_calls']} 次等待，累计等待 {lsjz_stats['total_wait_seconds']} 秒。")
+        if run_status is None:
+            logger.info(f"\n本节点已处理完可领取的基金，同步任务 #{run_id} 仍有基金在其他节点处理中。{report.summary()}")
+        else:
+            logger.info(f"\n同步任务 #{run_id} 结束 ({run_status})。{report.summary()}")
+        return report
     except Exception as e:
         db.rollback()
         logger.exception("更新历史净值时发生严重错误。")
@@ -76,31 +145,101 @@ def update_all_nav_history():
 def update_today_estimate():
     """手动任务：更新今日估值、估算金额、涨跌幅和更新时间。"""
     logger.info("开始执行任务：更新今日估值...")
+    if not trading_calendar.is_trading_day():
+        logger.info("今天不是交易日，没有新的盘中估值，跳过。")
+        return
     db = SessionLocal()
     try:
-        holdings = db.query(Holding).all()
+        # 只取计算所需的列，不加载 ORM 对象
+        holdings = db.execute(select(Holding.code, Holding.shares, Holding.today_estimate_update_time)).all()
+        estimates = fetch_fund_realtime_estimates(holding.code for holding in holdings)
+
+        changed_rows = []
+        unchanged_count = 0
         for holding in holdings:
-            realtime_data = fetch_fund_realtime_estimate(holding.code)
+            realtime_data = estimates.get(holding.code)
             if realtime_data and 'gsz' in realtime_data:
                 try:
                     estimate_nav = float(realtime_data['gsz'])
                     change_pct = float(realtime_data['gszzl'])
-                    update_time_str = realtime_data['gztime']
-                    update_time = datetime.fromisoformat(update_time_str)
-                    estimate_amount = float(holding.shares) * estimate_nav
-
-                    holding.today_estimate_nav = estimate_nav
-                    holding.percentage_change = change_pct
-                    holding.today_estimate_update_time = update_time
-                    holding.today_estimate_amount = estimate_amount
-                    logger.info(f"基金 {holding.code} 已更新，估值: {estimate_nav}, 估算金额: {estimate_amount:.2f}")
+                    update_time = to_china_time(datetime.fromisoformat(realtime_data['gztime']))
                 except (ValueError, TypeError) as e:
                     logger.error(f"处理基金 {holding.code} 的实时数据时出错: {e}")
-        
+                    continue
+
+                # 估值时间没变说明上次轮询后估值没有更新，不必重写这一行
+                previous_time = holding.today_estimate_update_time
+                if previous_time is not None and to_china_time(previous_time) == update_time:
+                    unchanged_count += 1
+                    continue
+
+                estimate_amount = float(holding.shares) * estimate_nav
+                changed_rows.append({
+                    'code': holding.code, 'today_estimate_nav': estimate_nav,
+                    'today_estimate_amount': round(estimate_amount, 2), 'percentage_change': change_pct,
+                    'today_estimate_update_time': update_time,
+                })
+                logger.info(f"基金 {holding.code} 已更新，估值: {estimate_nav}, 估算金额: {estimate_amount:.2f}")
+
+        updated_count = crud.bulk_update_estimates(db, changed_rows)
         db.commit()
-        logger.info("今日估值更新完成。")
+        logger.info(f"今日估值更新完成。更新 {updated_count} 只，估值未变化 {unchanged_count} 只。")
     except Exception as e:
         db.rollback()
         logger.exception("更新今日估值时发生错误。")
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def _parse_sync_time(value: str) -> dtime:
+    try:
+        hour, minute = value.split(":")
+        return dtime(int(hour), int(minute))
+    except ValueError:
+        logger.warning(f"NAV_SYNC_TIME='{value}' 格式无效，使用默认值 21:30。")
+        return dtime(21, 30)
+
+async def run_scheduler():
+    """
+    进程内的定时任务循环，由 FastAPI 的 lifespan 启动和取消：
+    - 交易日的交易时段内，每 ESTIMATE_INTERVAL_MINUTES 分钟刷新一次盘中估值；
+    - 交易日的 NAV_SYNC_TIME 之后，执行一次历史净值同步；
+    - 周末和节假日不做任何网络或数据库操作。
+    任务本身是同步代码，放到线程池中执行，不阻塞事件循环。
+    """
+    sync_time = _parse_sync_time(NAV_SYNC_TIME)
+    estimate_interval = ESTIMATE_INTERVAL_MINUTES * 60
+    logger.info(f"定时任务已启动: 交易时段内每 {ESTIMATE_INTERVAL_MINUTES:g} 分钟刷新估值，交易日 {sync_time:%H:%M} 后同步历史净值。")
+
+    checked_day: Optional[date] = None
+    trading_today = False
+    last_estimate_at: Optional[float] = None
+    last_nav_sync_day: Optional[date] = None
+    loop = asyncio.get_running_loop()
+
+    while True:
+        try:
+            now = trading_calendar.now_in_china()
+            today = now.date()
+            if today != checked_day:
+                # 每天只查一次日历；首次查询可能需要通过 akshare 下载，放到线程里执行
+                trading_today = await asyncio.to_thread(trading_calendar.is_trading_day, today)
+                checked_day = today
+                logger.info(f"{today} {'是' if trading_today else '不是'}交易日。")
+
+            if trading_today:
+                if trading_calendar.in_trading_session(now) and (
+                    last_estimate_at is None or loop.time() - last_estimate_at >= estimate_interval
+                ):
+                    last_estimate_at = loop.time()
+                    await asyncio.to_thread(update_today_estimate)
+
+                if now.time() >= sync_time and last_nav_sync_day != today:
+                    last_nav_sync_day = today
+                    await asyncio.to_thread(update_all_nav_history)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("定时任务执行时发生错误。")
+
+        await asyncio.sleep(SCHEDULER_TICK_SECONDS)
@@ -1,6 +1,6 @@
 # schemas.py
 from pydantic import BaseModel, ConfigDict
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime, date
 from enum import Enum
 
@@ -25,6 +25,17 @@ class Holding(BaseModel):
 class HoldingUpdate(BaseModel):
     holding_amount: float
 
+class WatchlistAdd(BaseModel):
+    codes: List[str]
+
+class WatchlistItem(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    code: str
+    name: Optional[str] = None
+    added_at: datetime
+    last_queried_at: Optional[datetime] = None
+
 
 class SignalType(str, Enum):
     BUY = "买入"
@@ -1,9 +1,12 @@
 # services.py
-from . import models, schemas, data_fetcher
+from . import models, schemas, crud, data_fetcher, nav_source, nav_archive, downsample
+from .nav_cache import nav_cache, NavSeries
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import date, datetime
+import numpy as np
 import pandas as pd
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
@@ -54,7 +57,7 @@ def create_new_holding(db: Session, holding_data: schemas.HoldingCreate) -> mode
             change_pct = float(realtime_data.get('gszzl'))
             update_time_str = realtime_data.get('gztime')
             if update_time_str:
-                update_time = datetime.fromisoformat(update_time_str)
+                update_time = data_fetcher.to_china_time(datetime.fromisoformat(update_time_str))
             if estimate_nav is not None:
                 estimate_amount = initial_shares * estimate_nav
         except (ValueError, TypeError) as e:
@@ -100,7 +103,7 @@ def update_holding_amount(db: Session, code: str, new_amount: float) -> models.H
             estimate_nav = float(realtime_data.get('gsz'))
             change_pct = float(realtime_data.get('gszzl'))
             update_time_str = realtime_data.get('gztime')
-            update_time = datetime.fromisoformat(update_time_str) if update_time_str else None
+            update_time = data_fetcher.to_china_time(datetime.fromisoformat(update_time_str)) if update_time_str else None
             estimate_amount = new_shares * estimate_nav if estimate_nav is not None else None
 
             holding_to_update.today_estimate_nav = estimate_nav
@@ -118,43 +121,82 @@ def update_holding_amount(db: Session, code: str, new_amount: float) -> models.H
     logger.info(f"成功更新持仓: {code}, 新金额: {new_amount}, 新份额: {new_shares:.4f}")
     return holding_to_update
 
+def _delete_nav_data(db: Session, codes: List[str]):
+    """删除这些基金的历史净值、技术指标、净值缓存和归档。不提交事务。"""
+    if not codes:
+        return
+    db.query(models.NavHistory).filter(models.NavHistory.code.in_(codes)).delete(synchronize_session=False)
+    crud.delete_indicators(db, codes)
+    for code in codes:
+        nav_cache.invalidate(code)
+    nav_archive.remove(codes)
+
 def delete_holding_by_code(db: Session, code: str):
-    """根据基金代码删除一个持仓记录及其所有相关的历史净值数据。"""
+    """根据基金代码删除一个持仓记录及其所有相关的历史净值数据 (基金仍在关注列表中时保留历史净值)。"""
     logger.info(f"准备删除基金 {code} 的所有记录。")
     holding_to_delete = db.query(models.Holding).filter(models.Holding.code == code).first()
     if not holding_to_delete:
         raise HoldingNotFoundError(code=code)
     
-    db.query(models.NavHistory).filter(models.NavHistory.code == code).delete(synchronize_session=False)
-    logger.info(f"已删除基金 {code} 的所有历史净值数据。")
+    if code in crud.get_watchlist_codes(db):
+        logger.info(f"基金 {code} 仍在关注列表中，保留其历史净值数据。")
+    else:
+        _delete_nav_data(db, [code])
+        logger.info(f"已删除基金 {code} 的所有历史净值数据。")
     
     db.delete(holding_to_delete)
     db.commit()
     logger.info(f"已删除基金 {code} 的持仓记录。")
 
+def moving_averages(navs: np.ndarray, windows: List[int]) -> Dict[int, np.ndarray]:
+    """
+    基于一次累加和计算多个窗口的简单移动平均，结果与 rolling(window).mean() 一致 (前 window - 1 个位置为 NaN)。
+    """
+    cumsum = np.concatenate(([0.0], np.cumsum(navs, dtype=np.float64)))
+    result = {}
+    for window in windows:
+        ma = np.full(len(navs), np.nan)
+        if window <= len(navs):
+            ma[window - 1:] = (cumsum[window:] - cumsum[:-window]) / window
+        result[window] = ma
+    return result
+
+def _history_frame(series: NavSeries, start_date: Optional[date], end_date: Optional[date],
+                   ma_options: Optional[List[int]], max_points: Optional[int] = None) -> pd.DataFrame:
+    """截取日期范围内的净值，并计算指定的移动平均线；指定 max_points 时按净值曲线 (LTTB) 降采样到该点数。"""
+    series = series.slice(start_date, end_date)
+    if not len(series):
+        return pd.DataFrame()
+
+    windows = [ma for ma in (ma_options or []) if isinstance(ma, int) and ma > 0]
+    # 均线在降采样之前用全部数据计算
+    averages = moving_averages(series.navs, windows)
+    columns = {'nav': series.navs, **{f'ma{window}': averages[window] for window in windows}}
+    dates = series.dates
+    if max_points and len(series) > max_points:
+        indices = downsample.lttb_indices(dates.astype(np.int64), series.navs, max_points)
+        dates = dates[indices]
+        columns = {name: values[indices] for name, values in columns.items()}
+    # 所有列一次性构造 DataFrame，避免逐列插入
+    return pd.DataFrame({'date': dates.astype('datetime64[ns]'), **columns})
+
 def get_history_with_ma(
     db: Session, code: str, start_date: Optional[date] = None, 
-    end_date: Optional[date] = None, ma_options: Optional[List[int]] = None
+    end_date: Optional[date] = None, ma_options: Optional[List[int]] = None,
+    max_points: Optional[int] = None
 ) -> pd.DataFrame:
     """获取指定基金的历史净值，并计算指定的移动平均线。"""
-    query = db.query(models.NavHistory).filter(models.NavHistory.code == code)
-    if start_date:
-        query = query.filter(models.NavHistory.nav_date >= start_date)
-    if end_date:
-        query = query.filter(models.NavHistory.nav_date <= end_date)
-    
-    history_records = query.order_by(models.NavHistory.nav_date.asc()).all()
-    if not history_records:
-        return pd.DataFrame()
+    # 完整序列来自进程内的净值缓存，这里只截取所需的日期范围
+    return _history_frame(nav_source.get_nav_series(code, db=db), start_date, end_date, ma_options, max_points)
 
-    df = pd.DataFrame([(record.nav_date, float(record.nav)) for record in history_records], columns=['date', 'nav'])
-    df['date'] = pd.to_datetime(df['date'])
-    
-    if ma_options:
-        for ma in ma_options:
-            if isinstance(ma, int) and ma > 0:
-                df[f'ma{ma}'] = df['nav'].rolling(window=ma).mean()
-    return df
+async def get_history_with_ma_async(
+    db: AsyncSession, code: str, start_date: Optional[date] = None,
+    end_date: Optional[date] = None, ma_options: Optional[List[int]] = None,
+    max_points: Optional[int] = None
+) -> pd.DataFrame:
+    """get_history_with_ma 的异步版本，未命中缓存时通过异步会话读库。"""
+    series = await nav_source.get_nav_series_async(code, db)
+    return _history_frame(series, start_date, end_date, ma_options, max_points)
 
 def export_holdings_data(db: Session) -> List[Dict[str, Any]]:
     """导出所有持仓数据。"""
@@ -168,13 +210,15 @@ def import_holdings_data(db: Session, data_to_import: List[Dict[str, Any]], over
     """导入持仓数据。"""
     if overwrite:
         logger.info("覆盖模式已启用，正在删除所有现有持仓数据...")
-        db.query(models.NavHistory).delete()
+        # 关注列表中的基金仍会被同步，保留它们的历史净值、指标和归档
+        _delete_nav_data(db, crud.get_nav_codes(db, exclude=crud.get_watchlist_codes(db)))
         db.query(models.Holding).delete()
-        logger.info("所有旧数据已删除。")
+        logger.info("所有旧数据已删除 (关注列表中基金的历史净值已保留)。")
     
     imported_count = 0
     skipped_count = 0
-    
+
+    valid_items = []
     for item in data_to_import:
         code = item.get("code")
         shares = item.get("shares")
@@ -183,15 +227,26 @@ def import_holdings_data(db: Session, data_to_import: List[Dict[str, Any]], over
             logger.warning(f"跳过无效的导入记录: {item}")
             skipped_count += 1
             continue
-            
-        if not overwrite:
-            existing = db.query(models.Holding).filter_by(code=code).first()
-            if existing:
-                logger.info(f"基金 {code} 已存在，跳过导入。")
-                skipped_count += 1
-                continue
-        
-        realtime_data = data_fetcher.fetch_fund_realtime_estimate(code)
+        valid_items.append((code, shares))
+
+    existing_codes = set()
+    if not overwrite and valid_items:
+        codes = [code for code, _ in valid_items]
+        existing_codes = {row.code for row in db.query(models.Holding.code).filter(models.Holding.code.in_(codes))}
+
+    items_to_fetch = []
+    for code, shares in valid_items:
+        if code in existing_codes:
+            logger.info(f"基金 {code} 已存在，跳过导入。")
+            skipped_count += 1
+            continue
+        items_to_fetch.append((code, shares))
+
+    # 一次性并发获取所有待导入基金的实时信息
+    realtime_by_code = data_fetcher.fetch_fund_realtime_estimates(code for code, _ in items_to_fetch)
+
+    for code, shares in items_to_fetch:
+        realtime_data = realtime_by_code.get(code)
         if not realtime_data:
             logger.warning(f"无法获取基金 {code} 的信息，跳过导入。")
             skipped_count += 1
@@ -217,4 +272,29 @@ def import_holdings_data(db: Session, data_to_import: List[Dict[str, Any]], over
 
     db.commit()
     logger.info(f"数据导入事务已提交。导入: {imported_count}, 跳过: {skipped_count}")
-    return imported_count, skipped_count
\ No newline at end of file
+    return imported_count, skipped_count
+
+
+class WatchlistNotFoundError(Exception):
+    def __init__(self, code: str):
+        self.code = code
+        super().__init__(f"基金代码 '{code}' 不在关注列表中。")
+
+def add_to_watchlist(db: Session, codes: List[str]) -> Tuple[int, int]:
+    """把一批基金加入关注列表，名称通过一次批量的实时估值请求获取 (获取不到时留空)。"""
+    codes = list(dict.fromkeys(code.strip() for code in codes if code and code.strip()))
+    if not codes:
+        return 0, 0
+    realtime_by_code = data_fetcher.fetch_fund_realtime_estimates(codes)
+    items = [{'code': code, 'name': (realtime_by_code.get(code) or {}).get('name')} for code in codes]
+    added = crud.add_watchlist_items(db, items)
+    db.commit()
+    logger.info(f"关注列表已更新。新增: {added}, 已存在: {len(codes) - added}")
+    return added, len(codes) - added
+
+def remove_from_watchlist(db: Session, code: str):
+    """把基金移出关注列表，已同步的历史净值会保留。"""
+    if not crud.delete_watchlist_item(db, code):
+        raise WatchlistNotFoundError(code=code)
+    db.commit()
+    logger.info(f"已将基金 {code} 移出关注列表。")
@@ -1,11 +1,11 @@
 # src/python_cli_starter/strategies/bollinger_bands_strategy.py
 
-import akshare as ak
 import pandas as pd
-from datetime import datetime, timedelta
 import logging
 from typing import Dict, Any
 
+from .. import nav_source, indicators
+
 logger = logging.getLogger(__name__)
 
 # --- 策略常量 ---
@@ -16,29 +16,16 @@ def get_latest_fund_data(fund_symbol: str) -> pd.DataFrame:
     """获取基金最近200天的净值数据"""
     logger.info(f"[BBands Strategy] 正在为基金 {fund_symbol} 获取最新净值数据...")
     # 缓冲期增加到200天以确保50周期计算的稳定性
-    start_date = (datetime.today() - timedelta(days=200)).strftime('%Y%m%d')
-    
-    try:
-        fund_nav_df = ak.fund_open_fund_info_em(symbol=fund_symbol, indicator="单位净值走势")
-        fund_nav_df['净值日期'] = pd.to_datetime(fund_nav_df['净值日期'])
-        fund_nav_df = fund_nav_df.set_index('净值日期')
-        fund_nav_df = fund_nav_df[['单位净值']]
-        fund_nav_df.columns = ['close']
-        fund_nav_df['close'] = pd.to_numeric(fund_nav_df['close'])
-        
-        fund_nav_df = fund_nav_df[fund_nav_df.index >= start_date].sort_index(ascending=True)
-        
-        if fund_nav_df.empty or len(fund_nav_df) < BBANDS_PERIOD + 1:
-            logger.warning(f"[BBands Strategy] 获取到的数据为空或数据量不足以计算布林带。")
-            return None
-            
-        logger.info(f"[BBands Strategy] 数据获取成功，共 {len(fund_nav_df)} 条记录。")
-        return fund_nav_df
-        
-    except Exception as e:
-        logger.error(f"[BBands Strategy] 获取基金 {fund_symbol} 数据时发生错误: {e}")
+    # 优先读取本地 fund_nav_history，本地没有该基金时才回退到网络
+    fund_nav_df = nav_source.get_nav_dataframe(fund_symbol, days=200)
+
+    if fund_nav_df is None or fund_nav_df.empty or len(fund_nav_df) < BBANDS_PERIOD + 1:
+        logger.warning(f"[BBands Strategy] 获取到的数据为空或数据量不足以计算布林带。")
         return None
 
+    logger.info(f"[BBands Strategy] 数据获取成功，共 {len(fund_nav_df)} 条记录。")
+    return fund_nav_df
+
 def calculate_bollinger_bands(data: pd.DataFrame, period: int, dev_factor: float) -> pd.DataFrame:
     """使用 pandas 手动计算布林带指标。"""
     data['bband_mid'] = data['close'].rolling(window=period).mean()
@@ -59,7 +46,14 @@ def run_strategy(fund_code: str, is_holding: bool) -> Dict[str, Any]:
     if df is None:
         return {"error": f"无法获取基金 {fund_code} 的数据。"}
 
-    df_with_bbands = calculate_bollinger_bands(df, period=BBANDS_PERIOD, dev_factor=BBANDS_DEV_FACTOR)
+    # 优先使用同步后预计算的指标，尚未计算时现场计算
+    df_with_bbands = indicators.attach_indicators(fund_code, df, {
+        'bband_mid': indicators.ma_key(BBANDS_PERIOD),
+        'bband_upper': indicators.bbands_key('upper', BBANDS_PERIOD, BBANDS_DEV_FACTOR),
+        'bband_lower': indicators.bbands_key('lower', BBANDS_PERIOD, BBANDS_DEV_FACTOR),
+    })
+    if df_with_bbands is None:
+        df_with_bbands = calculate_bollinger_bands(df, period=BBANDS_PERIOD, dev_factor=BBANDS_DEV_FACTOR)
     
     latest_data = df_with_bbands.iloc[-1]
     latest_date = latest_data.name.date()
@@ -1,11 +1,11 @@
 # src/python_cli_starter/strategies/dual_confirmation_strategy.py
 
-import akshare as ak
 import pandas as pd
-from datetime import datetime, timedelta
 import logging
 from typing import Dict, Any
 
+from .. import nav_source, indicators
+
 logger = logging.getLogger(__name__)
 
 # --- 策略常量 ---
@@ -14,31 +14,19 @@ RSI_PERIOD = 14
 RSI_LOWER = 30.0
 
 def get_latest_fund_data(fund_symbol: str) -> pd.DataFrame:
-    """获取基金最近200天的净值数据"""
+    """获取基金的全部历史净值数据"""
     logger.info(f"[Dual Confirm Strategy] 正在为基金 {fund_symbol} 获取最新净值数据...")
-    start_date = (datetime.today() - timedelta(days=200)).strftime('%Y%m%d')
-    
-    try:
-        fund_nav_df = ak.fund_open_fund_info_em(symbol=fund_symbol, indicator="单位净值走势")
-        fund_nav_df['净值日期'] = pd.to_datetime(fund_nav_df['净值日期'])
-        fund_nav_df = fund_nav_df.set_index('净值日期')
-        fund_nav_df = fund_nav_df[['单位净值']]
-        fund_nav_df.columns = ['close']
-        fund_nav_df['close'] = pd.to_numeric(fund_nav_df['close'])
-        
-        fund_nav_df = fund_nav_df[fund_nav_df.index >= start_date].sort_index(ascending=True)
-        
-        if fund_nav_df.empty or len(fund_nav_df) < TREND_MA_PERIOD + 1:
-            logger.warning(f"[Dual Confirm Strategy] 获取到的数据为空或数据量不足。")
-            return None
-            
-        logger.info(f"[Dual Confirm Strategy] 数据获取成功，共 {len(fund_nav_df)} 条记录。")
-        return fund_nav_df
-        
-    except Exception as e:
-        logger.error(f"[Dual Confirm Strategy] 获取基金 {fund_symbol} 数据时发生错误: {e}")
+    # RSI 是递推指标，结果取决于起点：读取全部历史，现场计算时与预计算的指标一样从第一条净值开始递推。
+    # 优先读取本地 fund_nav_history，本地没有该基金时才回退到网络
+    fund_nav_df = nav_source.get_nav_dataframe(fund_symbol)
+
+    if fund_nav_df is None or fund_nav_df.empty or len(fund_nav_df) < TREND_MA_PERIOD + 1:
+        logger.warning(f"[Dual Confirm Strategy] 获取到的数据为空或数据量不足。")
         return None
 
+    logger.info(f"[Dual Confirm Strategy] 数据获取成功，共 {len(fund_nav_df)} 条记录。")
+    return fund_nav_df
+
 def calculate_indicators(data: pd.DataFrame, trend_period: int, rsi_period: int) -> pd.DataFrame:
     """计算趋势均线和RSI。"""
     data['trend_ma'] = data['close'].rolling(window=trend_period).mean()
@@ -57,7 +45,12 @@ def run_strategy(fund_code: str, is_holding: bool) -> Dict[str, Any]:
     if df is None:
         return {"error": f"无法获取基金 {fund_code} 的数据。"}
 
-    df_with_indicators = calculate_indicators(df, trend_period=TREND_MA_PERIOD, rsi_period=RSI_PERIOD)
+    # 优先使用同步后预计算的指标 (决策只用到最后一天)，尚未计算时在全部历史上现场计算
+    df_with_indicators = indicators.attach_indicators(fund_code, df.iloc[-1:], {
+        'trend_ma': indicators.ma_key(TREND_MA_PERIOD), 'rsi': indicators.rsi_key(RSI_PERIOD),
+    })
+    if df_with_indicators is None:
+        df_with_indicators = calculate_indicators(df, trend_period=TREND_MA_PERIOD, rsi_period=RSI_PERIOD)
     
     latest_data = df_with_indicators.iloc[-1]
     latest_date = latest_data.name.date()
@@ -1,11 +1,11 @@
 # src/python_cli_starter/strategies/macd_strategy.py
 
-import akshare as ak
 import pandas as pd
-from datetime import datetime, timedelta
 import logging
 from typing import Dict, Any
 
+from .. import nav_source, indicators
+
 logger = logging.getLogger(__name__)
 
 # --- 策略常量 ---
@@ -14,32 +14,19 @@ MACD_LONG_PERIOD = 26
 MACD_SIGNAL_PERIOD = 9
 
 def get_latest_fund_data(fund_symbol: str) -> pd.DataFrame:
-    """获取基金最近150天的净值数据"""
+    """获取基金的全部历史净值数据"""
     logger.info(f"[MACD Strategy] 正在为基金 {fund_symbol} 获取最新净值数据...")
-    # 缓冲期设为150天，足够计算26周期的EMA
-    start_date = (datetime.today() - timedelta(days=150)).strftime('%Y%m%d')
-    
-    try:
-        fund_nav_df = ak.fund_open_fund_info_em(symbol=fund_symbol, indicator="单位净值走势")
-        fund_nav_df['净值日期'] = pd.to_datetime(fund_nav_df['净值日期'])
-        fund_nav_df = fund_nav_df.set_index('净值日期')
-        fund_nav_df = fund_nav_df[['单位净值']]
-        fund_nav_df.columns = ['close']
-        fund_nav_df['close'] = pd.to_numeric(fund_nav_df['close'])
-        
-        fund_nav_df = fund_nav_df[fund_nav_df.index >= start_date].sort_index(ascending=True)
-        
-        if fund_nav_df.empty or len(fund_nav_df) < MACD_LONG_PERIOD + 2:
-            logger.warning(f"[MACD Strategy] 获取到的数据为空或数据量不足以判断交叉。")
-            return None
-            
-        logger.info(f"[MACD Strategy] 数据获取成功，共 {len(fund_nav_df)} 条记录。")
-        return fund_nav_df
-        
-    except Exception as e:
-        logger.error(f"[MACD Strategy] 获取基金 {fund_symbol} 数据时发生错误: {e}")
+    # EMA 是递推指标，结果取决于起点：读取全部历史，现场计算时与预计算的指标一样从第一条净值开始递推。
+    # 优先读取本地 fund_nav_history，本地没有该基金时才回退到网络
+    fund_nav_df = nav_source.get_nav_dataframe(fund_symbol)
+
+    if fund_nav_df is None or fund_nav_df.empty or len(fund_nav_df) < MACD_LONG_PERIOD + 2:
+        logger.warning(f"[MACD Strategy] 获取到的数据为空或数据量不足以判断交叉。")
         return None
 
+    logger.info(f"[MACD Strategy] 数据获取成功，共 {len(fund_nav_df)} 条记录。")
+    return fund_nav_df
+
 def calculate_macd(data: pd.DataFrame, short_period: int, long_period: int, signal_period: int) -> pd.DataFrame:
     """使用 pandas 手动计算MACD指标。"""
     ema_short = data['close'].ewm(span=short_period, adjust=False).mean()
@@ -55,10 +42,18 @@ def run_strategy(fund_code: str, is_holding: bool) -> Dict[str, Any]:
     if df is None:
         return {"error": f"无法获取基金 {fund_code} 的数据。"}
 
-    df_with_macd = calculate_macd(df, 
-                                  short_period=MACD_SHORT_PERIOD, 
-                                  long_period=MACD_LONG_PERIOD, 
-                                  signal_period=MACD_SIGNAL_PERIOD)
+    # 优先使用同步后预计算的指标 (判断交叉只用到最后两天)，尚未计算时在全部历史上现场计算
+    periods = (MACD_SHORT_PERIOD, MACD_LONG_PERIOD, MACD_SIGNAL_PERIOD)
+    df_with_macd = indicators.attach_indicators(fund_code, df.iloc[-2:], {
+        'macd': indicators.macd_key('dif', *periods),
+        'macd_signal': indicators.macd_key('dea', *periods),
+        'macd_hist': indicators.macd_key('hist', *periods),
+    })
+    if df_with_macd is None:
+        df_with_macd = calculate_macd(df, 
+                                      short_period=MACD_SHORT_PERIOD, 
+                                      long_period=MACD_LONG_PERIOD, 
+                                      signal_period=MACD_SIGNAL_PERIOD)
     
     latest_data = df_with_macd.iloc[-1]
     previous_data = df_with_macd.iloc[-2]
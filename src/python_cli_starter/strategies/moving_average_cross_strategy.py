@@ -1,11 +1,11 @@
 # src/python_cli_starter/strategies/moving_average_cross_strategy.py
 
-import akshare as ak
 import pandas as pd
-from datetime import datetime, timedelta
 import logging
 from typing import Dict, Any
 
+from .. import nav_source, indicators
+
 logger = logging.getLogger(__name__)
 
 # --- 策略常量 ---
@@ -15,29 +15,16 @@ SLOW_MA_PERIOD = 60
 def get_latest_fund_data(fund_symbol: str) -> pd.DataFrame:
     """获取基金最近150天的净值数据"""
     logger.info(f"[MA Cross Strategy] 正在为基金 {fund_symbol} 获取最新净值数据...")
-    start_date = (datetime.today() - timedelta(days=150)).strftime('%Y%m%d')
-    
-    try:
-        fund_nav_df = ak.fund_open_fund_info_em(symbol=fund_symbol, indicator="单位净值走势")
-        fund_nav_df['净值日期'] = pd.to_datetime(fund_nav_df['净值日期'])
-        fund_nav_df = fund_nav_df.set_index('净值日期')
-        fund_nav_df = fund_nav_df[['单位净值']]
-        fund_nav_df.columns = ['close']
-        fund_nav_df['close'] = pd.to_numeric(fund_nav_df['close'])
-        
-        fund_nav_df = fund_nav_df[fund_nav_df.index >= start_date].sort_index(ascending=True)
-        
-        if fund_nav_df.empty or len(fund_nav_df) < SLOW_MA_PERIOD + 2:
-            logger.warning(f"[MA Cross Strategy] 获取到的数据为空或数据量不足以判断交叉。")
-            return None
-            
-        logger.info(f"[MA Cross Strategy] 数据获取成功，共 {len(fund_nav_df)} 条记录。")
-        return fund_nav_df
-        
-    except Exception as e:
-        logger.error(f"[MA Cross Strategy] 获取基金 {fund_symbol} 数据时发生错误: {e}")
+    # 优先读取本地 fund_nav_history，本地没有该基金时才回退到网络
+    fund_nav_df = nav_source.get_nav_dataframe(fund_symbol, days=150)
+
+    if fund_nav_df is None or fund_nav_df.empty or len(fund_nav_df) < SLOW_MA_PERIOD + 2:
+        logger.warning(f"[MA Cross Strategy] 获取到的数据为空或数据量不足以判断交叉。")
         return None
 
+    logger.info(f"[MA Cross Strategy] 数据获取成功，共 {len(fund_nav_df)} 条记录。")
+    return fund_nav_df
+
 def calculate_moving_averages(data: pd.DataFrame, fast_period: int, slow_period: int) -> pd.DataFrame:
     """计算快线和慢线。"""
     data['fast_ma'] = data['close'].rolling(window=fast_period).mean()
@@ -50,7 +37,12 @@ def run_strategy(fund_code: str, is_holding: bool) -> Dict[str, Any]:
     if df is None:
         return {"error": f"无法获取基金 {fund_code} 的数据。"}
 
-    df_with_ma = calculate_moving_averages(df, fast_period=FAST_MA_PERIOD, slow_period=SLOW_MA_PERIOD)
+    # 优先使用同步后预计算的指标，尚未计算时现场计算
+    df_with_ma = indicators.attach_indicators(fund_code, df, {
+        'fast_ma': indicators.ma_key(FAST_MA_PERIOD), 'slow_ma': indicators.ma_key(SLOW_MA_PERIOD),
+    })
+    if df_with_ma is None:
+        df_with_ma = calculate_moving_averages(df, fast_period=FAST_MA_PERIOD, slow_period=SLOW_MA_PERIOD)
     
     latest_data = df_with_ma.iloc[-1]
     previous_data = df_with_ma.iloc[-2]
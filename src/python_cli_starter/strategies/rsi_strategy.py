@@ -1,10 +1,10 @@
 # src/python_cli_starter/strategies/rsi_strategy.py
 
-import akshare as ak
 import pandas as pd
-from datetime import datetime, timedelta
 import logging
 
+from .. import nav_source, indicators
+
 logger = logging.getLogger(__name__)
 
 # --- 策略常量 ---
@@ -13,33 +13,19 @@ RSI_UPPER = 70.0
 RSI_LOWER = 30.0
 
 def get_latest_fund_data(fund_symbol: str):
-    """获取基金最近100天的净值数据"""
+    """获取基金的全部历史净值数据"""
     logger.info(f"[RSI Strategy] 正在为基金 {fund_symbol} 获取最新净值数据...")
-    start_date = (datetime.today() - timedelta(days=100)).strftime('%Y%m%d')
-    
-    try:
-        # 使用 akshare 获取数据
-        fund_nav_df = ak.fund_open_fund_info_em(symbol=fund_symbol, indicator="单位净值走势")
-        fund_nav_df['净值日期'] = pd.to_datetime(fund_nav_df['净值日期'])
-        fund_nav_df = fund_nav_df.set_index('净值日期')
-        fund_nav_df = fund_nav_df[['单位净值']]
-        fund_nav_df.columns = ['close']
-        fund_nav_df['close'] = pd.to_numeric(fund_nav_df['close'])
-        
-        # 筛选日期并按日期升序排序
-        fund_nav_df = fund_nav_df[fund_nav_df.index >= start_date].sort_index(ascending=True)
-        
-        if fund_nav_df.empty or len(fund_nav_df) < RSI_PERIOD + 1:
-            logger.warning(f"[RSI Strategy] 获取到的数据为空或数据量不足以计算RSI。")
-            return None
-            
-        logger.info(f"[RSI Strategy] 数据获取成功，共 {len(fund_nav_df)} 条记录。")
-        return fund_nav_df
-        
-    except Exception as e:
-        logger.error(f"[RSI Strategy] 获取基金 {fund_symbol} 数据时发生错误: {e}")
+    # RSI 是递推指标，结果取决于起点：读取全部历史，现场计算时与预计算的指标一样从第一条净值开始递推。
+    # 优先读取本地 fund_nav_history，本地没有该基金时才回退到网络
+    fund_nav_df = nav_source.get_nav_dataframe(fund_symbol)
+
+    if fund_nav_df is None or fund_nav_df.empty or len(fund_nav_df) < RSI_PERIOD + 1:
+        logger.warning(f"[RSI Strategy] 获取到的数据为空或数据量不足以计算RSI。")
         return None
 
+    logger.info(f"[RSI Strategy] 数据获取成功，共 {len(fund_nav_df)} 条记录。")
+    return fund_nav_df
+
 def calculate_rsi(data: pd.DataFrame, period: int) -> pd.DataFrame:
     """使用 pandas 手动计算 RSI 指标。"""
     delta = data['close'].diff()
@@ -65,7 +51,10 @@ def run_strategy(fund_code: str) -> dict:
     if df is None:
         return {"error": f"无法获取基金 {fund_code} 的数据。"}
 
-    df_with_rsi = calculate_rsi(df, period=RSI_PERIOD)
+    # 优先使用同步后预计算的指标 (决策只用到最后一天)，尚未计算时在全部历史上现场计算
+    df_with_rsi = indicators.attach_indicators(fund_code, df.iloc[-1:], {'rsi': indicators.rsi_key(RSI_PERIOD)})
+    if df_with_rsi is None:
+        df_with_rsi = calculate_rsi(df, period=RSI_PERIOD)
     
     # 提取最新的数据
     latest_data = df_with_rsi.iloc[-1]
@@ -0,0 +1,359 @@
+# src/python_cli_starter/sync_pipeline.py
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Dict, Any, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from .models import SessionLocal
+from . import crud, rate_limiter
+from .nav_cache import nav_cache
+from .data_fetcher import iter_fund_history_pages, HistoryFetchError
+
+logger = logging.getLogger(__name__)
+
+# 同时抓取历史净值的基金数 (抓取线程数)
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "4"))
+# 写库线程每攒够多少行提交一次；回填时也作为抓取线程向写库线程投递的批大小
+NAV_WRITE_BATCH_SIZE = int(os.getenv("NAV_WRITE_BATCH_SIZE", "2000"))
+# 写库线程空闲多久 (秒) 后把手头不足一批的数据先写掉
+WRITER_IDLE_FLUSH_SECONDS = 0.5
+# 多节点同步时本节点的标识，以及领取基金的租约时长 (秒)。租约在处理期间会自动续期，
+# 节点崩溃后其领取的基金在租约过期后由其他节点接手
+SYNC_NODE_ID = os.getenv("SYNC_NODE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+SYNC_LEASE_SECONDS = float(os.getenv("SYNC_LEASE_SECONDS", "120"))
+
+
+def parse_nav_records(code: str, records: list, after_date: Optional[date] = None) -> List[Dict[str, Any]]:
+    """把一页 lsjz 原始记录解析为待写入的字典行，跳过 after_date 及之前的日期和无效记录。"""
+    nav_rows = []
+    for record in records:
+        nav_date = date.fromisoformat(record['FSRQ'])
+        if after_date and nav_date <= after_date:
+            continue
+        try:
+            float(record['JZZZL'])
+        except (ValueError, TypeError):
+            logger.warning(f"跳过无效记录: 基金 {code}, 日期 {nav_date}, 净值 {record['DWJZ']}, 涨跌幅 {record['JZZZL']}")
+            continue
+        nav_rows.append({'code': code, 'nav_date': nav_date, 'nav': float(record['DWJZ'])})
+    return nav_rows
+
+
+@dataclass
+class FundSyncTask:
+    code: str
+    latest_date: Optional[date] = None  # 数据库中已有的最新净值日期，None 表示需要全量回填
+
+
+@dataclass
+class FundSyncResult:
+    code: str
+    status: str = "pending"  # updated / unchanged / failed
+    rows_written: int = 0
+    last_page: int = 0  # 已写入数据库的最后一页 (按日期升序计数)
+    error: Optional[str] = None
+
+
+@dataclass
+class SyncReport:
+    results: Dict[str, FundSyncResult] = field(default_factory=dict)
+    elapsed_seconds: float = 0.0
+    run_id: Optional[int] = None
+
+    def _count(self, status: str) -> int:
+        return sum(1 for result in self.results.values() if result.status == status)
+
+    @property
+    def funds_total(self) -> int:
+        return len(self.results)
+
+    @property
+    def funds_updated(self) -> int:
+        return self._count("updated")
+
+    @property
+    def funds_failed(self) -> int:
+        return self._count("failed")
+
+    @property
+    def rows_written(self) -> int:
+        return sum(result.rows_written for result in self.results.values())
+
+    @property
+    def updated_codes(self) -> List[str]:
+        return [code for code, result in self.results.items() if result.rows_written > 0]
+
+    @property
+    def funds_per_second(self) -> float:
+        return self.funds_total / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows_written / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    def summary(self) -> str:
+        return (f"共 {self.funds_total} 只基金 (更新 {self.funds_updated}，无新数据 {self._count('unchanged')}，"
+                f"失败 {self.funds_failed})，写入 {self.rows_written} 行，耗时 {self.elapsed_seconds:.2f} 秒，"
+                f"吞吐 {self.funds_per_second:.2f} 只/秒、{self.rows_per_second:.1f} 行/秒。")
+
+
+class SyncJobQueue:
+    """
+    以 sync_run_items 表为任务队列，为流水线按需领取基金 (FOR UPDATE SKIP LOCKED)。
+    多个节点 (容器) 对同一个任务各自运行流水线时，领取到的基金互不重叠。
+    只应在写库线程中使用，与写库线程共用同一个会话。
+    """
+
+    def __init__(self, db: Session, run_id: int, target_date: Optional[date] = None,
+                 node_id: str = SYNC_NODE_ID, lease_seconds: float = SYNC_LEASE_SECONDS):
+        self.db = db
+        self.run_id = run_id
+        self.target_date = target_date
+        self.node_id = node_id
+        self.lease_seconds = lease_seconds
+        self.claimed_count = 0
+        self.skipped_count = 0
+
+    def claim(self, limit: int) -> List[FundSyncTask]:
+        """领取最多 limit 只需要同步的基金；已有 target_date 净值的基金直接记为完成。队列为空时返回空列表。"""
+        while True:
+            codes = crud.claim_sync_items(self.db, self.run_id, self.node_id, limit, self.lease_seconds)
+            if not codes:
+                self.db.commit()
+                return []
+            self.claimed_count += len(codes)
+
+            latest_navs = crud.get_latest_navs(self.db, codes)
+            tasks, up_to_date = [], []
+            for code in codes:
+                latest_date = latest_navs[code][0] if code in latest_navs else None
+                # 已有最近一个交易日净值的基金不会有新数据，直接跳过，不发起任何网络请求
+                if latest_date is not None and self.target_date is not None and latest_date >= self.target_date:
+                    up_to_date.append(code)
+                else:
+                    tasks.append(FundSyncTask(code=code, latest_date=latest_date))
+            if up_to_date:
+                crud.checkpoint_sync_items(self.db, self.run_id, [
+                    {'code': code, 'status': "done", 'rows': 0, 'last_page': 0, 'error': None} for code in up_to_date
+                ])
+                self.skipped_count += len(up_to_date)
+            self.db.commit()
+            if tasks:
+                return tasks
+
+    def renew(self, codes: List[str]):
+        """为仍在处理的基金续租。"""
+        crud.renew_sync_leases(self.db, self.run_id, self.node_id, codes, self.lease_seconds)
+        self.db.commit()
+
+
+_FUND_DONE = "done"
+_FUND_ROWS = "rows"
+
+
+class NavSyncPipeline:
+    """
+    历史净值同步流水线：
+    - 多个抓取线程各自领取基金，流式获取新净值并解析成行，投递到有界队列；
+    - 调用 run() 的线程作为唯一的写库线程，把多只基金的行攒成批次统一写入并提交。
+    单只基金抓取或写库失败只影响这只基金，不会回滚其他基金已写入的数据。
+    指定 run_id 时，每只基金的进度会与净值数据在同一事务中写入 sync_run_items，任务中断后可据此续跑。
+    """
+
+    def __init__(self, workers: Optional[int] = None, batch_size: Optional[int] = None, run_id: Optional[int] = None):
+        self.workers = max(1, workers or SYNC_WORKERS)
+        self.batch_size = max(1, batch_size or NAV_WRITE_BATCH_SIZE)
+        self.run_id = run_id
+        self._queue: queue.Queue = queue.Queue(maxsize=self.workers * 4)
+        self._stop = threading.Event()
+        self._write_failed: Set[str] = set()
+
+    # --- 抓取线程 ---
+    def _fetch_fund(self, task: FundSyncTask):
+        # 按吞吐目标控制开始同步基金的速度，关注列表有几千只基金时也不会一下子把请求全部压给接口
+        rate_limiter.get_limiter("sync_funds").acquire()
+        if self._stop.is_set():
+            return
+        error = None
+        page_no = 0
+        pending_rows = []
+        start_date = (task.latest_date + timedelta(days=1)).strftime('%Y-%m-%d') if task.latest_date else None
+        try:
+            for page in iter_fund_history_pages(task.code, start_date=start_date):
+                page_no += 1
+                pending_rows.extend(parse_nav_records(task.code, page, after_date=task.latest_date))
+                if len(pending_rows) >= self.batch_size:
+                    if not self._put((_FUND_ROWS, task.code, (pending_rows, page_no))):
+                        return
+                    pending_rows = []
+        except HistoryFetchError as e:
+            error = str(e)
+        except Exception as e:
+            logger.exception(f"抓取基金 {task.code} 的历史净值时发生未知错误。")
+            error = f"{type(e).__name__}: {e}"
+        # 页面按日期升序产出，即使中途失败，已拿到的部分也是连续的，可以安全写入
+        if pending_rows and not self._put((_FUND_ROWS, task.code, (pending_rows, page_no))):
+            return
+        self._put((_FUND_DONE, task.code, error))
+
+    def _put(self, item) -> bool:
+        """向写库队列投递；写库线程已退出时放弃投递并返回 False，避免抓取线程永久阻塞。"""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=WRITER_IDLE_FLUSH_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    # --- 写库线程 ---
+    def _progress(self, code: str, status: str, rows: int, last_page: int, error: Optional[str] = None) -> Dict[str, Any]:
+        return {'code': code, 'status': status, 'rows': rows, 'last_page': last_page, 'error': error}
+
+    def _write_rows(self, db: Session, groups: Dict[str, List[Dict[str, Any]]], batch_pages: Dict[str, int]):
+        """写入若干只基金的行，并在同一事务中记录它们的进度后提交。"""
+        crud.upsert_nav_history(db, [row for rows in groups.values() for row in rows])
+        if self.run_id is not None:
+            crud.checkpoint_sync_items(db, self.run_id, [
+                self._progress(code, "running", len(rows), batch_pages.get(code, 0)) for code, rows in groups.items()
+            ])
+        db.commit()
+
+    def _write_batch(self, db: Session, batch: List[Dict[str, Any]], batch_pages: Dict[str, int],
+                     results: Dict[str, FundSyncResult]):
+        """写入一批 (可能跨多只基金的) 行；整批失败时按基金拆开重试，只让出错的基金失败。"""
+        groups: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for row in batch:
+            # 某只基金一旦写库失败就丢弃它后续的行，避免库里出现中间缺失的日期 (下次增量同步会从最新日期之后开始)
+            if row['code'] not in self._write_failed:
+                groups[row['code']].append(row)
+        if not groups:
+            return
+
+        try:
+            self._write_rows(db, groups, batch_pages)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"批量写入 {len(batch)} 行失败，改为按基金逐个写入: {e}")
+            for code, rows in list(groups.items()):
+                try:
+                    self._write_rows(db, {code: rows}, batch_pages)
+                except Exception as fund_error:
+                    db.rollback()
+                    logger.error(f"写入基金 {code} 的 {len(rows)} 行净值失败: {fund_error}")
+                    results[code].status = "failed"
+                    results[code].error = f"写库失败: {fund_error}"
+                    self._write_failed.add(code)
+                    del groups[code]
+
+        for code, rows in groups.items():
+            results[code].rows_written += len(rows)
+            results[code].last_page = max(results[code].last_page, batch_pages.get(code, 0))
+            nav_cache.append(code, [row['nav_date'] for row in rows], [row['nav'] for row in rows])
+
+    def _finish(self, db: Session, results: List[FundSyncResult]):
+        """确认一组已抓取完毕且数据已落库的基金的最终状态。"""
+        for result in results:
+            if result.status == "pending":
+                result.status = "updated" if result.rows_written else "unchanged"
+            if result.status == "failed":
+                logger.warning(f"基金 {result.code} 同步失败 (已写入 {result.rows_written} 行): {result.error}")
+            elif result.rows_written:
+                logger.info(f"基金 {result.code} 的历史净值更新成功，共写入 {result.rows_written} 条新记录。")
+        if self.run_id is not None and results:
+            try:
+                crud.checkpoint_sync_items(db, self.run_id, [
+                    self._progress(r.code, "failed" if r.status == "failed" else "done", 0, r.last_page, r.error)
+                    for r in results
+                ])
+                db.commit()
+            except Exception as e:
+                # 只是进度没记下来，续跑时这些基金会从数据库中的最新日期重新同步，不影响数据正确性
+                db.rollback()
+                logger.warning(f"记录 {len(results)} 只基金的同步进度失败: {e}")
+
+    def run(self, tasks: Optional[List[FundSyncTask]] = None, db: Optional[Session] = None,
+            job_queue: Optional[SyncJobQueue] = None) -> SyncReport:
+        """
+        并发抓取基金并写库，阻塞直到全部完成，返回逐只基金的结果和吞吐统计。
+        基金来自 tasks，以及 (指定 job_queue 时) 在运行过程中从队列按需领取，直到队列为空。
+        """
+        report = SyncReport(run_id=self.run_id)
+        if not tasks and job_queue is None:
+            return report
+
+        started_at = time.perf_counter()
+        own_session = db is None
+        db = db or SessionLocal()
+        self._stop.clear()
+        self._write_failed = set()
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="nav-sync")
+        in_flight: Set[str] = set()
+
+        def submit(new_tasks: List[FundSyncTask]):
+            for task in new_tasks:
+                report.results[task.code] = FundSyncResult(code=task.code)
+                in_flight.add(task.code)
+                executor.submit(self._fetch_fund, task)
+
+        try:
+            submit(tasks or [])
+            queue_exhausted = job_queue is None
+            last_renewed_at = time.monotonic()
+
+            batch: List[Dict[str, Any]] = []
+            batch_pages: Dict[str, int] = {}
+            finished: List[str] = []  # 已抓取完毕、等待其数据所在批次落库后再确认状态的基金
+            while True:
+                # 保持每个抓取线程手头都有基金可做，同时不一次领取过多，让其他节点也能分到
+                if not queue_exhausted and len(in_flight) < self.workers * 2:
+                    claimed = job_queue.claim(self.workers * 2 - len(in_flight))
+                    queue_exhausted = not claimed
+                    submit(claimed)
+                if not in_flight and not batch and not finished:
+                    break
+
+                try:
+                    kind, code, payload = self._queue.get(timeout=WRITER_IDLE_FLUSH_SECONDS)
+                except queue.Empty:
+                    kind = None
+                if kind == _FUND_ROWS:
+                    rows, batch_pages[code] = payload
+                    batch.extend(rows)
+                elif kind == _FUND_DONE:
+                    in_flight.discard(code)
+                    finished.append(code)
+                    if payload:
+                        report.results[code].status = "failed"
+                        report.results[code].error = payload
+
+                # 攒够一批、队列暂时空闲或全部抓取结束时落库
+                if batch and (len(batch) >= self.batch_size or kind is None or not in_flight):
+                    self._write_batch(db, batch, batch_pages, report.results)
+                    batch = []
+                    batch_pages = {}
+                if not batch and finished:
+                    self._finish(db, [report.results[done_code] for done_code in finished])
+                    finished = []
+
+                if job_queue is not None and in_flight and time.monotonic() - last_renewed_at > job_queue.lease_seconds / 3:
+                    job_queue.renew(list(in_flight))
+                    last_renewed_at = time.monotonic()
+        finally:
+            self._stop.set()
+            executor.shutdown(wait=True)
+            if own_session:
+                db.close()
+
+        report.elapsed_seconds = time.perf_counter() - started_at
+        logger.info(f"历史净值同步流水线完成: {report.summary()}")
+        return report
@@ -0,0 +1,138 @@
+# src/python_cli_starter/trading_calendar.py
+import bisect
+import logging
+import threading
+from datetime import date, datetime, timedelta, time as dtime
+from typing import List, Optional
+
+from sqlalchemy import select, delete, insert, func
+
+from .models import SessionLocal, TradeCalendar
+from . import rate_limiter
+from .data_fetcher import CHINA_TZ
+
+logger = logging.getLogger(__name__)
+
+# A 股 (场内基金估值随之变动) 的连续竞价时段
+MORNING_SESSION = (dtime(9, 30), dtime(11, 30))
+AFTERNOON_SESSION = (dtime(13, 0), dtime(15, 0))
+# 刷新 trade_calendar 表时使用的事务级咨询锁编号，多个进程同时刷新时只有一个会下载并重写日历
+CALENDAR_REFRESH_LOCK_KEY = 0x63616C65
+
+
+class TradingCalendar:
+    """
+    中国 A 股交易日历。
+    交易日列表保存在本地 trade_calendar 表中，进程内再缓存一份 (每天最多重新读一次表)；
+    只有表为空或查询日期超出已知范围 (例如跨年后新浪发布了新一年的日历) 时，
+    才通过 akshare 重新下载 (多个进程同时刷新时由咨询锁串行化，只有一个进程下载)。
+    下载失败时退化为"周一至周五都是交易日"，当天不再重试下载。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._trade_dates: List[date] = []  # 升序
+        self._checked_on: Optional[date] = None
+
+    def _download(self) -> List[date]:
+        import akshare as ak  # akshare 导入较慢，只在需要刷新日历时加载
+
+        rate_limiter.get_limiter("akshare").acquire()
+        df = ak.tool_trade_date_hist_sina()
+        trade_dates = sorted({d if isinstance(d, date) else date.fromisoformat(str(d)[:10]) for d in df['trade_date']})
+        if not trade_dates:
+            raise ValueError("交易日历为空")
+        return trade_dates
+
+    def _refresh(self, day: date):
+        with SessionLocal() as db:
+            # 先拿到咨询锁再读表：其他进程正在刷新时等它提交，随后直接使用它写入的日历
+            db.execute(select(func.pg_advisory_xact_lock(CALENDAR_REFRESH_LOCK_KEY)))
+            trade_dates = list(db.execute(select(TradeCalendar.trade_date).order_by(TradeCalendar.trade_date)).scalars())
+            if trade_dates and day <= trade_dates[-1]:
+                self._trade_dates = trade_dates
+                return
+
+            try:
+                downloaded = self._download()
+            except Exception as e:
+                logger.warning(f"下载交易日历失败，超出本地日历范围的日期将按周一至周五判断: {e}")
+                self._trade_dates = trade_dates
+                return
+
+            db.execute(delete(TradeCalendar))
+            db.execute(insert(TradeCalendar), [{"trade_date": d} for d in downloaded])
+            db.commit()
+            self._trade_dates = downloaded
+            logger.info(f"已更新本地交易日历，共 {len(downloaded)} 个交易日，最晚到 {downloaded[-1]}。")
+
+    def _ensure_loaded(self, day: date):
+        # 进程内的日历能覆盖查询日期时直接使用；否则每天 (北京时间) 最多成功刷新一次，
+        # 读写数据库失败时不记录，下次查询时重试
+        with self._lock:
+            if self._trade_dates and day <= self._trade_dates[-1]:
+                return
+            today = now_in_china().date()
+            if self._checked_on == today:
+                return
+            try:
+                self._refresh(day)
+            except Exception as e:
+                logger.warning(f"读取交易日历失败，本次将按周一至周五判断交易日: {e}")
+                return
+            self._checked_on = today
+
+    def _covers(self, day: date) -> bool:
+        return bool(self._trade_dates) and self._trade_dates[0] <= day <= self._trade_dates[-1]
+
+    def is_trading_day(self, day: date) -> bool:
+        self._ensure_loaded(day)
+        if self._covers(day):
+            index = bisect.bisect_left(self._trade_dates, day)
+            return self._trade_dates[index] == day
+        return day.weekday() < 5
+
+    def last_trading_day(self, day: date) -> date:
+        """返回不晚于 day 的最近一个交易日。"""
+        self._ensure_loaded(day)
+        if self._covers(day):
+            return self._trade_dates[bisect.bisect_right(self._trade_dates, day) - 1]
+        while day.weekday() >= 5:
+            day -= timedelta(days=1)
+        return day
+
+
+trading_calendar = TradingCalendar()
+
+
+def now_in_china() -> datetime:
+    return datetime.now(CHINA_TZ)
+
+def is_trading_day(day: Optional[date] = None) -> bool:
+    """判断某天 (默认今天，北京时间) 是否为交易日。"""
+    return trading_calendar.is_trading_day(day or now_in_china().date())
+
+def last_trading_day(day: Optional[date] = None) -> date:
+    """返回不晚于某天 (默认今天，北京时间) 的最近一个交易日。"""
+    return trading_calendar.last_trading_day(day or now_in_china().date())
+
+def latest_published_nav_date(moment: Optional[datetime] = None) -> date:
+    """
+    某一时刻 (默认现在，北京时间) 最新可能已公布的净值日期：
+    收盘 (15:00) 后为当天所在的最近交易日，收盘前为前一个交易日。
+    """
+    moment = moment or now_in_china()
+    day = moment.date()
+    if moment.time() < AFTERNOON_SESSION[1]:
+        day -= timedelta(days=1)
+    return last_trading_day(day)
+
+def in_trading_session(moment: datetime) -> bool:
+    """只按时刻判断是否处于连续竞价时段，不检查交易日。moment 应为北京时间。"""
+    t = moment.time()
+    return any(start <= t <= end for start, end in (MORNING_SESSION, AFTERNOON_SESSION))
+
+def is_trading_time(moment: Optional[datetime] = None) -> bool:
+    """判断某一时刻 (默认现在，北京时间) 是否处于交易日的交易时段。"""
+    moment = moment or now_in_china()
+    return in_trading_session(moment) and is_trading_day(moment.date())
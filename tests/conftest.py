@@ -0,0 +1,61 @@
+# tests/conftest.py
+# 测试需要一个可以随意读写的 PostgreSQL 数据库，通过 TEST_DATABASE_URL 指定；未设置时跳过全部测试。
+# 测试使用独立的 schema (TEST_DB_SCHEMA，默认 fund_test)，每次测试会话开始时重建。
+import os
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    # models 在导入时读取这些环境变量，必须在导入项目模块之前设置
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+    os.environ["DB_SCHEMA"] = os.getenv("TEST_DB_SCHEMA", "fund_test")
+    os.environ.pop("DATABASE_READ_URL", None)
+    os.environ.pop("NAV_ARCHIVE_DIR", None)
+
+
+def pytest_collection_modifyitems(config, items):
+    if TEST_DATABASE_URL:
+        return
+    skip = pytest.mark.skip(reason="未设置 TEST_DATABASE_URL，跳过需要 PostgreSQL 的测试")
+    for item in items:
+        item.add_marker(skip)
+
+
+@pytest.fixture(scope="session")
+def database():
+    from sqlalchemy import text
+    from python_cli_starter import models
+
+    with models.engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {models.DB_SCHEMA} CASCADE"))
+    models.create_db_and_tables()
+    yield models
+    models.engine.dispose()
+
+
+@pytest.fixture
+def db(database):
+    """每个测试一个会话，测试结束后清空全部表和进程内缓存。"""
+    from sqlalchemy import text
+    from python_cli_starter.nav_cache import nav_cache
+
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+        tables = ", ".join(f"{database.DB_SCHEMA}.{table.name}" for table in database.Base.metadata.sorted_tables)
+        with database.engine.begin() as connection:
+            connection.execute(text(f"TRUNCATE {tables} CASCADE"))
+        nav_cache.invalidate()
+
+
+@pytest.fixture
+def nav_archive_dir(tmp_path, monkeypatch):
+    """在临时目录中启用净值归档。"""
+    from python_cli_starter import nav_archive
+
+    monkeypatch.setattr(nav_archive, "NAV_ARCHIVE_DIR", str(tmp_path))
+    return tmp_path
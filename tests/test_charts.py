@@ -0,0 +1,71 @@
+# tests/test_charts.py
+from datetime import date, timedelta
+
+import pytest
+
+from python_cli_starter import charts, crud
+
+
+def _write_navs(db, navs, start=date(2024, 1, 1)):
+    crud.upsert_nav_history(db, [
+        {'code': "000001", 'nav_date': start + timedelta(days=i), 'nav': nav} for i, nav in enumerate(navs)
+    ], update_existing=True)
+    db.commit()
+
+
+@pytest.fixture
+def chart_fund(db, monkeypatch):
+    monkeypatch.setattr(charts.nav_source, "_touch_watchlist", lambda code: None)
+    charts._chart_states.clear()
+    _write_navs(db, [1 + (i % 7) / 50 for i in range(60)])
+    yield db
+    charts._chart_states.clear()
+
+
+def _refresh():
+    charts.nav_source.nav_cache.invalidate("000001")
+
+
+def test_since_returns_only_new_rows(chart_fund):
+    first = charts.get_rsi_chart_data("000001")
+    _write_navs(chart_fund, [1.3, 1.31], start=date(2024, 3, 1))
+    _refresh()
+
+    delta = charts.get_rsi_chart_data("000001", since=date.fromisoformat(first["latestDate"]),
+                                      version=first["version"])
+    assert delta["reset"] is False
+    assert delta["dates"] == ["2024-03-01", "2024-03-02"]
+    assert delta["version"] != first["version"]
+
+    full = charts.get_rsi_chart_data("000001")
+    assert full["rsiValues"][-2:] == delta["rsiValues"]
+
+
+def test_since_without_version_is_honored(chart_fund):
+    first = charts.get_rsi_chart_data("000001")
+    delta = charts.get_rsi_chart_data("000001", since=date.fromisoformat(first["latestDate"]))
+    assert delta["reset"] is False
+    assert delta["dates"] == []
+
+
+def test_version_is_stable_across_rebuilds(chart_fund):
+    first = charts.get_rsi_chart_data("000001")
+    # 模拟进程重启 / 状态被淘汰
+    charts._chart_states.clear()
+    again = charts.get_rsi_chart_data("000001", since=date.fromisoformat(first["latestDate"]),
+                                      version=first["version"])
+    assert again["reset"] is False
+    assert again["version"] == first["version"]
+
+
+def test_corrected_history_resets_client(chart_fund):
+    first = charts.get_rsi_chart_data("000001")
+    _write_navs(chart_fund, [2.0], start=date(2024, 1, 10))
+    _refresh()
+
+    response = charts.get_rsi_chart_data("000001", since=date.fromisoformat(first["latestDate"]),
+                                         version=first["version"])
+    assert response["reset"] is True
+    assert response["since"] is None
+    assert len(response["dates"]) == 60
+    assert response["netValues"][9] == 2.0
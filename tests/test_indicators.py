@@ -0,0 +1,42 @@
+# tests/test_indicators.py
+import math
+from datetime import date, timedelta
+
+import pytest
+
+from python_cli_starter import crud, indicators, nav_source
+from python_cli_starter.strategies import rsi_strategy, macd_strategy
+
+
+@pytest.fixture
+def fund(db, monkeypatch):
+    monkeypatch.setattr(nav_source, "_touch_watchlist", lambda code: None)
+    monkeypatch.setattr(nav_source, "_load_from_akshare", lambda code: pytest.fail("不应回退到 akshare"))
+    start = date.today() - timedelta(days=400)
+    crud.upsert_nav_history(db, [
+        {'code': "000001", 'nav_date': start + timedelta(days=i), 'nav': round(1 + math.sin(i / 9) / 5 + i / 1000, 4)}
+        for i in range(400)
+    ])
+    db.commit()
+    return db
+
+
+def test_strategies_match_precomputed_indicators(fund):
+    computed_rsi = rsi_strategy.run_strategy("000001")["metrics"]
+    computed_macd = macd_strategy.run_strategy("000001", is_holding=False)["metrics"]
+
+    indicators.refresh_indicators(fund, ["000001"])
+    fund.commit()
+
+    assert rsi_strategy.run_strategy("000001")["metrics"] == computed_rsi
+    assert macd_strategy.run_strategy("000001", is_holding=False)["metrics"] == computed_macd
+
+
+def test_stale_local_data_does_not_fall_back_to_akshare(db, monkeypatch):
+    monkeypatch.setattr(nav_source, "_touch_watchlist", lambda code: None)
+    monkeypatch.setattr(nav_source, "_load_from_akshare", lambda code: pytest.fail("不应回退到 akshare"))
+    crud.upsert_nav_history(db, [{'code': "000001", 'nav_date': date(2020, 1, 2), 'nav': 1.0}])
+    db.commit()
+
+    assert nav_source.get_nav_dataframe("000001", days=150).empty
+    assert len(nav_source.get_nav_dataframe("000001")) == 1
@@ -0,0 +1,42 @@
+# tests/test_nav_archive.py
+from datetime import date, timedelta
+
+import numpy as np
+
+from python_cli_starter import crud, nav_archive
+
+CODE = "000001"
+
+
+def _rows(days, start=0, base=1.0):
+    return [
+        {'code': CODE, 'nav_date': date(2024, 1, 1) + timedelta(days=i), 'nav': round(base + i / 100, 4)}
+        for i in range(start, start + days)
+    ]
+
+
+def test_refresh_appends_new_dates(db, nav_archive_dir):
+    crud.upsert_nav_history(db, _rows(5))
+    assert nav_archive.refresh(db, [CODE]) == 1
+
+    crud.upsert_nav_history(db, _rows(2, start=5))
+    assert nav_archive.refresh(db, [CODE]) == 1
+    series = nav_archive.load_series(CODE)
+    assert len(series) == 7
+    assert series.dates[-1] == np.datetime64(date(2024, 1, 7), "D")
+
+    # 数据库没有变化时不重写归档
+    assert nav_archive.refresh(db, [CODE]) == 0
+
+
+def test_refresh_rebuilds_after_in_place_correction(db, nav_archive_dir):
+    crud.upsert_nav_history(db, _rows(5))
+    nav_archive.refresh(db, [CODE])
+
+    # 只修正归档范围内的净值，行数不变
+    crud.upsert_nav_history(db, [{'code': CODE, 'nav_date': date(2024, 1, 3), 'nav': 2.5}], update_existing=True)
+    assert nav_archive.refresh(db, [CODE]) == 1
+    series = nav_archive.load_series(CODE)
+    assert len(series) == 5
+    assert series.navs[2] == 2.5
+    assert nav_archive.refresh(db, [CODE]) == 0
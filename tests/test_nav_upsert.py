@@ -0,0 +1,49 @@
+# tests/test_nav_upsert.py
+from datetime import date
+
+import pytest
+
+from python_cli_starter import crud, models
+
+CODE = "000001"
+
+
+def _navs(db):
+    nav = models.NavHistory
+    return {d: float(v) for d, v in db.query(nav.nav_date, nav.nav).filter(nav.code == CODE).all()}
+
+
+@pytest.fixture(params=["insert", "copy"])
+def write_path(request, monkeypatch):
+    """分别覆盖多行 INSERT 和 COPY 临时表两条写入路径。"""
+    monkeypatch.setattr(crud, "NAV_COPY_THRESHOLD", 10 ** 9 if request.param == "insert" else 1)
+    return request.param
+
+
+def test_duplicate_keys_in_one_batch_keep_last_row(db, write_path):
+    rows = [
+        {'code': CODE, 'nav_date': date(2024, 1, 1), 'nav': 1.0},
+        {'code': CODE, 'nav_date': date(2024, 1, 2), 'nav': 1.1},
+        {'code': CODE, 'nav_date': date(2024, 1, 1), 'nav': 1.5},
+    ]
+    assert crud.upsert_nav_history(db, rows) == 2
+    assert _navs(db) == {date(2024, 1, 1): 1.5, date(2024, 1, 2): 1.1}
+
+    rows = [
+        {'code': CODE, 'nav_date': date(2024, 1, 2), 'nav': 2.0},
+        {'code': CODE, 'nav_date': date(2024, 1, 2), 'nav': 2.1},
+        {'code': CODE, 'nav_date': date(2024, 1, 3), 'nav': 1.2},
+    ]
+    assert crud.upsert_nav_history(db, rows, update_existing=True) == 2
+    assert _navs(db) == {date(2024, 1, 1): 1.5, date(2024, 1, 2): 2.1, date(2024, 1, 3): 1.2}
+
+
+def test_existing_rows_are_skipped_unless_update_existing(db, write_path):
+    crud.upsert_nav_history(db, [{'code': CODE, 'nav_date': date(2024, 1, 1), 'nav': 1.0}])
+
+    rows = [{'code': CODE, 'nav_date': date(2024, 1, 1), 'nav': 3.0}, {'code': CODE, 'nav_date': date(2024, 1, 2), 'nav': 1.1}]
+    assert crud.upsert_nav_history(db, rows) == 1
+    assert _navs(db)[date(2024, 1, 1)] == 1.0
+
+    assert crud.upsert_nav_history(db, rows, update_existing=True) == 2
+    assert _navs(db) == {date(2024, 1, 1): 3.0, date(2024, 1, 2): 1.1}
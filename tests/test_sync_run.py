@@ -0,0 +1,107 @@
+# tests/test_sync_run.py
+from datetime import timedelta
+
+from sqlalchemy import update, func
+
+from python_cli_starter import crud, models, scheduler
+
+
+def _set_status(db, run_id, code, status, lease_seconds=None):
+    item = models.SyncRunItem
+    lease_until = func.now() + timedelta(seconds=lease_seconds) if lease_seconds is not None else None
+    db.execute(update(item).where(item.run_id == run_id, item.code == code)
+               .values(status=status, claimed_by="node-a" if status == "running" else None, lease_until=lease_until))
+
+
+def _interrupted_run(db):
+    """一次中断的任务：A 完成、B 失败、C 未领取、D 的节点崩溃 (租约已过期)。"""
+    run_id = crud.create_sync_run(db, ["A", "B", "C", "D"])
+    _set_status(db, run_id, "A", "done")
+    _set_status(db, run_id, "B", "failed")
+    _set_status(db, run_id, "D", "running", lease_seconds=-60)
+    db.execute(update(models.SyncRun).where(models.SyncRun.id == run_id)
+               .values(started_at=func.now() - timedelta(hours=1)))
+    db.commit()
+    return run_id
+
+
+def _statuses(db, run_id):
+    item = models.SyncRunItem
+    return dict(db.query(item.code, item.status).filter(item.run_id == run_id).all())
+
+
+def test_claim_takes_pending_and_expired_leases_in_priority_order(db):
+    run_id = crud.create_sync_run(db, ["A", "B", "C", "D", "E"])
+    _set_status(db, run_id, "A", "done")
+    _set_status(db, run_id, "B", "running", lease_seconds=600)
+    _set_status(db, run_id, "C", "running", lease_seconds=-60)
+    db.commit()
+
+    assert crud.claim_sync_items(db, run_id, "node-b", 2, 60) == ["C", "D"]
+    assert crud.claim_sync_items(db, run_id, "node-b", 10, 60) == ["E"]
+    assert crud.claim_sync_items(db, run_id, "node-b", 10, 60) == []
+    assert crud.finish_sync_run(db, run_id) is None
+
+    item = models.SyncRunItem
+    claimed = dict(db.query(item.code, item.claimed_by).filter(item.run_id == run_id, item.status == "running").all())
+    assert claimed == {"B": "node-a", "C": "node-b", "D": "node-b", "E": "node-b"}
+
+
+def test_concurrent_claims_are_disjoint(db):
+    run_id = crud.create_sync_run(db, ["A", "B", "C", "D"])
+    db.commit()
+
+    # 第一个节点的事务尚未提交，第二个节点跳过被锁住的行而不是等待
+    other = models.SessionLocal()
+    try:
+        first = crud.claim_sync_items(db, run_id, "node-a", 2, 60)
+        second = crud.claim_sync_items(other, run_id, "node-b", 10, 60)
+        assert first == ["A", "B"]
+        assert second == ["C", "D"]
+    finally:
+        other.rollback()
+        other.close()
+
+
+def test_requeue_and_finish(db):
+    run_id = crud.create_sync_run(db, ["A", "B", "C"])
+    _set_status(db, run_id, "A", "done")
+    _set_status(db, run_id, "B", "failed")
+    _set_status(db, run_id, "C", "done")
+
+    assert crud.finish_sync_run(db, run_id) == "failed"
+    assert crud.requeue_sync_items(db, run_id, ["failed"]) == 1
+    assert crud.claim_sync_items(db, run_id, "node-a", 10, 60) == ["B"]
+    _set_status(db, run_id, "B", "done")
+    crud.reopen_sync_run(db, run_id)
+    assert crud.finish_sync_run(db, run_id) == "completed"
+    db.commit()
+
+
+def test_only_failed_claims_only_failed_items(db):
+    run_id = _interrupted_run(db)
+
+    assert scheduler._open_sync_run(db, include_watchlist=False, resume=False, only_failed=True) == run_id
+    db.commit()
+
+    assert crud.claim_sync_items(db, run_id, "node-a", 10, 60) == ["B"]
+    # 加入同一任务的其他节点也领取不到暂缓的基金
+    assert crud.claim_sync_items(db, run_id, "node-b", 10, 60) == []
+    assert _statuses(db, run_id) == {"A": "done", "B": "running", "C": "deferred", "D": "deferred"}
+
+    _set_status(db, run_id, "B", "done")
+    assert crud.finish_sync_run(db, run_id) == "failed"
+    db.commit()
+
+
+def test_resume_requeues_failed_and_deferred_items(db):
+    run_id = _interrupted_run(db)
+    scheduler._open_sync_run(db, include_watchlist=False, resume=False, only_failed=True)
+    _set_status(db, run_id, "B", "failed")
+    crud.finish_sync_run(db, run_id)
+    db.commit()
+
+    assert scheduler._open_sync_run(db, include_watchlist=False, resume=True, only_failed=False) == run_id
+    db.commit()
+
+    assert sorted(crud.claim_sync_items(db, run_id, "node-a", 10, 60)) == ["B", "C", "D"]
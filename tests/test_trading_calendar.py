@@ -0,0 +1,46 @@
+# tests/test_trading_calendar.py
+import threading
+import time
+from datetime import date
+
+from python_cli_starter import models
+from python_cli_starter.trading_calendar import TradingCalendar
+
+TRADE_DATES = [date(2024, 1, 2), date(2024, 1, 3), date(2024, 1, 4)]
+
+
+def test_concurrent_refresh_downloads_once(db, monkeypatch):
+    downloads = []
+
+    def slow_download(self):
+        downloads.append(1)
+        time.sleep(0.2)
+        return TRADE_DATES
+
+    monkeypatch.setattr(TradingCalendar, "_download", slow_download)
+    calendars = [TradingCalendar(), TradingCalendar()]
+    threads = [threading.Thread(target=calendar.is_trading_day, args=(date(2024, 1, 3),)) for calendar in calendars]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(downloads) == 1
+    assert all(calendar._trade_dates == TRADE_DATES for calendar in calendars)
+    assert [row.trade_date for row in db.query(models.TradeCalendar).order_by(models.TradeCalendar.trade_date)] == TRADE_DATES
+
+
+def test_failed_refresh_is_retried(db, monkeypatch):
+    calendar = TradingCalendar()
+
+    def broken_refresh(day):
+        raise RuntimeError("数据库不可用")
+
+    monkeypatch.setattr(calendar, "_refresh", broken_refresh)
+    assert calendar.is_trading_day(date(2024, 1, 6)) is False  # 周六，按周一至周五判断
+    assert calendar._checked_on is None
+
+    monkeypatch.setattr(TradingCalendar, "_download", lambda self: TRADE_DATES)
+    monkeypatch.delattr(calendar, "_refresh")
+    assert calendar.is_trading_day(date(2024, 1, 3)) is True
+    assert calendar._checked_on is not None
@@ -0,0 +1,57 @@
+# tests/test_watchlist.py
+from datetime import date, timedelta
+
+from python_cli_starter import crud, models, services, nav_archive, data_fetcher
+from python_cli_starter.nav_cache import NavSeries
+
+
+def _add_holding(db, code):
+    db.add(models.Holding(code=code, name=code, shares=100, yesterday_nav=1, holding_amount=100))
+
+
+def _add_nav(db, code, days=5):
+    crud.upsert_nav_history(db, [
+        {'code': code, 'nav_date': date(2024, 1, 1) + timedelta(days=i), 'nav': 1 + i / 100} for i in range(days)
+    ])
+
+
+def _nav_count(db, code):
+    return db.query(models.NavHistory).filter(models.NavHistory.code == code).count()
+
+
+def _seed(db, nav_archive_dir):
+    """000001 只持有，000002 既持有又关注，000003 只关注。"""
+    _add_holding(db, "000001")
+    _add_holding(db, "000002")
+    crud.add_watchlist_items(db, [{'code': "000002", 'name': None}, {'code': "000003", 'name': None}])
+    for code in ("000001", "000002", "000003"):
+        _add_nav(db, code)
+        nav_archive.write_series(code, NavSeries.from_arrays([date(2024, 1, 1)], [1.0]))
+    db.commit()
+
+
+def test_delete_holding_keeps_history_of_watched_fund(db, nav_archive_dir):
+    _seed(db, nav_archive_dir)
+
+    services.delete_holding_by_code(db, "000002")
+    services.delete_holding_by_code(db, "000001")
+
+    assert crud.get_holding(db, "000002") is None
+    assert _nav_count(db, "000002") == 5
+    assert nav_archive.load_series("000002") is not None
+    assert _nav_count(db, "000001") == 0
+    assert nav_archive.load_series("000001") is None
+
+
+def test_overwrite_import_keeps_history_of_watched_funds(db, nav_archive_dir, monkeypatch):
+    _seed(db, nav_archive_dir)
+    monkeypatch.setattr(data_fetcher, "fetch_fund_realtime_estimates", lambda codes: {})
+
+    services.import_holdings_data(db, [], overwrite=True)
+
+    assert db.query(models.Holding).count() == 0
+    assert _nav_count(db, "000001") == 0
+    assert nav_archive.load_series("000001") is None
+    for code in ("000002", "000003"):
+        assert _nav_count(db, code) == 5
+        assert nav_archive.load_series(code) is not None